@@ -0,0 +1,343 @@
+"""Analítica de tiempos de respuesta de los despachos.
+
+Los despachos se leen por bloques (`db.iter_despacho_tiempos`) y se guardan
+en columnas compactas (`array`): servicio, tiempo de respuesta en minutos
+(`tiempoRespuestaDespacho`, o llegada menos asignación si falta), hora y día
+de la semana de la asignación y calificación. Sobre esas columnas se calculan
+percentiles, medias por servicio, perfiles por hora y día de la semana y la
+distribución de calificaciones; con NumPy instalado el cálculo es vectorial
+(vistas sin copia sobre los `array`), y sin NumPy se hace en una pasada.
+
+El resumen se guarda y se sirve durante `ANALYTICS_TTL` segundos. Al caducar
+solo se leen los despachos nuevos (`idDespacho > último leído`) y los
+modificados o eliminados en este proceso (eventos de `events.bus`); la tabla
+completa se relee cada `ANALYTICS_REBUILD_SECONDS` para incorporar los
+cambios hechos por otros procesos.
+
+Variables de entorno:
+ANALYTICS_TTL, ANALYTICS_REBUILD_SECONDS, ANALYTICS_BATCH
+"""
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+import db
+import events
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+TTL = float(os.getenv('ANALYTICS_TTL', '60'))
+REBUILD_SECONDS = float(os.getenv('ANALYTICS_REBUILD_SECONDS', '3600'))
+BATCH = int(os.getenv('ANALYTICS_BATCH', '5000'))
+
+PERCENTILES = (50, 90, 95, 99)
+DIAS = ('lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo')
+_NAN = float('nan')
+
+
+def _fecha(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _fila(row):
+    """Convierte una tupla de `iter_despacho_tiempos` en los valores de cada columna."""
+    despacho_id, servicio_id, asignacion, llegada, tiempo, calificacion = row
+    asignacion = _fecha(asignacion)
+    llegada = _fecha(llegada)
+    if tiempo is not None:
+        respuesta = float(tiempo)
+    elif asignacion and llegada and llegada >= asignacion:
+        respuesta = (llegada - asignacion).total_seconds() / 60.0
+    else:
+        respuesta = _NAN
+    calificacion = int(calificacion) if calificacion is not None and 1 <= int(calificacion) <= 5 else 0
+    return (
+        despacho_id,
+        servicio_id if servicio_id is not None else -1,
+        respuesta,
+        asignacion.hour if asignacion else -1,
+        asignacion.weekday() if asignacion else -1,
+        calificacion,
+    )
+
+
+class _Columnas:
+    """Columnas paralelas, ordenadas por `idDespacho`."""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.servicio = array('q')
+        self.respuesta = array('d')
+        self.hora = array('b')
+        self.dia = array('b')
+        self.calificacion = array('b')
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def last_id(self):
+        return self.ids[-1] if self.ids else 0
+
+    def _columns(self):
+        return (self.ids, self.servicio, self.respuesta, self.hora, self.dia, self.calificacion)
+
+    def append(self, values):
+        for column, value in zip(self._columns(), values):
+            column.append(value)
+
+    def replace(self, values):
+        """Sobrescribe un despacho ya leído; devuelve False si no está."""
+        index = bisect_left(self.ids, values[0])
+        if index == len(self.ids) or self.ids[index] != values[0]:
+            return False
+        for column, value in zip(self._columns()[1:], values[1:]):
+            column[index] = value
+        return True
+
+    def remove(self, despacho_id):
+        # Se marca como borrado en lugar de desplazar todas las columnas.
+        self.replace((despacho_id, -1, _NAN, -1, -1, 0))
+
+
+def _interpolate(ordered, q):
+    """Percentil con interpolación lineal (mismo criterio que `numpy.percentile`)."""
+    position = (len(ordered) - 1) * q / 100.0
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _media(total, n):
+    return round(total / n, 2) if n else None
+
+
+def _resumen_numpy(cols):
+    servicio = np.frombuffer(cols.servicio, dtype=np.int64)
+    respuesta = np.frombuffer(cols.respuesta, dtype=np.float64)
+    hora = np.frombuffer(cols.hora, dtype=np.int8)
+    dia = np.frombuffer(cols.dia, dtype=np.int8)
+    calificacion = np.frombuffer(cols.calificacion, dtype=np.int8)
+
+    vivo = servicio >= 0
+    con_tiempo = vivo & ~np.isnan(respuesta)
+    calificado = vivo & (calificacion > 0)
+    tiempos = respuesta[con_tiempo]
+    percentiles = np.percentile(tiempos, PERCENTILES).tolist() if tiempos.size else [None] * len(PERCENTILES)
+
+    ids, inverse = np.unique(servicio[vivo], return_inverse=True)
+    n = len(ids)
+    despachos = np.bincount(inverse, minlength=n)
+    mask_tiempo = con_tiempo[vivo]
+    n_tiempo = np.bincount(inverse[mask_tiempo], minlength=n)
+    suma_tiempo = np.bincount(inverse[mask_tiempo], weights=respuesta[vivo][mask_tiempo], minlength=n)
+    mask_cal = calificado[vivo]
+    n_cal = np.bincount(inverse[mask_cal], minlength=n)
+    suma_cal = np.bincount(inverse[mask_cal], weights=calificacion[vivo][mask_cal], minlength=n)
+
+    def perfil(columna, size):
+        asignado = vivo & (columna >= 0)
+        total = np.bincount(columna[asignado], minlength=size)
+        medido = asignado & con_tiempo
+        n_perfil = np.bincount(columna[medido], minlength=size)
+        suma = np.bincount(columna[medido], weights=respuesta[medido], minlength=size)
+        return total.tolist(), n_perfil.tolist(), suma.tolist()
+
+    return {
+        'total': int(vivo.sum()),
+        'con_tiempo': int(tiempos.size),
+        'suma_tiempo': float(tiempos.sum()),
+        'percentiles': percentiles,
+        'servicios': list(zip(ids.tolist(), despachos.tolist(), n_tiempo.tolist(), suma_tiempo.tolist(),
+                              n_cal.tolist(), suma_cal.tolist())),
+        'hora': perfil(hora, 24),
+        'dia': perfil(dia, 7),
+        'calificaciones': np.bincount(calificacion[calificado], minlength=6)[1:6].tolist(),
+    }
+
+
+def _resumen_python(cols):
+    tiempos = []
+    servicios = {}
+    hora = ([0] * 24, [0] * 24, [0.0] * 24)
+    dia = ([0] * 7, [0] * 7, [0.0] * 7)
+    calificaciones = [0] * 6
+    for servicio, respuesta, h, d, calificacion in zip(cols.servicio, cols.respuesta, cols.hora, cols.dia, cols.calificacion):
+        if servicio < 0:
+            continue
+        medido = respuesta == respuesta
+        acc = servicios.setdefault(servicio, [0, 0, 0.0, 0, 0.0])
+        acc[0] += 1
+        if medido:
+            tiempos.append(respuesta)
+            acc[1] += 1
+            acc[2] += respuesta
+        if calificacion > 0:
+            acc[3] += 1
+            acc[4] += calificacion
+            calificaciones[calificacion] += 1
+        for perfil, index in ((hora, h), (dia, d)):
+            if index >= 0:
+                perfil[0][index] += 1
+                if medido:
+                    perfil[1][index] += 1
+                    perfil[2][index] += respuesta
+    tiempos.sort()
+    return {
+        'total': sum(acc[0] for acc in servicios.values()),
+        'con_tiempo': len(tiempos),
+        'suma_tiempo': sum(tiempos),
+        'percentiles': [_interpolate(tiempos, q) for q in PERCENTILES] if tiempos else [None] * len(PERCENTILES),
+        'servicios': [(sid, *acc) for sid, acc in sorted(servicios.items())],
+        'hora': hora,
+        'dia': dia,
+        'calificaciones': calificaciones[1:6],
+    }
+
+
+class ResponseAnalytics:
+    """Columnas de despachos en memoria y resumen cacheado."""
+
+    def __init__(self, ttl=60.0, rebuild=3600.0, batch=5000):
+        self.ttl = float(ttl)
+        self.rebuild = float(rebuild)
+        self.batch = int(batch)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._cols = _Columnas()
+        self._changed = set()
+        self._full = True
+        self._built_at = None
+        self._summary = None
+        self._summary_at = None
+
+    def on_event(self, event):
+        """Oyente de `events.bus`: anota los despachos a releer."""
+        tipo = event.get('tipo')
+        data = event.get('data') or {}
+        with self._lock:
+            if tipo in ('despacho_actualizado', 'despacho_eliminado'):
+                self._changed.add(data.get('idDespacho'))
+            elif tipo in ('emergencia_eliminada', 'emergencias_archivadas'):
+                # Sus despachos se borran (en cascada o al archivarse) sin publicar eventos.
+                self._full = True
+
+    def refresh(self):
+        """Incorpora los despachos nuevos y modificados (o relee todo) y recalcula el resumen."""
+        with self._refresh_lock:
+            with self._lock:
+                full = self._full or self._built_at is None or (
+                    self.rebuild > 0 and time.monotonic() - self._built_at > self.rebuild)
+                changed, self._changed = self._changed, set()
+                self._full = False
+            try:
+                if full:
+                    cols = _Columnas()
+                    for rows in db.iter_despacho_tiempos(0, batch_size=self.batch):
+                        for row in rows:
+                            cols.append(_fila(row))
+                    with self._lock:
+                        self._cols = cols
+                        self._built_at = time.monotonic()
+                else:
+                    nuevos = [_fila(row) for rows in db.iter_despacho_tiempos(self._cols.last_id, batch_size=self.batch) for row in rows]
+                    changed = {i for i in changed if i is not None and i <= self._cols.last_id}
+                    releidos = [_fila(row) for rows in db.iter_despacho_tiempos(ids=changed, batch_size=self.batch) for row in rows] if changed else []
+                    with self._lock:
+                        for values in nuevos:
+                            self._cols.append(values)
+                        for values in releidos:
+                            self._cols.replace(values)
+                        for despacho_id in changed - {values[0] for values in releidos}:
+                            self._cols.remove(despacho_id)
+            except Exception:
+                with self._lock:
+                    self._changed |= changed
+                    self._full = self._full or full
+                raise
+            with self._lock:
+                raw = _resumen_numpy(self._cols) if np is not None and len(self._cols) else _resumen_python(self._cols)
+            summary = self._format(raw)
+            with self._lock:
+                self._summary = summary
+                self._summary_at = time.monotonic()
+            return summary
+
+    def _format(self, raw):
+        nombres = {s['idServicioEmergencia']: s.get('nombreServicioEmergencia') for s in db.get_all_servicioemergencia()}
+        servicios = [
+            {
+                'idServicioEmergencia': sid,
+                'nombre': nombres.get(sid),
+                'despachos': despachos,
+                'respuestaMedia': _media(suma_tiempo, n_tiempo),
+                'calificacionMedia': _media(suma_cal, n_cal),
+            }
+            for sid, despachos, n_tiempo, suma_tiempo, n_cal, suma_cal in raw['servicios']
+        ]
+        servicios.sort(key=lambda item: -item['despachos'])
+
+        def perfil(data, etiquetas, clave):
+            total, medidos, suma = data
+            return [
+                {clave: etiqueta, 'despachos': total[i], 'respuestaMedia': _media(suma[i], medidos[i])}
+                for i, etiqueta in enumerate(etiquetas)
+            ]
+
+        return {
+            'despachos': raw['total'],
+            'conTiempo': raw['con_tiempo'],
+            'respuestaMedia': _media(raw['suma_tiempo'], raw['con_tiempo']),
+            'percentiles': {
+                f'p{q}': round(value, 2) if value is not None else None
+                for q, value in zip(PERCENTILES, raw['percentiles'])
+            },
+            'porServicio': servicios,
+            'porHora': perfil(raw['hora'], range(24), 'hora'),
+            'porDia': perfil(raw['dia'], DIAS, 'dia'),
+            'calificaciones': {str(i + 1): count for i, count in enumerate(raw['calificaciones'])},
+            'motor': 'numpy' if np is not None else 'array',
+            'calculado': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def summary(self, max_age=None):
+        """Resumen cacheado; se refresca si tiene más de `max_age` (por defecto `ttl`) segundos."""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            summary, summary_at = self._summary, self._summary_at
+        if summary is not None and time.monotonic() - summary_at <= max_age:
+            return summary
+        return self.refresh()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'filas': len(self._cols),
+                'ultimo_id': self._cols.last_id,
+                'pendientes': len(self._changed),
+                'motor': 'numpy' if np is not None else 'array',
+            }
+
+
+analytics = ResponseAnalytics(ttl=TTL, rebuild=REBUILD_SECONDS, batch=BATCH)
+events.bus.add_listener(analytics.on_event)
+
+
+def resumen(max_age=None):
+    """Resumen de tiempos de respuesta (ver `ResponseAnalytics.summary`)."""
+    return analytics.summary(max_age)
@@ -0,0 +1,200 @@
+"""API JSON versionada (`/api/v1`) de solo lectura sobre las tablas de `db.py`.
+
+Rutas por entidad (`usuarios`, `tipos`, `servicios`, `contactos`,
+`emergencias`, `historialestados`, `despachos`, `duplicados`):
+
+- `GET /api/v1/<entidad>`: página keyset (`after`, `before`, `limit`) con
+  `fields=a,b` para elegir columnas y filtros de la entidad (p. ej.
+  `estado=reportada,en_proceso&prioridad=alta&desde=2024-01-01&hasta=2024-01-31`).
+  Con `ids=1,2,3` devuelve esas filas en una sola consulta `WHERE IN`.
+- `GET /api/v1/<entidad>/<id>`: una fila (admite `fields`).
+- `GET /api/v1/<entidad>/exportar?formato=csv|jsonl` (`emergencias`,
+  `despachos`): todas las filas que cumplen los filtros, en streaming.
+- `archivo=1` (`emergencias`, `historialestados`, `despachos`,
+  `duplicados`) incluye en los listados, el detalle y la exportación las
+  filas archivadas.
+- `GET /api/v1/emergencias/buscar?q=texto`: búsqueda de texto completo en
+  descripción, observaciones, ubicación y motivos del historial, de más a
+  menos relevante; admite los filtros, `archivo` y la paginación de
+  `emergencias`.
+- `GET /api/v1/triage?n=10` y `GET /api/v1/triage/siguiente`: emergencias
+  pendientes en orden de despacho (cola de `triage.py`).
+
+Los filtros y la selección de columnas se resuelven en SQL; las fechas se
+devuelven en ISO 8601.
+"""
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+import db
+from export import FORMATS, chunks, parse_date
+from http_cache import conditional
+import triage
+
+
+bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+# Parámetros de la consulta que no son filtros.
+_RESERVED = {'fields', 'ids', 'after', 'before', 'limit', 'formato', 'archivo', 'q'}
+_DATE_FILTERS = {'desde', 'hasta'}
+
+
+class BadRequest(ValueError):
+    """Parámetro de consulta inválido (responde 400)."""
+
+
+@bp.errorhandler(ValueError)
+def _bad_request(e):
+    return jsonify({'error': str(e)}), 400
+
+
+@bp.errorhandler(db.Error)
+def _db_error(e):
+    return jsonify({'error': str(e)}), 500
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def _int_list(value):
+    try:
+        return [int(part) for part in _split(value)]
+    except ValueError:
+        raise BadRequest("`ids` debe ser una lista de enteros separados por comas")
+
+
+def _filters():
+    filters = {}
+    for name, value in request.args.items():
+        if name in _RESERVED:
+            continue
+        if name in _DATE_FILTERS:
+            filters[name] = parse_date(name, value)
+        else:
+            values = _split(value)
+            filters[name] = values if len(values) > 1 else value
+    return filters
+
+
+def _archivo():
+    return request.args.get('archivo', '').lower() in ('1', 'true', 'si', 'sí')
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep='T')
+    if isinstance(value, (date, dtime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _tables(entity, **kwargs):
+    spec = db.API_ENTITIES.get(entity)
+    return (spec['table'],) if spec else ()
+
+
+def _shape(rows, fields):
+    """Serializa las filas dejando solo los campos pedidos."""
+    keep = set(fields) if fields else None
+    return [
+        {key: _json_value(value) for key, value in row.items() if keep is None or key in keep}
+        for row in rows
+    ]
+
+
+@bp.route('/')
+def index():
+    return jsonify({
+        'version': 1,
+        'entidades': {
+            name: {'campos': list(spec['columns']), 'filtros': sorted(spec['filters'])}
+            for name, spec in db.API_ENTITIES.items()
+        },
+    })
+
+
+@bp.route('/triage')
+def triage_top():
+    n = request.args.get('n', 10, type=int)
+    items = triage.top(n)
+    return jsonify({'data': _shape(items, None), 'pendientes': len(triage.queue)})
+
+
+@bp.route('/triage/siguiente')
+def triage_siguiente():
+    item = triage.siguiente()
+    if item is None:
+        return jsonify({'error': 'No hay emergencias pendientes'}), 404
+    return jsonify(_shape([item], None)[0])
+
+
+@bp.route('/emergencias/buscar')
+@conditional('tbemergencia', 'tbhistorialestados')
+def buscar():
+    fields = _split(request.args.get('fields', ''))
+    page = db.buscar_emergencias(
+        request.args.get('q', ''), _filters(),
+        after=request.args.get('after'), before=request.args.get('before'),
+        limit=request.args.get('limit', type=int), archivo=_archivo(),
+    )
+    return jsonify({
+        'data': _shape(page['rows'], fields + ['relevancia'] if fields else None),
+        'next': page['next'],
+        'prev': page['prev'],
+        'limit': page['limit'],
+    })
+
+
+@bp.route('/<entity>')
+@conditional(_tables)
+def listado(entity):
+    if entity not in db.API_ENTITIES:
+        return jsonify({'error': f"Entidad desconocida: {entity}"}), 404
+    fields = _split(request.args.get('fields', ''))
+    ids = request.args.get('ids')
+    if ids is not None:
+        wanted = _int_list(ids)
+        rows = db.get_api_by_ids(entity, wanted, fields, archivo=_archivo())
+        pk = db.API_ENTITIES[entity]['pk']
+        found = {row[pk] for row in rows}
+        return jsonify({'data': _shape(rows, fields), 'missing': [i for i in wanted if i not in found]})
+    page = db.query_api(
+        entity, fields, _filters(),
+        after=request.args.get('after'), before=request.args.get('before'),
+        limit=request.args.get('limit', type=int), archivo=_archivo(),
+    )
+    return jsonify({
+        'data': _shape(page['rows'], fields),
+        'next': page['next'],
+        'prev': page['prev'],
+        'limit': page['limit'],
+    })
+
+
+@bp.route('/<entity>/<int:item_id>')
+@conditional(_tables)
+def detalle(entity, item_id):
+    if entity not in db.API_ENTITIES:
+        return jsonify({'error': f"Entidad desconocida: {entity}"}), 404
+    fields = _split(request.args.get('fields', ''))
+    rows = db.get_api_by_ids(entity, [item_id], fields, archivo=_archivo())
+    if not rows:
+        return jsonify({'error': 'No encontrado'}), 404
+    return jsonify(_shape(rows, fields)[0])
+
+
+@bp.route('/<entity>/exportar')
+def exportar(entity):
+    fmt = request.args.get('formato', 'csv')
+    if fmt not in FORMATS:
+        raise BadRequest(f"Formato desconocido: {fmt}")
+    # Se valida antes de empezar a responder: después ya no se puede devolver un 400.
+    columns, batches = db.export_rows(entity, _split(request.args.get('fields', '')), _filters(), archivo=_archivo())
+    response = Response(stream_with_context(chunks(fmt, columns, batches)), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{entity}.{fmt}"'
+    return response
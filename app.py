@@ -1,8 +1,9 @@
+import json
 import os
 import sys
 from datetime import datetime
 try:
-	from flask import Flask, render_template, request, redirect, url_for, flash, session
+	from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
 except ImportError:
 	sys.stderr.write("Module 'flask' not found.\n")
 	sys.stderr.write("Start the app using the project's virtualenv or install dependencies.\n")
@@ -37,6 +38,9 @@ from db import (
     insert_emergencia,
     update_emergencia,
     delete_emergencia,
+    cambiar_estado_emergencia,
+    cambiar_estado_emergencias,
+    TRANSICIONES,
     get_all_historialestados,
     get_historialestados,
     insert_historialestados,
@@ -51,9 +55,37 @@ from db import (
     authenticate_user,
     get_user_by_id,
     get_emergencias_historial,
+    get_page_users,
+    get_page_emergencia,
+    get_page_historialestados,
+    get_page_despacho,
+    get_nearest_servicioemergencia,
+    buscar_emergencias,
+    pool_stats,
+    cache_stats,
 )
+from dedup import get_detector
+from export import parse_date
+from intake import get_journal
+import analytics
+import api
+import dashboard
+import dispatch
+import events
+import instrument
+from http_cache import conditional
+import metrics
+import triage
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET', 'dev-secret')
+instrument.init_app(app)
+metrics.init_app(app)
+app.register_blueprint(api.bp)
+
+
+def _empty_page():
+	"""Página vacía para los listados cuando la consulta falla."""
+	return {'rows': [], 'next': None, 'prev': None, 'limit': None}
 
 
 @app.route('/')
@@ -74,6 +106,7 @@ def index():
 
 
 @app.route('/tipos')
+@conditional('tbtipoemergencia')
 def tipos():
 	try:
 		tipos = get_all_tipoemergencia()
@@ -109,6 +142,7 @@ def nuevo_tipo():
 
 
 @app.route('/tipos/editar/<int:tipo_id>', methods=['GET'])
+@conditional('tbtipoemergencia')
 def editar_tipo_form(tipo_id):
 	try:
 		tipo = get_tipoemergencia(tipo_id)
@@ -152,13 +186,14 @@ def eliminar_tipo(tipo_id):
 
 
 @app.route('/usuarios')
+@conditional('tbusuario')
 def usuarios():
 	try:
-		users = get_all_users()
+		page = get_page_users(request.args.get('after'), request.args.get('before'), request.args.get('limit'))
 	except Exception as e:
 		flash(f"Error al obtener usuarios: {e}", 'danger')
-		users = []
-	return render_template('usuarios_list.html', users=users)
+		page = _empty_page()
+	return render_template('usuarios_list.html', users=page['rows'], page=page)
 
 
 @app.route('/usuarios/nuevo', methods=['GET'])
@@ -187,6 +222,7 @@ def nuevo_usuario():
 
 
 @app.route('/servicios')
+@conditional('tbservicioemergencia')
 def servicios():
     try:
         servicios = get_all_servicioemergencia()
@@ -212,6 +248,8 @@ def nuevo_servicio():
     horario = request.form.get('horario')
     especialidad = request.form.get('especialidad')
     estado = request.form.get('estado')
+    latitud = request.form.get('latitud') or None
+    longitud = request.form.get('longitud') or None
 
     if not nombre or not tipo or not estado:
         flash('Nombre, tipo y estado son obligatorios.', 'warning')
@@ -220,7 +258,9 @@ def nuevo_servicio():
     try:
         # convertir capacidad a int si viene
         capacidad_val = int(capacidad) if capacidad else None
-        new_id = insert_servicioemergencia(nombre, tipo, telefono, disponibilidad, direccion, capacidad_val, horario, especialidad, estado)
+        lat_val = float(latitud) if latitud else None
+        lon_val = float(longitud) if longitud else None
+        new_id = insert_servicioemergencia(nombre, tipo, telefono, disponibilidad, direccion, capacidad_val, horario, especialidad, estado, lat_val, lon_val)
         flash(f'Servicio creado correctamente (id={new_id}).', 'success')
         return redirect(url_for('servicios'))
     except Exception as e:
@@ -229,6 +269,7 @@ def nuevo_servicio():
 
 
 @app.route('/servicios/editar/<int:servicio_id>', methods=['GET'])
+@conditional('tbservicioemergencia')
 def editar_servicio_form(servicio_id):
     try:
         servicio = get_servicioemergencia(servicio_id)
@@ -252,6 +293,8 @@ def editar_servicio(servicio_id):
     horario = request.form.get('horario')
     especialidad = request.form.get('especialidad')
     estado = request.form.get('estado')
+    latitud = request.form.get('latitud') or None
+    longitud = request.form.get('longitud') or None
 
     if not nombre or not tipo or not estado:
         flash('Nombre, tipo y estado son obligatorios.', 'warning')
@@ -259,7 +302,9 @@ def editar_servicio(servicio_id):
 
     try:
         capacidad_val = int(capacidad) if capacidad else None
-        rows = update_servicioemergencia(servicio_id, nombre, tipo, telefono, disponibilidad, direccion, capacidad_val, horario, especialidad, estado)
+        lat_val = float(latitud) if latitud else None
+        lon_val = float(longitud) if longitud else None
+        rows = update_servicioemergencia(servicio_id, nombre, tipo, telefono, disponibilidad, direccion, capacidad_val, horario, especialidad, estado, lat_val, lon_val)
         flash('Servicio actualizado correctamente.', 'success')
         return redirect(url_for('servicios'))
     except Exception as e:
@@ -277,9 +322,74 @@ def eliminar_servicio(servicio_id):
     return redirect(url_for('servicios'))
 
 
+@app.route('/servicios/cercanos')
+def servicios_cercanos():
+    latitud = request.args.get('lat', type=float)
+    longitud = request.args.get('lon', type=float)
+    k = min(request.args.get('k', 5, type=int), 50)
+    if latitud is None or longitud is None:
+        return jsonify({'error': 'Parámetros lat y lon son obligatorios.'}), 400
+    try:
+        return jsonify(get_nearest_servicioemergencia(latitud, longitud, k))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/admin')
 def admin():
-    return render_template('admin.html')
+    try:
+        panel = dashboard.resumen()
+    except Exception as e:
+        panel = None
+        flash(f'Error al cargar los contadores: {e}', 'danger')
+    return render_template('admin.html', panel=panel)
+
+
+@app.route('/admin/panel')
+def admin_panel():
+    try:
+        return jsonify(dashboard.resumen())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/pool')
+def admin_pool():
+    return jsonify(pool_stats())
+
+
+@app.route('/admin/cache')
+def admin_cache():
+    return jsonify(cache_stats())
+
+
+@app.route('/admin/intake')
+def admin_intake():
+    journal = get_journal()
+    return jsonify(dict(journal.stats(), fallidas=journal.failed(), duplicados=get_detector().stats()))
+
+
+@app.route('/admin/eventos')
+def admin_eventos():
+    return jsonify(events.bus.stats())
+
+
+@app.route('/admin/analitica')
+def admin_analitica():
+    try:
+        return jsonify(analytics.resumen(0 if request.args.get('refresh') else None))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/sql')
+def admin_sql():
+    return jsonify(instrument.stats())
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/usuarios/editar/<int:user_id>', methods=['GET'])
@@ -331,6 +441,7 @@ def eliminar_usuario(user_id):
 
 
 @app.route('/contactos')
+@conditional('tbcontactoemergencia')
 def contactos():
 	try:
 		contactos = get_all_contactoemergencia()
@@ -374,6 +485,7 @@ def nuevo_contacto():
 
 
 @app.route('/contactos/editar/<int:contacto_id>', methods=['GET'])
+@conditional('tbcontactoemergencia', 'tbtipoemergencia')
 def editar_contacto_form(contacto_id):
 	try:
 		contacto = get_contactoemergencia(contacto_id)
@@ -421,13 +533,29 @@ def eliminar_contacto(contacto_id):
 
 
 @app.route('/emergencias')
+@conditional('tbemergencia')
 def emergencias():
 	try:
-		emergencias = get_all_emergencia()
+		page = get_page_emergencia(request.args.get('after'), request.args.get('before'), request.args.get('limit'))
 	except Exception as e:
 		flash(f"Error al obtener emergencias: {e}", 'danger')
-		emergencias = []
-	return render_template('emergencia_list.html', emergencias=emergencias)
+		page = _empty_page()
+	return render_template('emergencia_list.html', emergencias=page['rows'], page=page, transiciones=TRANSICIONES)
+
+
+@app.route('/emergencias/buscar')
+@conditional('tbemergencia', 'tbhistorialestados')
+def buscar_emergencias_view():
+	q = request.args.get('q', '').strip()
+	criterios = {name: request.args.get(name, '').strip() for name in ('estado', 'desde', 'hasta')}
+	page = _empty_page()
+	if q:
+		try:
+			filters = {name: parse_date(name, value) if name != 'estado' else value for name, value in criterios.items() if value}
+			page = buscar_emergencias(q, filters, request.args.get('after'), request.args.get('before'), request.args.get('limit'))
+		except Exception as e:
+			flash(f"Error en la búsqueda: {e}", 'danger')
+	return render_template('emergencia_buscar.html', q=q, criterios=criterios, emergencias=page['rows'], page=page, estados=TRANSICIONES)
 
 
 @app.route('/emergencias/nuevo', methods=['GET'])
@@ -537,16 +665,102 @@ def eliminar_emergencia(emergencia_id):
 	return redirect(url_for('emergencias'))
 
 
+@app.route('/emergencias/<int:emergencia_id>/estado', methods=['POST'])
+def cambiar_estado(emergencia_id):
+	estado = request.form.get('estado')
+	motivo = request.form.get('motivo') or None
+	try:
+		cambiar_estado_emergencia(emergencia_id, estado, session.get('user_id') or 1, session.get('user_name'), motivo)
+		flash(f'Emergencia {emergencia_id} pasó a {estado}.', 'success')
+	except Exception as e:
+		flash(f'Error al cambiar el estado: {e}', 'danger')
+	return redirect(request.referrer or url_for('emergencias'))
+
+
+@app.route('/emergencias/estado', methods=['POST'])
+def cambiar_estado_lote():
+	# Cambio masivo (incidentes con múltiples víctimas): formulario o JSON {"ids": [...], "estado": ..., "motivo": ...}
+	data = request.get_json(silent=True) if request.is_json else None
+	if data is not None:
+		ids, estado, motivo = data.get('ids') or [], data.get('estado'), data.get('motivo')
+	else:
+		ids, estado, motivo = request.form.getlist('ids'), request.form.get('estado'), request.form.get('motivo') or None
+	try:
+		result = cambiar_estado_emergencias(ids, estado, session.get('user_id') or 1, session.get('user_name'), motivo)
+	except Exception as e:
+		if data is not None:
+			return jsonify({'error': str(e)}), 400 if isinstance(e, (ValueError, TypeError)) else 500
+		flash(f'Error al cambiar el estado: {e}', 'danger')
+		return redirect(url_for('emergencias'))
+	if data is not None:
+		return jsonify(result)
+	flash(f"{len(result['cambiadas'])} emergencias pasaron a {estado}.", 'success')
+	for error in result['errores']:
+		flash(f"Emergencia {error['idEmergencia']}: {error['error']}", 'warning')
+	return redirect(url_for('emergencias'))
+
+
+def _sse(event):
+	data = json.dumps(dict(event['data'], ts=event['ts']), default=str, ensure_ascii=False)
+	return f"id: {event['id']}\nevent: {event['tipo']}\ndata: {data}\n\n"
+
+
+@app.route('/eventos/emergencias')
+def eventos_emergencias():
+	"""Flujo SSE de altas, cambios y bajas de emergencias (ver `events.py`)."""
+	last_id = request.headers.get('Last-Event-ID', type=int)
+	if last_id is None:
+		last_id = request.args.get('last_id', events.bus.last_seq, type=int)
+	if not events.bus.subscribe(events.MAX_SUBSCRIBERS):
+		return Response('Demasiadas consolas conectadas.', status=503, headers={'Retry-After': '10'})
+
+	def stream(last_id):
+		yield 'retry: 3000\n\n'
+		while True:
+			pending, reset = events.bus.wait(last_id, timeout=15)
+			if reset:
+				yield 'event: reset\ndata: {}\n\n'
+			if not pending:
+				# Comentario de latido: mantiene viva la conexión a través de proxies.
+				yield ': ping\n\n'
+			for event in pending:
+				last_id = event['id']
+				yield _sse(event)
+
+	response = Response(stream(last_id), mimetype='text/event-stream',
+						headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+	# Al cerrar la respuesta, aunque el generador no llegue a empezar (HEAD, cliente desconectado).
+	response.call_on_close(events.bus.unsubscribe)
+	return response
+
+
+@app.route('/eventos/emergencias/poll')
+def eventos_emergencias_poll():
+	"""Alternativa long-poll a `/eventos/emergencias` para clientes sin SSE."""
+	last_id = request.args.get('last_id', events.bus.last_seq, type=int)
+	timeout = max(0.0, min(request.args.get('timeout', 25, type=float), 60.0))
+	if not events.bus.subscribe(events.MAX_SUBSCRIBERS):
+		return jsonify({'error': 'Demasiadas consolas conectadas.'}), 503
+	try:
+		pending, reset = events.bus.wait(last_id, timeout)
+	finally:
+		events.bus.unsubscribe()
+	return jsonify({
+		'events': [dict(e['data'], id=e['id'], tipo=e['tipo'], ts=e['ts']) for e in pending],
+		'last_id': pending[-1]['id'] if pending else last_id,
+		'reset': reset,
+	})
 
 
 @app.route('/historialestados')
+@conditional('tbhistorialestados')
 def historialestados():
 	try:
-		historialestados = get_all_historialestados()
+		page = get_page_historialestados(request.args.get('after'), request.args.get('before'), request.args.get('limit'))
 	except Exception as e:
 		flash(f"Error al obtener historial: {e}", 'danger')
-		historialestados = []
-	return render_template('historialestados_list.html', historialestados=historialestados)
+		page = _empty_page()
+	return render_template('historialestados_list.html', historialestados=page['rows'], page=page)
 
 
 @app.route('/historialestados/nuevo', methods=['GET'])
@@ -638,13 +852,26 @@ def eliminar_historialestados(historial_id):
 	return redirect(url_for('historialestados'))
 
 
+# ==================== COLA DE TRIAJE ====================
+
+@app.route('/triage')
+def triage_list():
+	try:
+		pendientes = triage.top(request.args.get('n', 20, type=int))
+	except Exception as e:
+		flash(f'Error al obtener la cola de triaje: {e}', 'danger')
+		pendientes = []
+	return render_template('triage_list.html', pendientes=pendientes, total=len(triage.queue))
+
+
 # ==================== RUTAS PARA DESPACHO ====================
 
 @app.route('/despacho')
+@conditional('tbdespacho')
 def despacho():
 	try:
-		despachos = get_all_despacho()
-		return render_template('despacho_list.html', despachos=despachos)
+		page = get_page_despacho(request.args.get('after'), request.args.get('before'), request.args.get('limit'))
+		return render_template('despacho_list.html', despachos=page['rows'], page=page)
 	except Exception as e:
 		flash(f'Error al obtener despachos: {e}', 'danger')
 		return redirect(url_for('admin'))
@@ -655,12 +882,31 @@ def nuevo_despacho_form():
 	try:
 		servicios = get_all_servicioemergencia()
 		emergencias = get_all_emergencia()
-		return render_template('despacho_form.html', servicios=servicios, emergencias=emergencias)
+		emergencia_id = request.args.get('emergencia_id', type=int)
+		recomendados = []
+		if emergencia_id:
+			recomendados = dispatch.recomendar_para(emergencia_id) or []
+		return render_template('despacho_form.html', servicios=servicios, emergencias=emergencias, recomendados=recomendados, emergencia_id=emergencia_id)
 	except Exception as e:
 		flash(f'Error al cargar formulario: {e}', 'danger')
 		return redirect(url_for('despacho'))
 
 
+@app.route('/despacho/recomendar')
+def despacho_recomendar():
+	emergencia_id = request.args.get('emergencia_id', type=int)
+	k = min(request.args.get('k', 5, type=int), 50)
+	if not emergencia_id:
+		return jsonify({'error': 'Parámetro emergencia_id obligatorio.'}), 400
+	try:
+		recomendados = dispatch.recomendar_para(emergencia_id, k)
+	except Exception as e:
+		return jsonify({'error': str(e)}), 500
+	if recomendados is None:
+		return jsonify({'error': 'Emergencia no encontrada.'}), 404
+	return jsonify(recomendados)
+
+
 @app.route('/despacho/nuevo', methods=['POST'])
 def nuevo_despacho():
 	try:
@@ -802,6 +1048,7 @@ def logout():
 # ==================== RUTAS DE SOLICITUD DE AYUDA ====================
 
 @app.route('/solicitar-ayuda')
+@conditional('tbservicioemergencia')
 def solicitar_ayuda():
 	try:
 		servicios = get_all_servicioemergencia()
@@ -812,6 +1059,7 @@ def solicitar_ayuda():
 
 
 @app.route('/formulario-ayuda/<int:servicio_id>', methods=['GET', 'POST'])
+@conditional('tbservicioemergencia')
 def formulario_ayuda(servicio_id):
 	try:
 		servicio = get_servicioemergencia(servicio_id)
@@ -826,6 +1074,8 @@ def formulario_ayuda(servicio_id):
 			ubicacion = request.form.get('ubicacion')
 			grupo_sanguineo = request.form.get('grupo_sanguineo')
 			descripcion = request.form.get('descripcion', '')
+			latitud = request.form.get('latitud') or None
+			longitud = request.form.get('longitud') or None
 			
 			try:
 				# Obtener o crear usuario anónimo
@@ -833,26 +1083,31 @@ def formulario_ayuda(servicio_id):
 				if 'user_id' in session:
 					user_id = session['user_id']
 				
-				# Crear emergencia
+				# Registrar la solicitud en el diario local; el drenador la inserta en MySQL
+				# (o, si es un duplicado de un reporte reciente, la vincula a su emergencia).
+				# Solo se compara la descripción: la dirección la cubre el radio de `dedup.py`.
 				tipo_emergencia_id = servicio['idServicioEmergencia']
-				emergencia_id = insert_emergencia(
-					user_id=user_id or 1,
-					tipo_emergencia_id=tipo_emergencia_id,
-					codigo_emergencia=None,
-					fecha_hora=datetime.now(),
-					tipo_emergencia=None,
-					estado='reportada',
-					ubicacion=ubicacion,
-					latitud=None,
-					longitud=None,
-					descripcion=f"Solicitud: {descripcion}\nContacto: {nombre} ({telefono})\nGrupo Sanguíneo: {grupo_sanguineo}",
-					prioridad='media',
-					usuario_reporta=user_id or 1,
-					fecha_cierre=None,
-					observaciones=f"Solicitante: {nombre}\nTeléfono: {telefono}\nGrupo Sanguíneo: {grupo_sanguineo}"
-				)
+				_, duplicado = get_detector().submit({
+					'usuario_id': user_id or 1,
+					'tipoemergencia_id': tipo_emergencia_id,
+					'codigo': None,
+					'fecha_hora': datetime.now(),
+					'tipo': None,
+					'estado': 'reportada',
+					'ubicacion': ubicacion,
+					'latitud': float(latitud) if latitud else None,
+					'longitud': float(longitud) if longitud else None,
+					'descripcion': f"Solicitud: {descripcion}\nContacto: {nombre} ({telefono})\nGrupo Sanguíneo: {grupo_sanguineo}",
+					'prioridad': 'media',
+					'idusuarioreporta': user_id or 1,
+					'fecha_cierre': None,
+					'observaciones': f"Solicitante: {nombre}\nTeléfono: {telefono}\nGrupo Sanguíneo: {grupo_sanguineo}",
+				}, servicio_id, descripcion)
 				
-				flash('¡Solicitud de ayuda enviada correctamente! Los servicios de emergencia han sido notificados.', 'success')
+				if duplicado:
+					flash('¡Solicitud de ayuda enviada! Esta emergencia ya había sido reportada; su solicitud se ha añadido al reporte existente.', 'success')
+				else:
+					flash('¡Solicitud de ayuda enviada correctamente! Los servicios de emergencia han sido notificados.', 'success')
 				return redirect(url_for('index'))
 			except Exception as e:
 				flash(f'Error al enviar solicitud: {e}', 'danger')
@@ -864,4 +1119,5 @@ def formulario_ayuda(servicio_id):
 
 
 if __name__ == '__main__':
+	get_journal().start()
 	app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""Archivo de emergencias cerradas antiguas.
+
+Uso:
+    python archive.py                  # cerradas hace más de ARCHIVE_AFTER_DAYS días
+    python archive.py --dias 180 --lote 1000
+    python archive.py --dias 90 --dry-run
+
+Mueve las emergencias en estado 'cerrada' (con su historial, sus despachos y
+sus reportes duplicados) de `tbemergencia`, `tbhistorialestados`,
+`tbdespacho` y `tbreporteduplicado` a las tablas `*_archivo`, por lotes de
+`--lote` emergencias con una transacción cada uno (ver
+`db.archivar_emergencias_cerradas`). Pensado para ejecutarse de forma
+periódica (cron o el Programador de tareas); interrumpirlo es seguro.
+Las filas archivadas se consultan con `archivo=1` en la API o `--archivo` en
+`export.py`.
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+
+import db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archiva las emergencias cerradas antiguas.")
+    parser.add_argument('--dias', type=int, default=db.ARCHIVE_AFTER_DAYS, help="Antigüedad mínima del cierre, en días")
+    parser.add_argument('--lote', type=int, default=db.ARCHIVE_BATCH, help="Emergencias por transacción")
+    parser.add_argument('--max-lotes', type=int, help="Detenerse tras este número de lotes")
+    parser.add_argument('--dry-run', action='store_true', help="Solo cuenta las emergencias que se archivarían")
+    args = parser.parse_args(argv)
+    if args.dias < 0:
+        parser.error("--dias no puede ser negativo")
+
+    antes = datetime.now() - timedelta(days=args.dias)
+    if args.dry_run:
+        print(json.dumps({'antes': antes.isoformat(sep=' ', timespec='seconds'), 'archivables': db.count_emergencias_archivables(antes)}))
+        return 0
+    result = db.archivar_emergencias_cerradas(antes, args.lote, args.max_lotes)
+    result['antes'] = antes.isoformat(sep=' ', timespec='seconds')
+    print(json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""Banco de pruebas de carga para las rutas principales de `app.py`.
+
+Siembra una base SQLite local (ver `sqlite_backend.py`) con volúmenes
+configurables y lanza peticiones contra la aplicación Flask mediante su cliente
+WSGI de pruebas desde varios hilos. Para cada ruta informa p50/p95/p99 de
+latencia (ms), peticiones por segundo y errores, y lo guarda en JSON para
+comparar entre commits. Cuenta como error una respuesta 4xx/5xx y también una
+que muestre un `flash(..., 'danger')`: las vistas capturan los fallos de base
+de datos y responden 200 con el aviso.
+
+Uso:
+    python benchmark.py                                   # volúmenes pequeños
+    python benchmark.py --emergencias 1000000 --historial 5000000 --reseed
+    python benchmark.py --concurrency 16 --duration 20 --output actual.json
+    python benchmark.py --compare base.json --max-regression 15
+
+La base sembrada se reutiliza entre ejecuciones mientras no cambien los
+volúmenes (o hasta pasar `--reseed`).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+
+ROUTES = ('/', '/solicitar-ayuda', '/formulario-ayuda/<id>', '/emergencias', '/despacho')
+SEED_CHUNK = 50000
+ESTADOS = ('reportada', 'en_proceso', 'atendida', 'cerrada')
+PRIORIDADES = ('baja', 'media', 'alta', 'critica')
+
+
+def _chunks(total, generate):
+    """Genera listas de filas de hasta SEED_CHUNK elementos."""
+    for start in range(0, total, SEED_CHUNK):
+        yield [generate(i) for i in range(start, min(start + SEED_CHUNK, total))]
+
+
+def seed(path, volumes, rng):
+    """Crea la base `path` con los volúmenes indicados."""
+    import sqlite_backend
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    sqlite_backend.connect(database=path).close()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    base = datetime(2024, 1, 1)
+    fmt = '%Y-%m-%d %H:%M:%S'
+    n_users = volumes['usuarios']
+    n_servicios = volumes['servicios']
+    n_emergencias = volumes['emergencias']
+
+    def stamp(i, total, span_days=365):
+        return (base + timedelta(seconds=int(span_days * 86400 * i / max(total, 1)))).strftime(fmt)
+
+    conn.executemany(
+        "INSERT INTO tbtipoemergencia (idTipoEmergencia, nombreTipoEmergencia, descripcionTipoEmergencia, nivelPrioridadTipoEmergencia_3, estadoTipoEmergencia_4) VALUES (?, ?, ?, ?, ?)",
+        [(i, f"Tipo {i}", f"Descripción del tipo {i}", PRIORIDADES[i % 4], 'activo') for i in range(1, 11)]
+    )
+    for rows in _chunks(n_users, lambda i: (
+            i + 1, f"{10000000 + i}", f"Usuario {i + 1}", f"300{i:07d}", f"310{i:07d}",
+            'cliente', f"Calle {i % 200} # {i % 97}", f"usuario{i + 1}@bench.local",
+            stamp(i, n_users), 'activo', None)):
+        conn.executemany("INSERT INTO tbusuario VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    for rows in _chunks(n_servicios, lambda i: (
+            i + 1, f"Servicio {i + 1}", ('ambulancia', 'bomberos', 'policia')[i % 3], f"60{i:08d}",
+            'disponible', f"Base {i + 1}", 5 + i % 20, '24h', 'general', 'activo',
+            4.5 + rng.random() * 2.5, -76.5 + rng.random() * 2.5)):
+        conn.executemany("INSERT INTO tbservicioemergencia VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    for rows in _chunks(n_emergencias, lambda i: (
+            i + 1, rng.randint(1, n_users), rng.randint(1, n_servicios), 100000 + i,
+            stamp(i, n_emergencias), rng.randint(1, 10), ESTADOS[rng.randrange(4)],
+            f"Sector {i % 500}", 4.5 + rng.random() * 2.5, -76.5 + rng.random() * 2.5,
+            "Emergencia generada para el benchmark", PRIORIDADES[rng.randrange(4)],
+            None, None, None)):
+        conn.executemany("INSERT INTO tbemergencia VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    for rows in _chunks(volumes['historial'], lambda i: (
+            i + 1, rng.randint(1, n_emergencias), rng.randint(1, n_users),
+            ESTADOS[i % 3], ESTADOS[i % 3 + 1], stamp(i, volumes['historial']),
+            'benchmark', 'Cambio generado')):
+        conn.executemany("INSERT INTO tbhistorialestados VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    for rows in _chunks(volumes['despachos'], lambda i: (
+            i + 1, rng.randint(1, n_servicios), rng.randint(1, n_emergencias), None,
+            stamp(i, volumes['despachos']), None, None, 'asignado', None,
+            rng.randint(120, 3600), rng.randint(1, 5))):
+        conn.executemany("INSERT INTO tbdespacho VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    conn.execute("CREATE TABLE bench_meta (volumes TEXT NOT NULL)")
+    conn.execute("INSERT INTO bench_meta VALUES (?)", (json.dumps(volumes, sort_keys=True),))
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def seeded_volumes(path):
+    """Volúmenes con los que se sembró `path`, o None si no existe o está incompleta."""
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT volumes FROM bench_meta").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0]) if row else None
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def run_route(app, route, args, volumes):
+    """Lanza la carga contra una ruta y devuelve sus estadísticas."""
+    from flask import message_flashed
+
+    local = threading.local()
+    lock = threading.Lock()
+    remaining = [args.requests]
+    deadline = None
+
+    def client():
+        c = getattr(local, 'client', None)
+        if c is None:
+            c = local.client = app.test_client()
+            local.rng = random.Random(threading.get_ident())
+            if route == '/':
+                with c.session_transaction() as sess:
+                    user_id = local.rng.randint(1, volumes['usuarios'])
+                    sess['user_id'] = user_id
+                    sess['user_name'] = f"Usuario {user_id}"
+        return c
+
+    def url():
+        if route == '/formulario-ayuda/<id>':
+            return f"/formulario-ayuda/{local.rng.randint(1, volumes['servicios'])}"
+        return route
+
+    def take():
+        if deadline is not None:
+            return time.perf_counter() < deadline
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def on_flash(sender, message, category, **extra):
+        # El cliente de pruebas ejecuta la vista en el hilo que hace la petición.
+        if category == 'danger':
+            local.danger = True
+
+    def worker():
+        c = client()
+        latencies = []
+        errors = 0
+        while take():
+            local.danger = False
+            start = time.perf_counter()
+            try:
+                response = c.get(url())
+                response.get_data()
+                failed = response.status_code >= 400 or local.danger
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+        return latencies, errors
+
+    # Calentamiento: cachés, plantillas compiladas y conexiones del pool.
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for _ in range(args.concurrency):
+            executor.submit(lambda: [client().get(url()) for _ in range(args.warmup)]).result()
+
+    if args.duration:
+        deadline = time.perf_counter() + args.duration
+    message_flashed.connect(on_flash, app)
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(lambda _: worker(), range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        message_flashed.disconnect(on_flash, app)
+
+    latencies = sorted(value for lat, _ in results for value in lat)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': sum(err for _, err in results),
+        'req_per_s': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, max_regression):
+    """Imprime la variación frente a `baseline_path`; devuelve True si hay regresión."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressed = False
+    sys.stderr.write(f"Comparación con {baseline_path} ({(baseline.get('meta') or {}).get('commit')}):\n")
+    for route, now in current['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if not before or not before.get('p95_ms') or not before.get('req_per_s'):
+            sys.stderr.write(f"  {route}: sin referencia\n")
+            continue
+        p95_delta = 100.0 * (now['p95_ms'] - before['p95_ms']) / before['p95_ms']
+        rps_delta = 100.0 * (now['req_per_s'] - before['req_per_s']) / before['req_per_s']
+        flag = ''
+        if p95_delta > max_regression or -rps_delta > max_regression:
+            regressed = True
+            flag = '  <-- regresión'
+        sys.stderr.write(f"  {route}: p95 {p95_delta:+.1f}%  req/s {rps_delta:+.1f}%{flag}\n")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de carga de las rutas de la aplicación.")
+    parser.add_argument('--db', default='bench.sqlite3', help="Fichero SQLite sembrado")
+    parser.add_argument('--reseed', action='store_true', help="Vuelve a sembrar aunque la base exista")
+    parser.add_argument('--usuarios', type=int, default=1000)
+    parser.add_argument('--servicios', type=int, default=200)
+    parser.add_argument('--emergencias', type=int, default=10000)
+    parser.add_argument('--historial', type=int, default=50000)
+    parser.add_argument('--despachos', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=8, help="Hilos cliente simultáneos")
+    parser.add_argument('--requests', type=int, default=500, help="Peticiones por ruta")
+    parser.add_argument('--duration', type=float, default=0, help="Segundos por ruta (sustituye a --requests)")
+    parser.add_argument('--warmup', type=int, default=5, help="Peticiones de calentamiento por hilo")
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=list(ROUTES))
+    parser.add_argument('--seed', type=int, default=42, help="Semilla de los datos generados")
+    parser.add_argument('--output', help="Fichero JSON de resultados (por defecto, stdout)")
+    parser.add_argument('--compare', help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help="Porcentaje de empeoramiento de p95 o req/s que se considera regresión")
+    args = parser.parse_args(argv)
+
+    volumes = {
+        'usuarios': max(args.usuarios, 1),
+        'servicios': max(args.servicios, 1),
+        'emergencias': max(args.emergencias, 1),
+        'historial': args.historial,
+        'despachos': args.despachos,
+    }
+    path = os.path.abspath(args.db)
+    if args.reseed or seeded_volumes(path) != volumes:
+        sys.stderr.write(f"Sembrando {path} con {volumes}...\n")
+        started = time.perf_counter()
+        seed(path, volumes, random.Random(args.seed))
+        sys.stderr.write(f"Siembra completada en {time.perf_counter() - started:.1f}s\n")
+
+    # La configuración se fija antes de importar la aplicación (db lee el entorno al cargar).
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = path
+    os.environ.setdefault('INTAKE_JOURNAL_PATH', path + '.intake')
+    os.environ.setdefault('DB_POOL_SIZE', str(args.concurrency))
+    from app import app
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'concurrency': args.concurrency,
+            'requests_per_route': None if args.duration else args.requests,
+            'duration_per_route': args.duration or None,
+            'volumes': volumes,
+        },
+        'routes': {},
+    }
+    for route in args.routes:
+        sys.stderr.write(f"{route} ...\n")
+        report['routes'][route] = run_route(app, route, args, volumes)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare and compare(report, args.compare, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Carga masiva de emergencias, despachos o historial desde CSV o JSONL.
+
+Uso:
+    python bulk_load.py emergencia datos.csv
+    python bulk_load.py despacho datos.jsonl --chunk-size 1000
+
+Las columnas del CSV (o las claves de cada línea JSON) son los nombres de
+parámetro de `insert_emergencia`, `insert_despacho` o `insert_historialestados`
+(p. ej. `usuario_id`, `tipoemergencia_id`, `fecha_hora`, ...). En CSV las
+celdas vacías se cargan como NULL. Las filas con error se listan por stderr
+con su número de línea.
+"""
+import argparse
+import csv
+import json
+import sys
+from itertools import islice
+
+from db import insert_emergencia_batch, insert_despacho_batch, insert_historialestados_batch
+
+
+LOADERS = {
+    'emergencia': insert_emergencia_batch,
+    'despacho': insert_despacho_batch,
+    'historialestados': insert_historialestados_batch,
+}
+
+
+def read_records(path):
+    """Genera (número de línea, registro) desde un fichero CSV o JSONL."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson', '.json')):
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_no, json.loads(line)
+        else:
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, {k: (v if v != '' else None) for k, v in record.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carga masiva en la base de datos de emergencias.")
+    parser.add_argument('entidad', choices=sorted(LOADERS))
+    parser.add_argument('fichero', help="Fichero .csv o .jsonl")
+    parser.add_argument('--chunk-size', type=int, default=500, help="Filas por INSERT/commit")
+    args = parser.parse_args(argv)
+
+    loader = LOADERS[args.entidad]
+    records = read_records(args.fichero)
+    inserted = 0
+    failed = 0
+    # Se lee el fichero por bloques para no cargarlo entero en memoria.
+    while True:
+        block = list(islice(records, args.chunk_size * 10))
+        if not block:
+            break
+        result = loader([record for _, record in block], chunk_size=args.chunk_size)
+        inserted += sum(1 for new_id in result['ids'] if new_id is not None)
+        for item in result['errors']:
+            failed += 1
+            sys.stderr.write(f"línea {block[item['index']][0]}: {item['error']}\n")
+        if result['aborted']:
+            sys.stderr.write("Conexión perdida; carga interrumpida.\n")
+            break
+
+    print(json.dumps({'entidad': args.entidad, 'insertadas': inserted, 'errores': failed}))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TableVersions:
+    """Contador de versión e instante del último cambio por tabla.
+
+    Lo incrementa cada invalidación de `TTLCache`, así que sirve para saber si
+    una tabla cambió (p. ej. para ETag) sin consultar la base de datos. Los
+    contadores son del proceso: otros procesos no los ven.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._changed = {}
+        self.started = time.time()
+
+    def bump(self, table):
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+            self._changed[table] = time.time()
+
+    def snapshot(self, tables):
+        """Devuelve `(versiones, instante del último cambio)` de `tables`."""
+        with self._lock:
+            versions = tuple(self._versions.get(t, 0) for t in tables)
+            changed = max((self._changed.get(t, self.started) for t in tables), default=self.started)
+        return versions, changed
+
+
+class TTLCache:
+    """Caché en memoria con caducidad (TTL) y expulsión LRU.
+
+    Las claves son tuplas cuyo primer elemento es la tabla de origen, lo que
+    permite invalidar de una vez todas las lecturas de una tabla con
+    `invalidate(tabla)`. La tabla puede acotarse con una tupla, p. ej.
+    `('tbemergencia', usuario_id)`: `invalidate(('tbemergencia', 5))` solo
+    afecta a ese usuario e `invalidate('tbemergencia')` a todos. Con `enabled = False` todas las lecturas van a la
+    base de datos (útil en pruebas). Toda invalidación incrementa además la
+    versión de la tabla en `versions` (ver `TableVersions`).
+    """
+
+    def __init__(self, maxsize=256, ttl=60.0, enabled=True):
+        self.maxsize = max(int(maxsize), 1)
+        self.ttl = float(ttl)
+        self.enabled = bool(enabled)
+        self._data = OrderedDict()
+        # Generación por tabla: evita guardar un valor leído antes de una invalidación.
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.versions = TableVersions()
+
+    def get(self, key):
+        """Devuelve el valor guardado o `_MISSING` si no existe o caducó."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return _MISSING
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _generation(self, table):
+        root = table[0] if isinstance(table, tuple) else table
+        return (self._generations.get(root, 0), self._generations.get(table, 0))
+
+    def generation(self, table):
+        with self._lock:
+            return self._generation(table)
+
+    def set(self, key, value, generation=None, ttl=None):
+        with self._lock:
+            if generation is not None and self._generation(key[0]) != generation:
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, table):
+        """Elimina todas las entradas de `table` (y sus subdivisiones si es una tabla)."""
+        with self._lock:
+            for key in [k for k in self._data
+                        if k[0] == table or (isinstance(k[0], tuple) and k[0][0] == table)]:
+                del self._data[key]
+            self._generations[table] = self._generations.get(table, 0) + 1
+            self.invalidations += 1
+        self.versions.bump(table[0] if isinstance(table, tuple) else table)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+def cached(cache, table, ttl=None):
+    """Decorador de lectura: guarda el resultado de la función en `cache`.
+
+    `table` puede ser una función que recibe los argumentos y devuelve la
+    tabla acotada (ver `TTLCache`). `ttl` sustituye al TTL de la caché.
+    Los resultados se comparten entre peticiones y no deben modificarse.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not cache.enabled:
+                return func(*args, **kwargs)
+            namespace = table(*args, **kwargs) if callable(table) else table
+            key = (namespace, func.__name__, args, tuple(sorted(kwargs.items())))
+            value = cache.get(key)
+            if value is _MISSING:
+                generation = cache.generation(namespace)
+                value = func(*args, **kwargs)
+                cache.set(key, value, generation, ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidates(cache, *tables):
+    """Decorador de escritura: invalida las lecturas cacheadas de `tables`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                for table in tables:
+                    cache.invalidate(table)
+        return wrapper
+    return decorator
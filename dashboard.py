@@ -0,0 +1,241 @@
+"""Contadores en vivo del panel de administración.
+
+Mantiene en memoria:
+
+- emergencias abiertas (estado distinto de 'cerrada') por estado y prioridad;
+- despachos activos (no finalizados) por `estadoDespacho`;
+- emergencias reportadas y usuarios registrados hoy.
+
+Los contadores se actualizan con cada evento de `events.bus` (altas,
+modificaciones, bajas y cambios de estado de este proceso), así que pintar el
+panel no consulta la base de datos: cuesta lo mismo con mil emergencias que
+con un millón. Para incorporar lo hecho por otros procesos y los borrados en
+cascada (que no publican eventos), cada `DASHBOARD_RESYNC_SECONDS` segundos,
+tras un borrado de ese tipo y al cambiar de día se reconcilia con las tablas.
+Mientras un hilo reconcilia, los demás siguen leyendo los contadores
+anteriores. Se guarda un id por emergencia abierta y por despacho activo
+(para saber qué restar al cambiar); las cerradas y finalizadas no ocupan
+memoria.
+
+Variables de entorno:
+DASHBOARD_RESYNC_SECONDS
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+
+import db
+import events
+
+
+CERRADA = 'cerrada'
+ESTADOS = tuple(estado for estado in db.TRANSICIONES if estado != CERRADA)
+PRIORIDADES = ('critica', 'alta', 'media', 'baja')
+ESTADOS_DESPACHO = ('asignado', 'en_ruta', 'en_sitio')
+# Etiqueta de los valores NULL (las claves del resumen deben ser texto para JSON).
+SIN_VALOR = 'sin_definir'
+
+# Eventos tras los que hay que releer: sus borrados en cascada no se publican.
+_CASCADAS = ('emergencia_eliminada', 'emergencias_archivadas', 'usuario_eliminado')
+
+
+def _dia(value):
+    """Fecha (date) de un datetime o texto ISO; None si no se puede interpretar."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value[:19]).date()
+        except ValueError:
+            return None
+    return None
+
+
+class PanelCounters:
+    """Contadores del panel, mantenidos con eventos y reconciliados periódicamente."""
+
+    def __init__(self, resync=300.0):
+        self.resync = float(resync)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._emergencias = {}
+        self._por_estado = Counter()
+        self._despachos = {}
+        self._por_estado_despacho = Counter()
+        self._emergencias_hoy = set()
+        self._usuarios_hoy = set()
+        self._dia = None
+        self._pendientes = None
+        self._loaded_at = None
+        self._stale = False
+        self.reconciliaciones = 0
+        self.correcciones = 0
+
+    # -- mantenimiento -------------------------------------------------
+
+    def _set_emergencia(self, emergencia_id, estado, prioridad):
+        anterior = self._emergencias.pop(emergencia_id, None)
+        if anterior is not None:
+            self._por_estado[anterior] -= 1
+            if self._por_estado[anterior] <= 0:
+                del self._por_estado[anterior]
+        if estado != CERRADA:
+            clave = (estado or 'reportada', prioridad or SIN_VALOR)
+            self._emergencias[emergencia_id] = clave
+            self._por_estado[clave] += 1
+
+    def _set_despacho(self, despacho_id, estado, activo=True):
+        anterior = self._despachos.pop(despacho_id, None)
+        if anterior is not None:
+            self._por_estado_despacho[anterior] -= 1
+            if self._por_estado_despacho[anterior] <= 0:
+                del self._por_estado_despacho[anterior]
+        if activo and db.despacho_activo(estado):
+            estado = estado or SIN_VALOR
+            self._despachos[despacho_id] = estado
+            self._por_estado_despacho[estado] += 1
+
+    def _apply(self, event):
+        """Aplica un evento; cada uno fija el estado final de una fila, así que reaplicarlo no cambia nada."""
+        tipo = event.get('tipo')
+        data = event.get('data') or {}
+        if tipo in ('emergencia_creada', 'emergencia_actualizada'):
+            emergencia_id = data.get('idEmergencia')
+            self._set_emergencia(emergencia_id, data.get('estado'), data.get('prioridad'))
+            if tipo == 'emergencia_creada' and _dia(data.get('fechaHora')) == self._dia:
+                self._emergencias_hoy.add(emergencia_id)
+        elif tipo == 'estado_cambiado':
+            # Sin `aplicado` solo se añadió historial: `estadoEmergencia` no cambió.
+            emergencia_id = data.get('idEmergencia')
+            if data.get('aplicado') and emergencia_id in self._emergencias:
+                self._set_emergencia(emergencia_id, data.get('estadoNuevo'), self._emergencias[emergencia_id][1])
+        elif tipo == 'emergencia_eliminada':
+            self._set_emergencia(data.get('idEmergencia'), CERRADA, None)
+            self._emergencias_hoy.discard(data.get('idEmergencia'))
+        elif tipo in ('despacho_creado', 'despacho_actualizado'):
+            self._set_despacho(data.get('idDespacho'), data.get('estado'))
+        elif tipo == 'despacho_eliminado':
+            self._set_despacho(data.get('idDespacho'), None, activo=False)
+        elif tipo == 'usuario_creado' and _dia(data.get('fechaRegistro')) == self._dia:
+            self._usuarios_hoy.add(data.get('idUsuario'))
+        elif tipo == 'usuario_eliminado':
+            self._usuarios_hoy.discard(data.get('idUsuario'))
+
+    def on_event(self, event):
+        """Oyente de `events.bus`."""
+        with self._lock:
+            if self._pendientes is not None:
+                self._pendientes.append(event)
+            if self._loaded_at is None:
+                return
+            self._apply(event)
+            if event.get('tipo') in _CASCADAS:
+                self._stale = True
+
+    def _snapshot_counts(self):
+        return (dict(self._por_estado), dict(self._por_estado_despacho), len(self._emergencias_hoy), len(self._usuarios_hoy))
+
+    def reload(self):
+        """Reconstruye los contadores desde las tablas y reaplica lo publicado mientras tanto."""
+        hoy = date.today()
+        with self._lock:
+            self._pendientes = []
+        try:
+            base = db.get_panel_base(datetime.combine(hoy, datetime.min.time()))
+        except Exception:
+            with self._lock:
+                self._pendientes = None
+            raise
+        with self._lock:
+            antes = self._snapshot_counts() if self._loaded_at is not None and self._dia == hoy else None
+            self._emergencias, self._por_estado = {}, Counter()
+            self._despachos, self._por_estado_despacho = {}, Counter()
+            for emergencia_id, estado, prioridad in base['emergencias']:
+                self._set_emergencia(emergencia_id, estado, prioridad)
+            for despacho_id, estado in base['despachos']:
+                self._set_despacho(despacho_id, estado)
+            self._emergencias_hoy = set(base['emergencias_hoy'])
+            self._usuarios_hoy = set(base['usuarios_hoy'])
+            self._dia = hoy
+            for event in self._pendientes:
+                self._apply(event)
+            # Un borrado en cascada durante la lectura pudo quedar a medias en ella.
+            self._stale = any(event.get('tipo') in _CASCADAS for event in self._pendientes)
+            self._pendientes = None
+            self._loaded_at = time.monotonic()
+            self.reconciliaciones += 1
+            if antes is not None and antes != self._snapshot_counts():
+                # Diferencias con lo mantenido por eventos: cambios de otros procesos o cascadas.
+                self.correcciones += 1
+
+    def _due(self):
+        with self._lock:
+            loaded_at, stale, dia = self._loaded_at, self._stale, self._dia
+        return (loaded_at is None or stale or dia != date.today()
+                or (self.resync > 0 and time.monotonic() - loaded_at > self.resync))
+
+    def ensure(self):
+        """Reconcilia si toca. Si otro hilo ya lo está haciendo, no espera (salvo en la primera carga)."""
+        if not self._due():
+            return
+        with self._lock:
+            first = self._loaded_at is None
+        if not self._refresh_lock.acquire(blocking=first):
+            return
+        try:
+            # Otro hilo pudo reconciliar mientras se esperaba el candado.
+            if self._due():
+                self.reload()
+        finally:
+            self._refresh_lock.release()
+
+    # -- consultas -----------------------------------------------------
+
+    def snapshot(self):
+        """Contadores actuales; el tamaño no depende del número de filas."""
+        self.ensure()
+        with self._lock:
+            por_estado, por_estado_despacho, emergencias_hoy, usuarios_hoy = self._snapshot_counts()
+            edad = time.monotonic() - self._loaded_at
+        estados = list(ESTADOS) + sorted({e for e, _ in por_estado if e not in ESTADOS})
+        prioridades = list(PRIORIDADES) + sorted({p for _, p in por_estado if p not in PRIORIDADES})
+        matriz = {
+            estado: {prioridad: por_estado.get((estado, prioridad), 0) for prioridad in prioridades}
+            for estado in estados
+        }
+        estados_despacho = list(ESTADOS_DESPACHO) + sorted({e for e in por_estado_despacho if e not in ESTADOS_DESPACHO})
+        return {
+            'emergencias_abiertas': sum(por_estado.values()),
+            'emergencias_por_estado': {estado: sum(fila.values()) for estado, fila in matriz.items()},
+            'emergencias_por_prioridad': {p: sum(fila[p] for fila in matriz.values()) for p in prioridades},
+            'emergencias_estado_prioridad': matriz,
+            'prioridades': prioridades,
+            'despachos_activos': sum(por_estado_despacho.values()),
+            'despachos_por_estado': {estado: por_estado_despacho.get(estado, 0) for estado in estados_despacho},
+            'emergencias_hoy': emergencias_hoy,
+            'usuarios_hoy': usuarios_hoy,
+            'segundos_desde_reconciliacion': round(edad, 1),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'emergencias_abiertas': len(self._emergencias),
+                'despachos_activos': len(self._despachos),
+                'reconciliaciones': self.reconciliaciones,
+                'correcciones': self.correcciones,
+                'cargada': self._loaded_at is not None,
+            }
+
+
+contadores = PanelCounters(resync=float(os.getenv('DASHBOARD_RESYNC_SECONDS', '300')))
+events.bus.add_listener(contadores.on_event)
+
+
+def resumen():
+    """Atajo a `contadores.snapshot()`."""
+    return contadores.snapshot()
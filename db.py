@@ -1,27 +1,295 @@
+import base64
+import json
 import os
-from datetime import datetime
-import hashlib
+import re
 import secrets
+import threading
+import time
+from datetime import datetime
 
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errors
+
+from cache import TTLCache, cached, invalidates
+import events
+from geo import GridIndex
+import instrument
+from passwords import get_hasher
+from pool import ConnectionPool, PoolTimeoutError
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _connect_args():
+    """Parámetros de conexión leídos de las variables de entorno DB_*."""
+    if os.getenv('DB_BACKEND') == 'sqlite':
+        return {'database': os.getenv('DB_SQLITE_PATH', 'sistema_emergencias.sqlite3')}
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', '3306')),
+        'user': os.getenv('DB_USER', 'root'),
+        'password': os.getenv('DB_PASSWORD', '12345678'),
+        'database': os.getenv('DB_NAME', 'sistema_emergencias'),
+    }
+
+
+def _connect_function():
+    """Función que abre conexiones: MySQL o, con DB_BACKEND=sqlite, el sustituto local
+    de `sqlite_backend` (solo para benchmarks y desarrollo sin servidor MySQL)."""
+    if os.getenv('DB_BACKEND') == 'sqlite':
+        import sqlite_backend
+        return sqlite_backend.connect
+    return mysql.connector.connect
+
+
+def statement_timeout():
+    """Segundos máximos por consulta (`DB_STATEMENT_TIMEOUT`, `0` = sin límite)."""
+    return max(float(os.getenv('DB_STATEMENT_TIMEOUT', '0')), 0.0)
+
+
+def _open_connection(**kwargs):
+    """Abre una conexión y fija sus opciones de sesión.
+
+    Con `DB_STATEMENT_TIMEOUT` MySQL interrumpe las lecturas (SELECT) que
+    superen el plazo (`max_execution_time`): la petición recibe el error en
+    lugar de ocupar un hilo y una conexión indefinidamente. Los cambios
+    (INSERT, UPDATE, DELETE) no se cortan. El sustituto SQLite lo ignora.
+    """
+    conn = _connect_function()(**kwargs)
+    timeout_ms = int(statement_timeout() * 1000)
+    if timeout_ms and os.getenv('DB_BACKEND') != 'sqlite':
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SET SESSION max_execution_time = %s", (timeout_ms,))
+            cursor.close()
+        except Error:
+            conn.close()
+            raise
+    return conn
+
+
+def get_pool():
+    """Devuelve el pool de conexiones del proceso, creándolo la primera vez.
+
+    Se configura con variables de entorno:
+    DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_IDLE_TIMEOUT, DB_POOL_PRE_PING, DB_POOL_RECYCLE
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _connect_args(),
+                    size=int(os.getenv('DB_POOL_SIZE', '5')),
+                    max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                    idle_timeout=float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300')),
+                    pre_ping=os.getenv('DB_POOL_PRE_PING', '1') not in ('0', 'false', 'False'),
+                    recycle=int(os.getenv('DB_POOL_RECYCLE', '1000')),
+                    connect=_open_connection,
+                )
+    return _pool
+
+
+def dispose_pool():
+    """Cierra las conexiones en reposo y descarta el pool del proceso.
+
+    Se usa al terminar un worker del servidor WSGI; la siguiente llamada a
+    `get_connection()` crea un pool nuevo.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.dispose()
+
+
+def pool_stats():
+    """Devuelve las estadísticas del pool (conexiones en uso, esperas, tiempo de espera)."""
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+# Caché de lecturas de tablas de referencia (tipos, servicios, contactos, usuarios).
+# Se configura con DB_CACHE_ENABLED, DB_CACHE_SIZE y DB_CACHE_TTL (segundos).
+_cache = TTLCache(
+    maxsize=int(os.getenv('DB_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('DB_CACHE_TTL', '60')),
+    enabled=os.getenv('DB_CACHE_ENABLED', '1') not in ('0', 'false', 'False'),
+)
+
+
+# Correos sin usuario consultados en el login: solo los fallos, pocos segundos y
+# en una caché propia para que un barrido de correos no desaloje `_cache`.
+_auth_misses = TTLCache(
+    maxsize=int(os.getenv('AUTH_MISS_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('AUTH_MISS_CACHE_TTL', '5')),
+    enabled=_cache.enabled,
+)
+
+
+def cache_stats():
+    """Devuelve los contadores de la caché de tablas de referencia."""
+    return _cache.stats()
+
+
+def table_versions(*tables):
+    """Versiones (por proceso) de `tables` e instante de su último cambio.
+
+    Cada insert_/update_/delete_ incrementa la versión de las tablas que
+    modifica; sirve para validar respuestas (ETag) sin consultar MySQL.
+    """
+    return _cache.versions.snapshot(tables)
+
+
+def cache_clear():
+    """Vacía la caché de tablas de referencia."""
+    _cache.clear()
+
+
+def set_cache_enabled(enabled):
+    """Activa o desactiva la caché de tablas de referencia (p. ej. en pruebas)."""
+    _cache.enabled = _auth_misses.enabled = bool(enabled)
+    if not enabled:
+        _cache.clear()
+        _auth_misses.clear()
 
 
 def get_connection():
-    """Crea y devuelve una conexión a la base de datos MySQL.
+    """Devuelve una conexión a la base de datos MySQL tomada del pool.
 
     Los valores pueden configurarse con variables de entorno:
-    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME, DB_STATEMENT_TIMEOUT
+
+    Al llamar a `close()` la conexión vuelve al pool. Con `DB_POOL_SIZE=0`
+    se desactiva el pool y cada llamada abre una conexión nueva.
+    Salvo con `SQL_INSTRUMENT=0`, la conexión se entrega envuelta por
+    `instrument` para medir las consultas de la petición en curso.
     """
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST', 'localhost'),
-        port=int(os.getenv('DB_PORT', '3306')),
-        user=os.getenv('DB_USER', 'root'),
-        password=os.getenv('DB_PASSWORD', '12345678'),
-        database=os.getenv('DB_NAME', 'sistema_emergencias')
-    )
+    start = time.perf_counter()
+    if os.getenv('DB_POOL_SIZE') == '0':
+        conn = _open_connection(**_connect_args())
+    else:
+        conn = get_pool().acquire()
+    if not instrument.ENABLED:
+        return conn
+    return instrument.wrap_connection(conn, time.perf_counter() - start)
+
+
+# ======================== PAGINACIÓN (KEYSET) ========================
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+
+
+def _page_limit(limit):
+    """Normaliza el tamaño de página al rango [1, PAGE_SIZE_MAX]."""
+    try:
+        limit = int(limit) if limit else PAGE_SIZE_DEFAULT
+    except (TypeError, ValueError):
+        limit = PAGE_SIZE_DEFAULT
+    return max(1, min(limit, PAGE_SIZE_MAX))
+
+
+def _encode_cursor(values):
+    """Codifica los valores de las columnas de orden en un token opaco."""
+    data = [v.isoformat(sep=' ') if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(token, size):
+    """Decodifica un token de `_encode_cursor`. Lanza ValueError si es inválido."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError('Token de paginación inválido')
+    if not isinstance(data, list) or len(data) != size:
+        raise ValueError('Token de paginación inválido')
+    return data
 
 
+def _keyset_condition(keys, values, op):
+    """Condición WHERE para las filas situadas a un lado (`op`) del cursor.
+
+    `keys` es `(id,)` o `(columna, id)`; en el segundo caso la columna puede
+    contener NULL, que MySQL ordena como el valor más pequeño.
+    """
+    if len(keys) == 1:
+        return f"{keys[0]} {op} %s", [values[0]]
+    col, pk = keys
+    value, pk_value = values
+    if op == '<':
+        if value is None:
+            return f"({col} IS NULL AND {pk} < %s)", [pk_value]
+        return f"({col} < %s OR ({col} = %s AND {pk} < %s) OR {col} IS NULL)", [value, value, pk_value]
+    if value is None:
+        return f"({col} IS NOT NULL OR {pk} > %s)", [pk_value]
+    return f"({col} > %s OR ({col} = %s AND {pk} > %s))", [value, value, pk_value]
+
+
+def _fetch_keyset_page(base_sql, keys, descending, after=None, before=None, limit=None,
+                       conditions=(), condition_params=(), base_params=()):
+    """Ejecuta `base_sql` paginado por keyset sobre las columnas `keys`.
+
+    `conditions` son filtros SQL adicionales (unidos con AND) cuyos valores
+    van en `condition_params`; los de `base_sql` van en `base_params`.
+    Devuelve un diccionario con `rows`, `next` y `prev` (tokens para pedir la
+    página siguiente/anterior o None) y `limit`.
+    """
+    limit = _page_limit(limit)
+    forward = not before
+    token = after if forward else before
+    scan_desc = descending == forward
+    clauses = list(conditions)
+    params = list(condition_params)
+    if token:
+        values = _decode_cursor(token, len(keys))
+        condition, keyset_params = _keyset_condition(keys, values, '<' if scan_desc else '>')
+        clauses.append(condition)
+        params.extend(keyset_params)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+    direction = 'DESC' if scan_desc else 'ASC'
+    order = ', '.join(f"{k} {direction}" for k in keys)
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"{base_sql}{where} ORDER BY {order} LIMIT %s", (*base_params, *params, limit + 1))
+        rows = cursor.fetchall()
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+
+    def cursor_of(row):
+        return _encode_cursor([row[k] for k in keys])
+
+    if forward:
+        next_token = cursor_of(rows[-1]) if has_more else None
+        prev_token = (cursor_of(rows[0]) if rows else token) if token else None
+    else:
+        prev_token = cursor_of(rows[0]) if has_more else None
+        next_token = cursor_of(rows[-1]) if rows else token
+    return {'rows': rows, 'next': next_token, 'prev': prev_token, 'limit': limit}
+
+
+@cached(_cache, 'tbusuario')
 def get_all_users():
     """Devuelve lista de usuarios (diccionarios) desde `tbusuario`."""
     conn = None
@@ -43,6 +311,14 @@ def get_all_users():
             conn.close()
 
 
+def get_page_users(after=None, before=None, limit=None):
+    """Devuelve una página de usuarios ordenada por `idUsuario`."""
+    return _fetch_keyset_page(
+        "SELECT idUsuario, nombresApellidosUsuario, emailUsuario, telefonoUsuario FROM tbusuario",
+        ('idUsuario',), False, after, before, limit
+    )
+
+
 def ensure_auto_increment(start=4):
     """Asegura que `tbusuario` tenga AUTO_INCREMENT al menos en `start`.
 
@@ -80,6 +356,8 @@ def ensure_auto_increment(start=4):
             conn.close()
 
 
+@invalidates(_auth_misses, 'tbusuario')
+@invalidates(_cache, 'tbusuario')
 def insert_user(name, email, telefono, **kwargs):
     """Inserta un nuevo usuario en `tbusuario`.
 
@@ -112,6 +390,7 @@ def insert_user(name, email, telefono, **kwargs):
 
         cursor.execute(insert_sql, values)
         conn.commit()
+        events.publish('usuario_creado', {'idUsuario': cursor.lastrowid, 'fechaRegistro': fecha})
         return cursor.lastrowid
     except Error as e:
         if conn:
@@ -124,6 +403,7 @@ def insert_user(name, email, telefono, **kwargs):
             conn.close()
 
 
+@cached(_cache, 'tbtipoemergencia')
 def get_all_tipoemergencia():
     """Devuelve todos los registros de `tbtipoemergencia` como lista de dicts."""
     conn = None
@@ -166,6 +446,8 @@ def get_user(user_id):
             conn.close()
 
 
+@invalidates(_auth_misses, 'tbusuario')
+@invalidates(_cache, 'tbusuario')
 def update_user(user_id, cedula, nombres, telefono, contacto, tipo, direccion, email, fecha, estado):
     """Actualiza un usuario. Devuelve filas afectadas."""
     conn = None
@@ -192,6 +474,7 @@ def update_user(user_id, cedula, nombres, telefono, contacto, tipo, direccion, e
             conn.close()
 
 
+@invalidates(_cache, 'tbusuario', 'tbemergencia', 'tbhistorialestados', 'tbdespacho', 'tbreporteduplicado')
 def delete_user(user_id):
     """Elimina un usuario. Devuelve filas afectadas."""
     conn = None
@@ -201,6 +484,8 @@ def delete_user(user_id):
         cursor = conn.cursor()
         cursor.execute("DELETE FROM tbusuario WHERE idUsuario = %s", (user_id,))
         conn.commit()
+        if cursor.rowcount:
+            events.publish('usuario_eliminado', {'idUsuario': user_id})
         return cursor.rowcount
     except Error:
         if conn:
@@ -213,6 +498,7 @@ def delete_user(user_id):
             conn.close()
 
 
+@cached(_cache, 'tbtipoemergencia')
 def get_tipoemergencia(tipo_id):
     """Devuelve un registro por `idTipoEmergencia` como diccionario o None."""
     conn = None
@@ -234,6 +520,7 @@ def get_tipoemergencia(tipo_id):
             conn.close()
 
 
+@invalidates(_cache, 'tbtipoemergencia')
 def insert_tipoemergencia(nombre, descripcion, nivel, estado):
     """Inserta un nuevo tipo de emergencia y devuelve el id insertado."""
     conn = None
@@ -260,6 +547,7 @@ def insert_tipoemergencia(nombre, descripcion, nivel, estado):
             conn.close()
 
 
+@invalidates(_cache, 'tbtipoemergencia')
 def update_tipoemergencia(tipo_id, nombre, descripcion, nivel, estado):
     """Actualiza un tipo de emergencia. Devuelve el número de filas afectadas."""
     conn = None
@@ -286,6 +574,7 @@ def update_tipoemergencia(tipo_id, nombre, descripcion, nivel, estado):
             conn.close()
 
 
+@invalidates(_cache, 'tbtipoemergencia', 'tbcontactoemergencia', 'tbemergencia', 'tbhistorialestados', 'tbdespacho', 'tbreporteduplicado')
 def delete_tipoemergencia(tipo_id):
     """Elimina un tipo de emergencia. Devuelve filas afectadas."""
     conn = None
@@ -307,6 +596,7 @@ def delete_tipoemergencia(tipo_id):
             conn.close()
 
 
+@cached(_cache, 'tbservicioemergencia')
 def get_all_servicioemergencia():
     """Devuelve todos los registros de `tbservicioemergencia` como lista de dicts."""
     conn = None
@@ -315,7 +605,7 @@ def get_all_servicioemergencia():
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         cursor.execute(
-            "SELECT idServicioEmergencia, nombreServicioEmergencia, tipoServicioEmergencia, telefonoServicioEmergencia, disponibilidadServicioEmergencia, direccionBaseServicioEmergencia, capacidadAtencionServicioEmergencia, horarioServicioEmergencia, especialidadServicioEmergencia, estadoServicioEmergencia FROM tbservicioemergencia ORDER BY idServicioEmergencia"
+            "SELECT idServicioEmergencia, nombreServicioEmergencia, tipoServicioEmergencia, telefonoServicioEmergencia, disponibilidadServicioEmergencia, direccionBaseServicioEmergencia, capacidadAtencionServicioEmergencia, horarioServicioEmergencia, especialidadServicioEmergencia, estadoServicioEmergencia, latitudServicioEmergencia, longitudServicioEmergencia FROM tbservicioemergencia ORDER BY idServicioEmergencia"
         )
         rows = cursor.fetchall()
         return rows
@@ -328,6 +618,7 @@ def get_all_servicioemergencia():
             conn.close()
 
 
+@cached(_cache, 'tbservicioemergencia')
 def get_servicioemergencia(servicio_id):
     """Devuelve un registro por `idServicioEmergencia` como diccionario o None."""
     conn = None
@@ -336,7 +627,7 @@ def get_servicioemergencia(servicio_id):
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         cursor.execute(
-            "SELECT idServicioEmergencia, nombreServicioEmergencia, tipoServicioEmergencia, telefonoServicioEmergencia, disponibilidadServicioEmergencia, direccionBaseServicioEmergencia, capacidadAtencionServicioEmergencia, horarioServicioEmergencia, especialidadServicioEmergencia, estadoServicioEmergencia FROM tbservicioemergencia WHERE idServicioEmergencia = %s",
+            "SELECT idServicioEmergencia, nombreServicioEmergencia, tipoServicioEmergencia, telefonoServicioEmergencia, disponibilidadServicioEmergencia, direccionBaseServicioEmergencia, capacidadAtencionServicioEmergencia, horarioServicioEmergencia, especialidadServicioEmergencia, estadoServicioEmergencia, latitudServicioEmergencia, longitudServicioEmergencia FROM tbservicioemergencia WHERE idServicioEmergencia = %s",
             (servicio_id,)
         )
         return cursor.fetchone()
@@ -349,7 +640,8 @@ def get_servicioemergencia(servicio_id):
             conn.close()
 
 
-def insert_servicioemergencia(nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado):
+@invalidates(_cache, 'tbservicioemergencia')
+def insert_servicioemergencia(nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado, latitud=None, longitud=None):
     """Inserta un nuevo servicio de emergencia y devuelve el id insertado."""
     conn = None
     cursor = None
@@ -358,10 +650,10 @@ def insert_servicioemergencia(nombre, tipo, telefono, disponibilidad, direccion,
         cursor = conn.cursor()
         sql = """
         INSERT INTO tbservicioemergencia
-        (nombreServicioEmergencia, tipoServicioEmergencia, telefonoServicioEmergencia, disponibilidadServicioEmergencia, direccionBaseServicioEmergencia, capacidadAtencionServicioEmergencia, horarioServicioEmergencia, especialidadServicioEmergencia, estadoServicioEmergencia)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        (nombreServicioEmergencia, tipoServicioEmergencia, telefonoServicioEmergencia, disponibilidadServicioEmergencia, direccionBaseServicioEmergencia, capacidadAtencionServicioEmergencia, horarioServicioEmergencia, especialidadServicioEmergencia, estadoServicioEmergencia, latitudServicioEmergencia, longitudServicioEmergencia)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
         """
-        cursor.execute(sql, (nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado))
+        cursor.execute(sql, (nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado, latitud, longitud))
         conn.commit()
         return cursor.lastrowid
     except Error:
@@ -375,7 +667,8 @@ def insert_servicioemergencia(nombre, tipo, telefono, disponibilidad, direccion,
             conn.close()
 
 
-def update_servicioemergencia(servicio_id, nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado):
+@invalidates(_cache, 'tbservicioemergencia')
+def update_servicioemergencia(servicio_id, nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado, latitud=None, longitud=None):
     """Actualiza un servicio de emergencia. Devuelve el número de filas afectadas."""
     conn = None
     cursor = None
@@ -384,10 +677,10 @@ def update_servicioemergencia(servicio_id, nombre, tipo, telefono, disponibilida
         cursor = conn.cursor()
         sql = """
         UPDATE tbservicioemergencia
-        SET nombreServicioEmergencia=%s, tipoServicioEmergencia=%s, telefonoServicioEmergencia=%s, disponibilidadServicioEmergencia=%s, direccionBaseServicioEmergencia=%s, capacidadAtencionServicioEmergencia=%s, horarioServicioEmergencia=%s, especialidadServicioEmergencia=%s, estadoServicioEmergencia=%s
+        SET nombreServicioEmergencia=%s, tipoServicioEmergencia=%s, telefonoServicioEmergencia=%s, disponibilidadServicioEmergencia=%s, direccionBaseServicioEmergencia=%s, capacidadAtencionServicioEmergencia=%s, horarioServicioEmergencia=%s, especialidadServicioEmergencia=%s, estadoServicioEmergencia=%s, latitudServicioEmergencia=%s, longitudServicioEmergencia=%s
         WHERE idServicioEmergencia=%s
         """
-        cursor.execute(sql, (nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado, servicio_id))
+        cursor.execute(sql, (nombre, tipo, telefono, disponibilidad, direccion, capacidad, horario, especialidad, estado, latitud, longitud, servicio_id))
         conn.commit()
         return cursor.rowcount
     except Error:
@@ -401,6 +694,7 @@ def update_servicioemergencia(servicio_id, nombre, tipo, telefono, disponibilida
             conn.close()
 
 
+@invalidates(_cache, 'tbservicioemergencia', 'tbdespacho')
 def delete_servicioemergencia(servicio_id):
     """Elimina un servicio de emergencia. Devuelve filas afectadas."""
     conn = None
@@ -422,8 +716,61 @@ def delete_servicioemergencia(servicio_id):
             conn.close()
 
 
+# ======================== BÚSQUEDA GEOGRÁFICA ========================
+
+_geo_index = None
+_geo_state = (None, 0.0)  # (generación de la caché de servicios, instante de construcción)
+_geo_lock = threading.Lock()
+
+
+def _servicio_disponible(servicio):
+    """Un servicio es candidato si está activo y no figura como ocupado o fuera de servicio."""
+    estado = (servicio.get('estadoServicioEmergencia') or '').lower()
+    disponibilidad = (servicio.get('disponibilidadServicioEmergencia') or '').lower()
+    return estado != 'inactivo' and disponibilidad in ('', 'disponible')
+
+
+def _get_servicio_index():
+    """Devuelve el índice espacial de servicios, reconstruyéndolo si la tabla cambió.
+
+    Se reconstruye cuando un insert_/update_/delete_ de servicios invalida la
+    caché de este proceso, o cuando pasa el TTL de la caché (cambios hechos
+    por otros procesos).
+    """
+    global _geo_index, _geo_state
+    generation = _cache.generation('tbservicioemergencia')
+    built_generation, built_at = _geo_state
+    if _geo_index is None or built_generation != generation or time.monotonic() - built_at > _cache.ttl:
+        with _geo_lock:
+            built_generation, built_at = _geo_state
+            if _geo_index is None or built_generation != generation or time.monotonic() - built_at > _cache.ttl:
+                servicios = get_all_servicioemergencia()
+                _geo_index = GridIndex(
+                    (s['latitudServicioEmergencia'], s['longitudServicioEmergencia'], s) for s in servicios
+                )
+                _geo_state = (generation, time.monotonic())
+    return _geo_index
+
+
+def get_nearest_servicioemergencia(latitud, longitud, k=5, solo_disponibles=True):
+    """Devuelve los `k` servicios más cercanos a la coordenada, del más cercano al más lejano.
+
+    Cada servicio es una copia del diccionario de `get_servicioemergencia` con
+    la clave adicional `distanciaKm`. Los servicios sin coordenadas no se incluyen.
+    """
+    index = _get_servicio_index()
+    predicate = _servicio_disponible if solo_disponibles else None
+    result = []
+    for distance, servicio in index.nearest(latitud, longitud, k, predicate):
+        item = dict(servicio)
+        item['distanciaKm'] = round(distance, 3)
+        result.append(item)
+    return result
+
+
 # ======================== CONTACTO DE EMERGENCIA ========================
 
+@cached(_cache, 'tbcontactoemergencia')
 def get_all_contactoemergencia():
     """Devuelve todos los registros de `tbcontactoemergencia` como lista de dicts."""
     conn = None
@@ -445,6 +792,7 @@ def get_all_contactoemergencia():
             conn.close()
 
 
+@cached(_cache, 'tbcontactoemergencia')
 def get_contactoemergencia(contacto_id):
     """Devuelve un registro por `idContactoEmergencia` como diccionario o None."""
     conn = None
@@ -466,6 +814,7 @@ def get_contactoemergencia(contacto_id):
             conn.close()
 
 
+@invalidates(_cache, 'tbcontactoemergencia')
 def insert_contactoemergencia(tipo_id, nombre, telefono, tipo, descripcion, estado):
     """Inserta un nuevo contacto de emergencia y devuelve el id insertado."""
     conn = None
@@ -492,6 +841,7 @@ def insert_contactoemergencia(tipo_id, nombre, telefono, tipo, descripcion, esta
             conn.close()
 
 
+@invalidates(_cache, 'tbcontactoemergencia')
 def update_contactoemergencia(contacto_id, tipo_id, nombre, telefono, tipo, descripcion, estado):
     """Actualiza un contacto de emergencia. Devuelve el número de filas afectadas."""
     conn = None
@@ -518,6 +868,7 @@ def update_contactoemergencia(contacto_id, tipo_id, nombre, telefono, tipo, desc
             conn.close()
 
 
+@invalidates(_cache, 'tbcontactoemergencia')
 def delete_contactoemergencia(contacto_id):
     """Elimina un contacto de emergencia. Devuelve filas afectadas."""
     conn = None
@@ -562,18 +913,33 @@ def get_all_emergencia():
             conn.close()
 
 
-def get_emergencia(emergencia_id):
-    """Devuelve un registro por `idEmergencia` como diccionario o None."""
+def get_page_emergencia(after=None, before=None, limit=None):
+    """Devuelve una página de `tbemergencia` ordenada por `idEmergencia`."""
+    return _fetch_keyset_page(
+        "SELECT idEmergencia, tbUsuario_idUsuario, tbTipoEmergencia_idTipoEmergencia, codigoEmergencia, fechaHoraEmergencia, tipoEmergencia, estadoEmergencia, ubicacionEmergencia, latitudEmergencia, longitudEmergencia, descripcionEmergencia, prioridadEmergencia, idusuarioreportaEmergencia, fechaCierreEmergencia, observacionesEmergencia FROM tbemergencia",
+        ('idEmergencia',), False, after, before, limit
+    )
+
+
+def get_emergencia(emergencia_id, archivo=False):
+    """Devuelve un registro por `idEmergencia` como diccionario o None.
+
+    Con `archivo=True`, si no está en `tbemergencia` se busca en `tbemergencia_archivo`.
+    """
     conn = None
     cursor = None
     try:
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute(
-            "SELECT idEmergencia, tbUsuario_idUsuario, tbTipoEmergencia_idTipoEmergencia, codigoEmergencia, fechaHoraEmergencia, tipoEmergencia, estadoEmergencia, ubicacionEmergencia, latitudEmergencia, longitudEmergencia, descripcionEmergencia, prioridadEmergencia, idusuarioreportaEmergencia, fechaCierreEmergencia, observacionesEmergencia FROM tbemergencia WHERE idEmergencia = %s",
-            (emergencia_id,)
-        )
-        return cursor.fetchone()
+        for table in ('tbemergencia', 'tbemergencia_archivo') if archivo else ('tbemergencia',):
+            cursor.execute(
+                f"SELECT idEmergencia, tbUsuario_idUsuario, tbTipoEmergencia_idTipoEmergencia, codigoEmergencia, fechaHoraEmergencia, tipoEmergencia, estadoEmergencia, ubicacionEmergencia, latitudEmergencia, longitudEmergencia, descripcionEmergencia, prioridadEmergencia, idusuarioreportaEmergencia, fechaCierreEmergencia, observacionesEmergencia FROM {table} WHERE idEmergencia = %s",
+                (emergencia_id,)
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                return row
+        return None
     except Error:
         raise
     finally:
@@ -597,6 +963,12 @@ def insert_emergencia(usuario_id, tipoemergencia_id, codigo, fecha_hora, tipo, e
         """
         cursor.execute(sql, (usuario_id, tipoemergencia_id, codigo, fecha_hora, tipo, estado, ubicacion, latitud, longitud, descripcion, prioridad, idusuarioreporta, fecha_cierre, observaciones))
         conn.commit()
+        _cache.invalidate(('tbemergencia', usuario_id))
+        events.publish('emergencia_creada', events.emergencia_event({
+            'idEmergencia': cursor.lastrowid, 'estado': estado, 'prioridad': prioridad,
+            'fecha_hora': fecha_hora, 'ubicacion': ubicacion, 'usuario_id': usuario_id,
+            'tipoemergencia_id': tipoemergencia_id,
+        }))
         return cursor.lastrowid
     except Error:
         if conn:
@@ -609,6 +981,7 @@ def insert_emergencia(usuario_id, tipoemergencia_id, codigo, fecha_hora, tipo, e
             conn.close()
 
 
+@invalidates(_cache, 'tbemergencia')
 def update_emergencia(emergencia_id, usuario_id, tipoemergencia_id, codigo, fecha_hora, tipo, estado, ubicacion, latitud, longitud, descripcion, prioridad, idusuarioreporta, fecha_cierre, observaciones):
     """Actualiza una emergencia. Devuelve el número de filas afectadas."""
     conn = None
@@ -623,6 +996,12 @@ def update_emergencia(emergencia_id, usuario_id, tipoemergencia_id, codigo, fech
         """
         cursor.execute(sql, (usuario_id, tipoemergencia_id, codigo, fecha_hora, tipo, estado, ubicacion, latitud, longitud, descripcion, prioridad, idusuarioreporta, fecha_cierre, observaciones, emergencia_id))
         conn.commit()
+        if cursor.rowcount:
+            events.publish('emergencia_actualizada', events.emergencia_event({
+                'idEmergencia': emergencia_id, 'estado': estado, 'prioridad': prioridad,
+                'fecha_hora': fecha_hora, 'ubicacion': ubicacion, 'usuario_id': usuario_id,
+                'tipoemergencia_id': tipoemergencia_id,
+            }))
         return cursor.rowcount
     except Error:
         if conn:
@@ -635,6 +1014,7 @@ def update_emergencia(emergencia_id, usuario_id, tipoemergencia_id, codigo, fech
             conn.close()
 
 
+@invalidates(_cache, 'tbemergencia', 'tbhistorialestados', 'tbdespacho', 'tbreporteduplicado')
 def delete_emergencia(emergencia_id):
     """Elimina una emergencia. Devuelve filas afectadas."""
     conn = None
@@ -644,6 +1024,8 @@ def delete_emergencia(emergencia_id):
         cursor = conn.cursor()
         cursor.execute("DELETE FROM tbemergencia WHERE idEmergencia = %s", (emergencia_id,))
         conn.commit()
+        if cursor.rowcount:
+            events.publish('emergencia_eliminada', {'idEmergencia': emergencia_id})
         return cursor.rowcount
     except Error:
         if conn:
@@ -677,6 +1059,14 @@ def get_all_historialestados():
             conn.close()
 
 
+def get_page_historialestados(after=None, before=None, limit=None):
+    """Devuelve una página del historial, del cambio más reciente al más antiguo."""
+    return _fetch_keyset_page(
+        "SELECT idHistorialEstados, tbEmergencia_idEmergencia, tbUsuario_idUsuario, estadoAnterior, estadoNuevo, fechaCambioHistorialEstados, usuarioCambioHistorialEstados, motivoHistorialEstados FROM tbhistorialestados",
+        ('fechaCambioHistorialEstados', 'idHistorialEstados'), True, after, before, limit
+    )
+
+
 def get_historialestados(historial_id):
     """Devuelve un registro del historial por id."""
     conn = None
@@ -698,6 +1088,7 @@ def get_historialestados(historial_id):
             conn.close()
 
 
+@invalidates(_cache, 'tbhistorialestados')
 def insert_historialestados(emergencia_id, usuario_id, estado_anterior, estado_nuevo, fecha_cambio, usuario_cambio, motivo):
     """Inserta un nuevo registro de historial de estados."""
     conn = None
@@ -712,6 +1103,10 @@ def insert_historialestados(emergencia_id, usuario_id, estado_anterior, estado_n
         """
         cursor.execute(sql, (emergencia_id, usuario_id, estado_anterior, estado_nuevo, fecha_cambio, usuario_cambio, motivo))
         conn.commit()
+        events.publish('estado_cambiado', {
+            'idEmergencia': emergencia_id, 'estadoAnterior': estado_anterior, 'estadoNuevo': estado_nuevo,
+            'fechaCambio': fecha_cambio,
+        })
         return cursor.lastrowid
     except Error:
         if conn:
@@ -724,6 +1119,7 @@ def insert_historialestados(emergencia_id, usuario_id, estado_anterior, estado_n
             conn.close()
 
 
+@invalidates(_cache, 'tbhistorialestados')
 def update_historialestados(historial_id, emergencia_id, usuario_id, estado_anterior, estado_nuevo, fecha_cambio, usuario_cambio, motivo):
     """Actualiza un registro del historial."""
     conn = None
@@ -750,6 +1146,7 @@ def update_historialestados(historial_id, emergencia_id, usuario_id, estado_ante
             conn.close()
 
 
+@invalidates(_cache, 'tbhistorialestados')
 def delete_historialestados(historial_id):
     """Elimina un registro del historial."""
     conn = None
@@ -770,6 +1167,136 @@ def delete_historialestados(historial_id):
         if conn and conn.is_connected():
             conn.close()
 
+# ======================== MÁQUINA DE ESTADOS ========================
+
+# estadoEmergencia -> estados a los que puede pasar. Una emergencia sin estado cuenta como 'reportada'.
+TRANSICIONES = {
+    'reportada': ('en_proceso',),
+    'en_proceso': ('atendida',),
+    'atendida': ('cerrada',),
+    'cerrada': (),
+}
+
+
+def validar_transicion(estado_actual, estado_nuevo):
+    """Lanza ValueError si no se permite pasar de `estado_actual` a `estado_nuevo`."""
+    if estado_nuevo not in TRANSICIONES:
+        raise ValueError(f"Estado desconocido: {estado_nuevo}")
+    actual = estado_actual or 'reportada'
+    if estado_nuevo not in TRANSICIONES.get(actual, ()):
+        raise ValueError(f"Transición no permitida: {actual} -> {estado_nuevo}")
+
+
+def _in_list(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+@invalidates(_cache, 'tbemergencia', 'tbhistorialestados')
+def cambiar_estado_emergencias(emergencia_ids, estado_nuevo, usuario_id, usuario_cambio=None, motivo=None, fecha=None, strict=False):
+    """Cambia el estado de varias emergencias en una sola transacción.
+
+    Valida cada transición con `TRANSICIONES`, actualiza `estadoEmergencia`
+    (y `fechaCierreEmergencia` al cerrar) y añade una fila por emergencia a
+    `tbhistorialestados`, con una conexión y un único commit. Las emergencias
+    inexistentes o con una transición no permitida se omiten y se informan en
+    `errores`; con `strict=True` se lanza ValueError y no se cambia ninguna.
+    Si otra transacción cambia el estado de alguna entre la lectura y la
+    escritura, se deshace todo y se lanza ValueError.
+
+    Devuelve `{'cambiadas': [ids], 'historial': {id: idHistorialEstados}, 'errores': [{'idEmergencia': id, 'error': msg}, ...]}`.
+    """
+    if estado_nuevo not in TRANSICIONES:
+        raise ValueError(f"Estado desconocido: {estado_nuevo}")
+    ids = list(dict.fromkeys(int(emergencia_id) for emergencia_id in emergencia_ids))
+    fecha = fecha or datetime.now()
+    cierre = fecha if estado_nuevo == 'cerrada' else None
+    result = {'cambiadas': [], 'historial': {}, 'errores': []}
+    if not ids:
+        return result
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        actuales = {}
+        for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+            chunk = ids[start:start + BATCH_CHUNK_SIZE]
+            cursor.execute(f"SELECT idEmergencia, estadoEmergencia FROM tbemergencia WHERE idEmergencia IN ({_in_list(chunk)})", chunk)
+            actuales.update((row[0], row[1]) for row in cursor.fetchall())
+
+        grupos = {}
+        for emergencia_id in ids:
+            if emergencia_id not in actuales:
+                result['errores'].append({'idEmergencia': emergencia_id, 'error': 'Emergencia no encontrada'})
+                continue
+            try:
+                validar_transicion(actuales[emergencia_id], estado_nuevo)
+            except ValueError as e:
+                result['errores'].append({'idEmergencia': emergencia_id, 'error': str(e)})
+                continue
+            grupos.setdefault(actuales[emergencia_id], []).append(emergencia_id)
+            result['cambiadas'].append(emergencia_id)
+        if strict and result['errores']:
+            raise ValueError(result['errores'][0]['error'])
+
+        # El UPDATE repite el estado leído en el WHERE: si otra transacción lo
+        # cambió entretanto, afecta a menos filas y se deshace el lote entero.
+        set_sql = "estadoEmergencia = %s" + (", fechaCierreEmergencia = %s" if cierre else "")
+        set_params = (estado_nuevo, cierre) if cierre else (estado_nuevo,)
+        for anterior, grupo in grupos.items():
+            condition = "estadoEmergencia IS NULL" if anterior is None else "estadoEmergencia = %s"
+            condition_params = () if anterior is None else (anterior,)
+            for start in range(0, len(grupo), BATCH_CHUNK_SIZE):
+                chunk = grupo[start:start + BATCH_CHUNK_SIZE]
+                cursor.execute(
+                    f"UPDATE tbemergencia SET {set_sql} WHERE idEmergencia IN ({_in_list(chunk)}) AND {condition}",
+                    (*set_params, *chunk, *condition_params)
+                )
+                if cursor.rowcount != len(chunk):
+                    raise ValueError("El estado de alguna emergencia cambió durante la operación; vuelva a intentarlo")
+
+        row_sql = "(%s,%s,%s,%s,%s,%s,%s)"
+        cambiadas = result['cambiadas']
+        for start in range(0, len(cambiadas), BATCH_CHUNK_SIZE):
+            chunk = cambiadas[start:start + BATCH_CHUNK_SIZE]
+            cursor.execute(
+                "INSERT INTO tbhistorialestados (tbEmergencia_idEmergencia, tbUsuario_idUsuario, estadoAnterior, estadoNuevo, fechaCambioHistorialEstados, usuarioCambioHistorialEstados, motivoHistorialEstados) VALUES "
+                + ','.join([row_sql] * len(chunk)),
+                [value for emergencia_id in chunk
+                 for value in (emergencia_id, usuario_id, actuales[emergencia_id], estado_nuevo, fecha, usuario_cambio, motivo)]
+            )
+            first_id = cursor.lastrowid
+            for offset, emergencia_id in enumerate(chunk):
+                result['historial'][emergencia_id] = first_id + offset
+        conn.commit()
+    except (Error, ValueError):
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+    # `aplicado`: además del historial, `estadoEmergencia` ya tiene el estado nuevo.
+    for emergencia_id in result['cambiadas']:
+        events.publish('estado_cambiado', {
+            'idEmergencia': emergencia_id, 'estadoAnterior': actuales[emergencia_id], 'estadoNuevo': estado_nuevo,
+            'fechaCambio': fecha, 'aplicado': True,
+        })
+    return result
+
+
+def cambiar_estado_emergencia(emergencia_id, estado_nuevo, usuario_id, usuario_cambio=None, motivo=None, fecha=None):
+    """Cambia el estado de una emergencia y registra el historial en la misma transacción.
+
+    Devuelve el id del historial. Lanza ValueError si la emergencia no existe
+    o la transición no está permitida.
+    """
+    result = cambiar_estado_emergencias([emergencia_id], estado_nuevo, usuario_id, usuario_cambio, motivo, fecha, strict=True)
+    return result['historial'][int(emergencia_id)]
+
+
 # CRUD para tbdespacho
 def get_all_despacho():
     """Devuelve todos los registros de despachos."""
@@ -791,6 +1318,14 @@ def get_all_despacho():
             conn.close()
 
 
+def get_page_despacho(after=None, before=None, limit=None):
+    """Devuelve una página de despachos, de la asignación más reciente a la más antigua."""
+    return _fetch_keyset_page(
+        "SELECT idDespacho, tbServicioEmergencia_idServicioEmergencia, tbEmergencia_idEmergencia, idServicio, horaAsignacionDespacho, horaLlegadaDespacho, horaFinalizacionDespacho, estadoDespacho, observacionesDespacho, tiempoRespuestaDespacho, calificacionDespacho FROM tbdespacho",
+        ('horaAsignacionDespacho', 'idDespacho'), True, after, before, limit
+    )
+
+
 def get_despacho(despacho_id):
     """Devuelve un registro de despacho por id."""
     conn = None
@@ -812,6 +1347,7 @@ def get_despacho(despacho_id):
             conn.close()
 
 
+@invalidates(_cache, 'tbdespacho')
 def insert_despacho(servicio_id, emergencia_id, id_servicio, hora_asignacion, hora_llegada, hora_finalizacion, estado, observaciones, tiempo_respuesta, calificacion):
     """Inserta un nuevo registro de despacho."""
     conn = None
@@ -826,6 +1362,9 @@ def insert_despacho(servicio_id, emergencia_id, id_servicio, hora_asignacion, ho
         """
         cursor.execute(sql, (servicio_id, emergencia_id, id_servicio, hora_asignacion, hora_llegada, hora_finalizacion, estado, observaciones, tiempo_respuesta, calificacion))
         conn.commit()
+        events.publish('despacho_creado', {
+            'idDespacho': cursor.lastrowid, 'idEmergencia': emergencia_id, 'servicio': servicio_id, 'estado': estado,
+        })
         return cursor.lastrowid
     except Error:
         if conn:
@@ -838,6 +1377,7 @@ def insert_despacho(servicio_id, emergencia_id, id_servicio, hora_asignacion, ho
             conn.close()
 
 
+@invalidates(_cache, 'tbdespacho')
 def update_despacho(despacho_id, servicio_id, emergencia_id, id_servicio, hora_asignacion, hora_llegada, hora_finalizacion, estado, observaciones, tiempo_respuesta, calificacion):
     """Actualiza un registro de despacho."""
     conn = None
@@ -852,6 +1392,10 @@ def update_despacho(despacho_id, servicio_id, emergencia_id, id_servicio, hora_a
         """
         cursor.execute(sql, (servicio_id, emergencia_id, id_servicio, hora_asignacion, hora_llegada, hora_finalizacion, estado, observaciones, tiempo_respuesta, calificacion, despacho_id))
         conn.commit()
+        if cursor.rowcount:
+            events.publish('despacho_actualizado', {
+                'idDespacho': despacho_id, 'idEmergencia': emergencia_id, 'servicio': servicio_id, 'estado': estado,
+            })
         return cursor.rowcount
     except Error:
         if conn:
@@ -864,6 +1408,7 @@ def update_despacho(despacho_id, servicio_id, emergencia_id, id_servicio, hora_a
             conn.close()
 
 
+@invalidates(_cache, 'tbdespacho')
 def delete_despacho(despacho_id):
     """Elimina un registro de despacho."""
     conn = None
@@ -873,6 +1418,8 @@ def delete_despacho(despacho_id):
         cursor = conn.cursor()
         cursor.execute("DELETE FROM tbdespacho WHERE idDespacho = %s", (despacho_id,))
         conn.commit()
+        if cursor.rowcount:
+            events.publish('despacho_eliminado', {'idDespacho': despacho_id})
         return cursor.rowcount
     except Error:
         if conn:
@@ -884,22 +1431,91 @@ def delete_despacho(despacho_id):
         if conn and conn.is_connected():
             conn.close()
 
+# Un despacho está activo mientras no esté finalizado (NULL incluido). Es la
+# única definición: la usan las consultas de aquí y los contadores en memoria
+# de `dashboard.py` y `dispatch.py`.
+DESPACHO_FINALIZADO = 'finalizado'
+_DESPACHO_ACTIVO_SQL = "(estadoDespacho <> 'finalizado' OR estadoDespacho IS NULL)"
+
+
+def despacho_activo(estado):
+    """Indica si un despacho con `estado` cuenta como activo."""
+    return estado != DESPACHO_FINALIZADO
+
+
+def get_despachos_activos():
+    """Despachos no finalizados como `(idDespacho, idServicioEmergencia)` (carga de cada servicio)."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT idDespacho, tbServicioEmergencia_idServicioEmergencia FROM tbdespacho WHERE " + _DESPACHO_ACTIVO_SQL
+        )
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+def iter_despacho_tiempos(after_id=0, ids=None, batch_size=5000):
+    """Recorre los despachos por bloques de tuplas, en orden de `idDespacho`.
+
+    Cada tupla es `(idDespacho, idServicioEmergencia, horaAsignacionDespacho,
+    horaLlegadaDespacho, tiempoRespuestaDespacho, calificacionDespacho)`. Se lee
+    con `fetchmany` sobre un cursor sin buffer, así que la memoria no depende
+    del tamaño de la tabla. Con `ids` solo se leen esos despachos.
+    """
+    sql = "SELECT idDespacho, tbServicioEmergencia_idServicioEmergencia, horaAsignacionDespacho, horaLlegadaDespacho, tiempoRespuestaDespacho, calificacionDespacho FROM tbdespacho"
+    if ids is None:
+        queries = [(sql + " WHERE idDespacho > %s ORDER BY idDespacho", (after_id,))]
+    else:
+        ids = sorted(ids)
+        queries = [
+            (sql + f" WHERE idDespacho IN ({', '.join(['%s'] * len(chunk))}) ORDER BY idDespacho", tuple(chunk))
+            for chunk in (ids[start:start + BATCH_CHUNK_SIZE] for start in range(0, len(ids), BATCH_CHUNK_SIZE))
+        ]
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        for query, params in queries:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            cursor = None
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
 # FUNCIONES DE AUTENTICACIÓN
 def hash_password(password):
-    """Genera un hash seguro de una contraseña."""
-    salt = secrets.token_hex(32)
-    pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-    return f"{salt}${pwd_hash.hex()}"
+    """Genera un hash seguro de una contraseña (calculado en el pool de `passwords`)."""
+    return get_hasher().hash(password)
 
 
 def verify_password(password, hash_password_stored):
-    """Verifica si una contraseña coincide con su hash."""
-    try:
-        salt, pwd_hash = hash_password_stored.split('$')
-        pwd_hash_attempt = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-        return pwd_hash_attempt.hex() == pwd_hash
-    except:
-        return False
+    """Verifica si una contraseña coincide con su hash.
+
+    Los errores del pool de hashing (`PasswordBusyError`, pool roto) se
+    propagan: no son una contraseña incorrecta.
+    """
+    return get_hasher().verify(password, hash_password_stored)
 
 
 def user_exists_by_email(email):
@@ -921,6 +1537,8 @@ def user_exists_by_email(email):
             conn.close()
 
 
+@invalidates(_auth_misses, 'tbusuario')
+@invalidates(_cache, 'tbusuario')
 def register_user(cedula, nombres_apellidos, email, telefono, direccion, password):
     """Registra un nuevo usuario en el sistema."""
     conn = None
@@ -938,11 +1556,11 @@ def register_user(cedula, nombres_apellidos, email, telefono, direccion, passwor
         
         sql = """
         INSERT INTO tbusuario
-        (cedulaUsuario, nombresApellidosUsuario, emailUsuario, telefonoUsuario, direccionUsuario, estadoUsuario, fechaRegistroUsuario, tipoUsuario)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        (cedulaUsuario, nombresApellidosUsuario, emailUsuario, telefonoUsuario, direccionUsuario, estadoUsuario, fechaRegistroUsuario, tipoUsuario, passwordUsuario)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         
-        cursor.execute(sql, (cedula, nombres_apellidos, email, telefono, direccion, 'activo', datetime.now(), f'cliente|{password_hash}'))
+        cursor.execute(sql, (cedula, nombres_apellidos, email, telefono, direccion, 'activo', datetime.now(), 'cliente', password_hash))
         conn.commit()
         return cursor.lastrowid
     except ValueError:
@@ -958,28 +1576,39 @@ def register_user(cedula, nombres_apellidos, email, telefono, direccion, passwor
             conn.close()
 
 
-def authenticate_user(email, password):
-    """Autentica un usuario y retorna sus datos si son válidos."""
+# Hash de referencia para igualar el tiempo de respuesta cuando el correo no existe.
+_DUMMY_PASSWORD_HASH = None
+
+
+def _get_auth_row(email):
+    """Lee en una sola consulta (por el índice de `emailUsuario`) los datos de login.
+
+    Las filas encontradas no se cachean (un cambio de contraseña o de rol en
+    otro proceso debe verse en el siguiente login). Solo los correos que no
+    existen se recuerdan en `_auth_misses` durante `AUTH_MISS_CACHE_TTL`
+    segundos, para que los intentos repetidos no lleguen a MySQL.
+    """
+    key = ('tbusuario', (email or '').strip().lower())
+    if _auth_misses.enabled and _auth_misses.get(key) is True:
+        return None
+    generation = _auth_misses.generation('tbusuario')
+    row = _select_auth_row(email)
+    if row is None and _auth_misses.enabled:
+        _auth_misses.set(key, True, generation)
+    return row
+
+
+def _select_auth_row(email):
     conn = None
     cursor = None
     try:
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT idUsuario, nombresApellidosUsuario, emailUsuario, tipoUsuario FROM tbusuario WHERE emailUsuario = %s", (email,))
-        user = cursor.fetchone()
-        
-        if user:
-            # Obtener la contraseña hasheada desde tipoUsuario (formato: role|hash)
-            cursor.execute("SELECT tipoUsuario FROM tbusuario WHERE idUsuario = %s", (user['idUsuario'],))
-            result = cursor.fetchone()
-            tipo_usuario = result['tipoUsuario']
-            
-            if '|' in tipo_usuario:
-                role, password_hash = tipo_usuario.split('|', 1)
-                if verify_password(password, password_hash):
-                    return user
-        
-        return None
+        cursor.execute(
+            "SELECT idUsuario, nombresApellidosUsuario, emailUsuario, tipoUsuario, passwordUsuario FROM tbusuario WHERE emailUsuario = %s LIMIT 1",
+            (email,)
+        )
+        return cursor.fetchone()
     except Error:
         raise
     finally:
@@ -989,6 +1618,62 @@ def authenticate_user(email, password):
             conn.close()
 
 
+def _store_password(user_id, role, password):
+    """Guarda un hash nuevo en `passwordUsuario` (y limpia el formato antiguo `role|hash`)."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE tbusuario SET tipoUsuario = %s, passwordUsuario = %s WHERE idUsuario = %s",
+            (role, hash_password(password), user_id)
+        )
+        conn.commit()
+    except Error:
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+        _cache.invalidate('tbusuario')
+
+
+def authenticate_user(email, password):
+    """Autentica un usuario y retorna sus datos si son válidos."""
+    global _DUMMY_PASSWORD_HASH
+    row = _get_auth_row(email)
+
+    if not row:
+        if _DUMMY_PASSWORD_HASH is None:
+            _DUMMY_PASSWORD_HASH = hash_password(secrets.token_hex(16))
+        verify_password(password, _DUMMY_PASSWORD_HASH)
+        return None
+
+    role = row['tipoUsuario'] or ''
+    password_hash = row['passwordUsuario']
+    if not password_hash and '|' in role:
+        # Usuarios registrados antes de `passwordUsuario` (formato role|hash)
+        role, password_hash = role.split('|', 1)
+    if not password_hash or not verify_password(password, password_hash):
+        return None
+
+    if row['passwordUsuario'] != password_hash or get_hasher().needs_rehash(password_hash):
+        # Migrar a la columna dedicada y al algoritmo/coste actual
+        _store_password(row['idUsuario'], role, password)
+
+    return {
+        'idUsuario': row['idUsuario'],
+        'nombresApellidosUsuario': row['nombresApellidosUsuario'],
+        'emailUsuario': row['emailUsuario'],
+        'tipoUsuario': role,
+    }
+
+
+@cached(_cache, 'tbusuario')
 def get_user_by_id(user_id):
     """Obtiene los datos de un usuario por su ID."""
     conn = None
@@ -1007,6 +1692,7 @@ def get_user_by_id(user_id):
             conn.close()
 
 
+@cached(_cache, lambda user_id, limit=10: ('tbemergencia', user_id), ttl=float(os.getenv('DB_HISTORIAL_CACHE_TTL', '15')))
 def get_emergencias_historial(user_id, limit=10):
     """Obtiene el historial de emergencias de un usuario."""
     conn = None
@@ -1037,3 +1723,756 @@ def get_emergencias_historial(user_id, limit=10):
             cursor.close()
         if conn and conn.is_connected():
             conn.close()
+
+
+def get_max_emergencia_id():
+    """Devuelve el mayor idEmergencia (0 si la tabla está vacía)."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(idEmergencia) FROM tbemergencia")
+        row = cursor.fetchone()
+        return (row[0] if row else None) or 0
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+def get_emergencias_desde(last_id, limit=500):
+    """Devuelve las emergencias con idEmergencia > `last_id`, en orden de inserción."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT idEmergencia, tbUsuario_idUsuario, tbTipoEmergencia_idTipoEmergencia, estadoEmergencia, prioridadEmergencia, fechaHoraEmergencia, ubicacionEmergencia FROM tbemergencia WHERE idEmergencia > %s ORDER BY idEmergencia LIMIT %s",
+            (last_id, limit)
+        )
+        return cursor.fetchall()
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+def get_emergencias_pendientes(ids=None):
+    """Emergencias en estado 'reportada' con los datos que usa el triaje.
+
+    Con `ids` devuelve esas emergencias sea cual sea su estado, en una sola
+    consulta `WHERE IN` (para refrescar entradas concretas de la cola).
+    """
+    sql = "SELECT idEmergencia, tbUsuario_idUsuario, tbTipoEmergencia_idTipoEmergencia, estadoEmergencia, prioridadEmergencia, fechaHoraEmergencia, ubicacionEmergencia FROM tbemergencia"
+    params = ()
+    if ids is None:
+        sql += " WHERE estadoEmergencia = 'reportada'"
+    else:
+        ids = list(ids)
+        if not ids:
+            return []
+        sql += f" WHERE idEmergencia IN ({', '.join(['%s'] * len(ids))})"
+        params = tuple(ids)
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+@cached(_cache, 'tbemergencia', ttl=float(os.getenv('METRICS_BUSINESS_TTL', '15')))
+def count_emergencias_por_estado():
+    """Cuenta las emergencias por `estadoEmergencia` (para métricas y paneles)."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT estadoEmergencia, COUNT(*) FROM tbemergencia GROUP BY estadoEmergencia"
+        )
+        return {estado or '': count for estado, count in cursor.fetchall()}
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+# ======================== PANEL DE ADMINISTRACIÓN ========================
+
+def get_panel_base(desde):
+    """Filas con las que `dashboard.py` reconstruye sus contadores, con una sola conexión.
+
+    Devuelve un diccionario con `emergencias` (abiertas, como `(id, estado,
+    prioridad)`), `despachos` (no finalizados, como `(id, estado)`) y los ids
+    de `emergencias_hoy` y `usuarios_hoy` (alta o registro desde `desde`).
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT idEmergencia, estadoEmergencia, prioridadEmergencia FROM tbemergencia WHERE estadoEmergencia <> 'cerrada' OR estadoEmergencia IS NULL"
+        )
+        emergencias = [tuple(row) for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT idDespacho, estadoDespacho FROM tbdespacho WHERE " + _DESPACHO_ACTIVO_SQL
+        )
+        despachos = [tuple(row) for row in cursor.fetchall()]
+        cursor.execute("SELECT idEmergencia FROM tbemergencia WHERE fechaHoraEmergencia >= %s", (desde,))
+        emergencias_hoy = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT idUsuario FROM tbusuario WHERE fechaRegistroUsuario >= %s", (desde,))
+        usuarios_hoy = [row[0] for row in cursor.fetchall()]
+        return {
+            'emergencias': emergencias, 'despachos': despachos,
+            'emergencias_hoy': emergencias_hoy, 'usuarios_hoy': usuarios_hoy,
+        }
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+# ======================== CARGA MASIVA ========================
+
+BATCH_CHUNK_SIZE = 500
+
+# Parámetros de cada insert_* (en orden) -> columna de la tabla
+_EMERGENCIA_FIELDS = (
+    ('usuario_id', 'tbUsuario_idUsuario'),
+    ('tipoemergencia_id', 'tbTipoEmergencia_idTipoEmergencia'),
+    ('codigo', 'codigoEmergencia'),
+    ('fecha_hora', 'fechaHoraEmergencia'),
+    ('tipo', 'tipoEmergencia'),
+    ('estado', 'estadoEmergencia'),
+    ('ubicacion', 'ubicacionEmergencia'),
+    ('latitud', 'latitudEmergencia'),
+    ('longitud', 'longitudEmergencia'),
+    ('descripcion', 'descripcionEmergencia'),
+    ('prioridad', 'prioridadEmergencia'),
+    ('idusuarioreporta', 'idusuarioreportaEmergencia'),
+    ('fecha_cierre', 'fechaCierreEmergencia'),
+    ('observaciones', 'observacionesEmergencia'),
+)
+_HISTORIAL_FIELDS = (
+    ('emergencia_id', 'tbEmergencia_idEmergencia'),
+    ('usuario_id', 'tbUsuario_idUsuario'),
+    ('estado_anterior', 'estadoAnterior'),
+    ('estado_nuevo', 'estadoNuevo'),
+    ('fecha_cambio', 'fechaCambioHistorialEstados'),
+    ('usuario_cambio', 'usuarioCambioHistorialEstados'),
+    ('motivo', 'motivoHistorialEstados'),
+)
+_DESPACHO_FIELDS = (
+    ('servicio_id', 'tbServicioEmergencia_idServicioEmergencia'),
+    ('emergencia_id', 'tbEmergencia_idEmergencia'),
+    ('id_servicio', 'idServicio'),
+    ('hora_asignacion', 'horaAsignacionDespacho'),
+    ('hora_llegada', 'horaLlegadaDespacho'),
+    ('hora_finalizacion', 'horaFinalizacionDespacho'),
+    ('estado', 'estadoDespacho'),
+    ('observaciones', 'observacionesDespacho'),
+    ('tiempo_respuesta', 'tiempoRespuestaDespacho'),
+    ('calificacion', 'calificacionDespacho'),
+)
+_REPORTE_FIELDS = (
+    ('emergencia_id', 'tbEmergencia_idEmergencia'),
+    ('fecha_hora', 'fechaHoraReporteDuplicado'),
+    ('ubicacion', 'ubicacionReporteDuplicado'),
+    ('latitud', 'latitudReporteDuplicado'),
+    ('longitud', 'longitudReporteDuplicado'),
+    ('descripcion', 'descripcionReporteDuplicado'),
+    ('observaciones', 'observacionesReporteDuplicado'),
+    ('similitud', 'similitudReporteDuplicado'),
+)
+
+
+def _record_values(record, fields, required):
+    """Convierte un registro (dict con los nombres de parámetro o secuencia) en tupla."""
+    if isinstance(record, dict):
+        unknown = set(record) - {name for name, _ in fields}
+        if unknown:
+            raise ValueError(f"Campos desconocidos: {', '.join(sorted(unknown))}")
+        values = tuple(record.get(name) for name, _ in fields)
+    else:
+        values = tuple(record)
+        if len(values) != len(fields):
+            raise ValueError(f"Se esperaban {len(fields)} valores y llegaron {len(values)}")
+    missing = [name for (name, _), value in zip(fields, values) if name in required and value in (None, '')]
+    if missing:
+        raise ValueError(f"Campos obligatorios vacíos: {', '.join(missing)}")
+    return values
+
+
+def _insert_batch(table, fields, required, records, chunk_size):
+    """Inserta `records` en `table` con INSERT multi-fila y un commit por bloque.
+
+    Devuelve `{'ids': [...], 'errors': [{'index': i, 'error': msg}, ...]}`;
+    `ids` va alineado con la entrada (None en las filas que fallaron). Los
+    errores de los datos de una fila (validación, tipos, claves foráneas...)
+    llevan `permanent = True`, pues reintentar no los arregla, y los de
+    integridad además `integrity = True`. Si un
+    bloque falla por los datos, se reintenta fila a fila para aislar las filas
+    culpables. Si se pierde la conexión, las filas restantes se marcan como
+    error con `aborted = True` para que el llamador pueda reintentarlas.
+
+    Los ids de un INSERT multi-fila se obtienen de LAST_INSERT_ID() más la
+    posición, lo que InnoDB garantiza para inserciones simples.
+    """
+    chunk_size = max(int(chunk_size or BATCH_CHUNK_SIZE), 1)
+    columns = ', '.join(column for _, column in fields)
+    row_sql = '(' + ','.join(['%s'] * len(fields)) + ')'
+    result = {'ids': [], 'errors': [], 'aborted': False}
+
+    pending = []
+    for index, record in enumerate(records):
+        result['ids'].append(None)
+        try:
+            pending.append((index, _record_values(record, fields, required)))
+        except (ValueError, TypeError) as e:
+            result['errors'].append({'index': index, 'error': str(e), 'permanent': True})
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            try:
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) VALUES " + ','.join([row_sql] * len(chunk)),
+                    [value for _, values in chunk for value in values]
+                )
+                conn.commit()
+                first_id = cursor.lastrowid
+                for offset, (index, _) in enumerate(chunk):
+                    result['ids'][index] = first_id + offset
+                continue
+            except (errors.OperationalError, errors.InterfaceError):
+                raise
+            except Error:
+                conn.rollback()
+
+            for index, values in chunk:
+                try:
+                    cursor.execute(f"INSERT INTO {table} ({columns}) VALUES {row_sql}", values)
+                    conn.commit()
+                    result['ids'][index] = cursor.lastrowid
+                except (errors.OperationalError, errors.InterfaceError):
+                    raise
+                except Error as e:
+                    conn.rollback()
+                    result['errors'].append({
+                        'index': index, 'error': str(e), 'permanent': True,
+                        'integrity': isinstance(e, errors.IntegrityError),
+                    })
+    except (errors.OperationalError, errors.InterfaceError, errors.PoolError, PoolTimeoutError) as e:
+        result['aborted'] = True
+        failed = {item['index'] for item in result['errors']}
+        for index, _ in pending:
+            if result['ids'][index] is None and index not in failed:
+                result['errors'].append({'index': index, 'error': str(e)})
+    finally:
+        if cursor:
+            try:
+                cursor.close()
+            except Error:
+                pass
+        if conn and conn.is_connected():
+            conn.close()
+
+    result['errors'].sort(key=lambda item: item['index'])
+    return result
+
+
+@invalidates(_cache, 'tbemergencia')
+def insert_emergencia_batch(records, chunk_size=BATCH_CHUNK_SIZE):
+    """Inserta varias emergencias. Cada registro usa los parámetros de `insert_emergencia`."""
+    records = list(records)
+    result = _insert_batch('tbemergencia', _EMERGENCIA_FIELDS, {'usuario_id', 'tipoemergencia_id'}, records, chunk_size)
+    for record, new_id in zip(records, result['ids']):
+        if new_id is not None:
+            events.publish('emergencia_creada', events.emergencia_event(dict(record, idEmergencia=new_id)))
+    return result
+
+
+@invalidates(_cache, 'tbhistorialestados')
+def insert_historialestados_batch(records, chunk_size=BATCH_CHUNK_SIZE):
+    """Inserta varios registros de historial (parámetros de `insert_historialestados`)."""
+    records = list(records)
+    result = _insert_batch('tbhistorialestados', _HISTORIAL_FIELDS, {'emergencia_id', 'usuario_id'}, records, chunk_size)
+    for record, new_id in zip(records, result['ids']):
+        if new_id is not None:
+            events.publish('estado_cambiado', {
+                'idEmergencia': record.get('emergencia_id'), 'estadoAnterior': record.get('estado_anterior'),
+                'estadoNuevo': record.get('estado_nuevo'), 'fechaCambio': record.get('fecha_cambio'),
+            })
+    return result
+
+
+@invalidates(_cache, 'tbdespacho')
+def insert_despacho_batch(records, chunk_size=BATCH_CHUNK_SIZE):
+    """Inserta varios despachos (parámetros de `insert_despacho`)."""
+    records = list(records)
+    result = _insert_batch('tbdespacho', _DESPACHO_FIELDS, {'servicio_id', 'emergencia_id'}, records, chunk_size)
+    for record, new_id in zip(records, result['ids']):
+        if new_id is not None:
+            events.publish('despacho_creado', {
+                'idDespacho': new_id, 'idEmergencia': record.get('emergencia_id'),
+                'servicio': record.get('servicio_id'), 'estado': record.get('estado'),
+            })
+    return result
+
+
+@invalidates(_cache, 'tbreporteduplicado')
+def insert_reporte_duplicado_batch(records, chunk_size=BATCH_CHUNK_SIZE):
+    """Vincula reportes duplicados a su emergencia (campos de `_REPORTE_FIELDS`), sin crear emergencias."""
+    records = list(records)
+    result = _insert_batch('tbreporteduplicado', _REPORTE_FIELDS, {'emergencia_id'}, records, chunk_size)
+    for record, new_id in zip(records, result['ids']):
+        if new_id is not None:
+            events.publish('reporte_duplicado', {
+                'idReporteDuplicado': new_id, 'idEmergencia': record.get('emergencia_id'),
+                'similitud': record.get('similitud'),
+            })
+    return result
+
+
+# ======================== CONSULTAS DE LA API JSON ========================
+
+# Por entidad: tabla (y tabla de archivo, si la tiene), columnas expuestas,
+# columnas de orden (keyset), sentido, clave primaria y filtros admitidos
+# (nombre -> (columna, operador)).
+API_ENTITIES = {
+    'usuarios': {
+        'table': 'tbusuario',
+        'columns': ('idUsuario', 'cedulaUsuario', 'nombresApellidosUsuario', 'telefonoUsuario', 'contactoEmergenciaUsuario', 'tipoUsuario', 'direccionUsuario', 'emailUsuario', 'fechaRegistroUsuario', 'estadoUsuario'),
+        'keys': ('idUsuario',), 'descending': False, 'pk': 'idUsuario',
+        'filters': {'estado': ('estadoUsuario', '='), 'tipo': ('tipoUsuario', '='), 'email': ('emailUsuario', '=')},
+    },
+    'tipos': {
+        'table': 'tbtipoemergencia',
+        'columns': ('idTipoEmergencia', 'nombreTipoEmergencia', 'descripcionTipoEmergencia', 'nivelPrioridadTipoEmergencia_3', 'estadoTipoEmergencia_4'),
+        'keys': ('idTipoEmergencia',), 'descending': False, 'pk': 'idTipoEmergencia',
+        'filters': {'estado': ('estadoTipoEmergencia_4', '='), 'prioridad': ('nivelPrioridadTipoEmergencia_3', '=')},
+    },
+    'servicios': {
+        'table': 'tbservicioemergencia',
+        'columns': ('idServicioEmergencia', 'nombreServicioEmergencia', 'tipoServicioEmergencia', 'telefonoServicioEmergencia', 'disponibilidadServicioEmergencia', 'direccionBaseServicioEmergencia', 'capacidadAtencionServicioEmergencia', 'horarioServicioEmergencia', 'especialidadServicioEmergencia', 'estadoServicioEmergencia', 'latitudServicioEmergencia', 'longitudServicioEmergencia'),
+        'keys': ('idServicioEmergencia',), 'descending': False, 'pk': 'idServicioEmergencia',
+        'filters': {'estado': ('estadoServicioEmergencia', '='), 'tipo': ('tipoServicioEmergencia', '='), 'disponibilidad': ('disponibilidadServicioEmergencia', '=')},
+    },
+    'contactos': {
+        'table': 'tbcontactoemergencia',
+        'columns': ('idContactoEmergencia', 'tbTipoEmergencia_idTipoEmergencia', 'nombreContactoEmergencia', 'telefonoContactoEmergencia', 'tipoContactoEmergencia', 'descripcionContactoEmergencia', 'estadoContactoEmergencia'),
+        'keys': ('idContactoEmergencia',), 'descending': False, 'pk': 'idContactoEmergencia',
+        'filters': {'tipo_emergencia': ('tbTipoEmergencia_idTipoEmergencia', '='), 'estado': ('estadoContactoEmergencia', '=')},
+    },
+    'emergencias': {
+        'table': 'tbemergencia', 'archive': 'tbemergencia_archivo',
+        'columns': ('idEmergencia', 'tbUsuario_idUsuario', 'tbTipoEmergencia_idTipoEmergencia', 'codigoEmergencia', 'fechaHoraEmergencia', 'tipoEmergencia', 'estadoEmergencia', 'ubicacionEmergencia', 'latitudEmergencia', 'longitudEmergencia', 'descripcionEmergencia', 'prioridadEmergencia', 'idusuarioreportaEmergencia', 'fechaCierreEmergencia', 'observacionesEmergencia'),
+        'keys': ('idEmergencia',), 'descending': False, 'pk': 'idEmergencia',
+        'filters': {
+            'estado': ('estadoEmergencia', '='), 'prioridad': ('prioridadEmergencia', '='),
+            'usuario': ('tbUsuario_idUsuario', '='), 'tipo_emergencia': ('tbTipoEmergencia_idTipoEmergencia', '='),
+            'desde': ('fechaHoraEmergencia', '>='), 'hasta': ('fechaHoraEmergencia', '<='),
+        },
+    },
+    'historialestados': {
+        'table': 'tbhistorialestados', 'archive': 'tbhistorialestados_archivo',
+        'columns': ('idHistorialEstados', 'tbEmergencia_idEmergencia', 'tbUsuario_idUsuario', 'estadoAnterior', 'estadoNuevo', 'fechaCambioHistorialEstados', 'usuarioCambioHistorialEstados', 'motivoHistorialEstados'),
+        'keys': ('fechaCambioHistorialEstados', 'idHistorialEstados'), 'descending': True, 'pk': 'idHistorialEstados',
+        'filters': {
+            'emergencia': ('tbEmergencia_idEmergencia', '='), 'estado': ('estadoNuevo', '='),
+            'desde': ('fechaCambioHistorialEstados', '>='), 'hasta': ('fechaCambioHistorialEstados', '<='),
+        },
+    },
+    'despachos': {
+        'table': 'tbdespacho', 'archive': 'tbdespacho_archivo',
+        'columns': ('idDespacho', 'tbServicioEmergencia_idServicioEmergencia', 'tbEmergencia_idEmergencia', 'idServicio', 'horaAsignacionDespacho', 'horaLlegadaDespacho', 'horaFinalizacionDespacho', 'estadoDespacho', 'observacionesDespacho', 'tiempoRespuestaDespacho', 'calificacionDespacho'),
+        'keys': ('horaAsignacionDespacho', 'idDespacho'), 'descending': True, 'pk': 'idDespacho',
+        'filters': {
+            'estado': ('estadoDespacho', '='), 'emergencia': ('tbEmergencia_idEmergencia', '='),
+            'servicio': ('tbServicioEmergencia_idServicioEmergencia', '='),
+            'desde': ('horaAsignacionDespacho', '>='), 'hasta': ('horaAsignacionDespacho', '<='),
+        },
+    },
+    'duplicados': {
+        'table': 'tbreporteduplicado', 'archive': 'tbreporteduplicado_archivo',
+        'columns': ('idReporteDuplicado', 'tbEmergencia_idEmergencia', 'fechaHoraReporteDuplicado', 'ubicacionReporteDuplicado', 'latitudReporteDuplicado', 'longitudReporteDuplicado', 'descripcionReporteDuplicado', 'observacionesReporteDuplicado', 'similitudReporteDuplicado'),
+        'keys': ('idReporteDuplicado',), 'descending': True, 'pk': 'idReporteDuplicado',
+        'filters': {
+            'emergencia': ('tbEmergencia_idEmergencia', '='),
+            'desde': ('fechaHoraReporteDuplicado', '>='), 'hasta': ('fechaHoraReporteDuplicado', '<='),
+        },
+    },
+}
+
+API_IDS_MAX = PAGE_SIZE_MAX
+
+
+def _api_spec(entity):
+    spec = API_ENTITIES.get(entity)
+    if spec is None:
+        raise ValueError(f"Entidad desconocida: {entity}")
+    return spec
+
+
+def _api_columns(spec, fields, required):
+    """Columnas a seleccionar: las pedidas (validadas) más las `required`."""
+    if not fields:
+        return spec['columns']
+    unknown = [f for f in fields if f not in spec['columns']]
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+    wanted = set(fields) | set(required)
+    return tuple(c for c in spec['columns'] if c in wanted)
+
+
+def _api_source(spec, archivo):
+    """Origen del FROM: la tabla viva o, con `archivo`, su unión con la tabla de archivo."""
+    if not archivo:
+        return spec['table']
+    if not spec.get('archive'):
+        raise ValueError(f"La entidad {spec['table']} no tiene archivo")
+    # Todas las columnas: los filtros pueden usar alguna que no se pidió.
+    cols = ', '.join(spec['columns'])
+    return f"(SELECT {cols} FROM {spec['table']} UNION ALL SELECT {cols} FROM {spec['archive']}) AS {spec['table']}"
+
+
+def _api_conditions(spec, filters):
+    """Traduce `{filtro: valor o lista}` a condiciones SQL parametrizadas."""
+    conditions = []
+    params = []
+    for name, value in (filters or {}).items():
+        if name not in spec['filters']:
+            raise ValueError(f"Filtro desconocido: {name}")
+        column, op = spec['filters'][name]
+        if isinstance(value, (list, tuple)):
+            if op != '=':
+                raise ValueError(f"El filtro {name} no admite varios valores")
+            conditions.append(f"{column} IN ({', '.join(['%s'] * len(value))})")
+            params.extend(value)
+        else:
+            conditions.append(f"{column} {op} %s")
+            params.append(value)
+    return conditions, params
+
+
+def query_api(entity, fields=None, filters=None, after=None, before=None, limit=None, archivo=False):
+    """Página de `entity` con columnas y filtros aplicados en SQL.
+
+    Las columnas de orden se seleccionan siempre (las necesita el cursor de
+    paginación); quien no las pidió debe descartarlas. Con `archivo=True` se
+    incluyen las filas archivadas. Lanza ValueError si un campo, filtro o
+    token no es válido.
+    """
+    spec = _api_spec(entity)
+    columns = _api_columns(spec, fields, spec['keys'])
+    conditions, params = _api_conditions(spec, filters)
+    return _fetch_keyset_page(
+        f"SELECT {', '.join(columns)} FROM {_api_source(spec, archivo)}",
+        spec['keys'], spec['descending'], after, before, limit,
+        conditions=conditions, condition_params=params,
+    )
+
+
+def get_api_by_ids(entity, ids, fields=None, archivo=False):
+    """Devuelve las filas de `entity` con esos ids en una sola consulta `WHERE IN`.
+
+    El resultado sigue el orden de `ids`; los que no existen se omiten. Con
+    `archivo=True` también se buscan en la tabla de archivo.
+    """
+    spec = _api_spec(entity)
+    source = _api_source(spec, archivo)
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+    if len(ids) > API_IDS_MAX:
+        raise ValueError(f"Como máximo {API_IDS_MAX} ids por petición")
+    columns = _api_columns(spec, fields, (spec['pk'],))
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {source} WHERE {spec['pk']} IN ({', '.join(['%s'] * len(ids))})",
+            tuple(ids)
+        )
+        by_id = {row[spec['pk']]: row for row in cursor.fetchall()}
+        return [by_id[i] for i in ids if i in by_id]
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+# ======================== EXPORTACIÓN ========================
+
+EXPORT_ENTITIES = ('emergencias', 'despachos')
+EXPORT_BATCH = int(os.getenv('EXPORT_BATCH', '10000'))
+
+
+def export_rows(entity, fields=None, filters=None, batch_size=None, archivo=False):
+    """Prepara la exportación de `entity` y devuelve `(columnas, bloques)`.
+
+    Columnas y filtros son los de `API_ENTITIES` y se validan al llamar
+    (ValueError), antes de abrir ninguna conexión. `bloques` es un generador
+    de listas de tuplas en orden de clave primaria, leídas con `fetchmany`
+    sobre un cursor sin buffer: la memoria no depende del número de filas.
+    Con `archivo=True` se exportan primero las filas archivadas y después
+    las vivas (cada parte en orden de clave primaria, sin ordenar la unión).
+    """
+    if entity not in EXPORT_ENTITIES:
+        raise ValueError(f"Entidad no exportable: {entity}")
+    spec = _api_spec(entity)
+    columns = _api_columns(spec, fields, ())
+    conditions, params = _api_conditions(spec, filters)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ''
+    tables = (spec['archive'], spec['table']) if archivo else (spec['table'],)
+    queries = [(f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY {spec['pk']}", tuple(params)) for table in tables]
+    return columns, _stream_rows(queries, max(int(batch_size or EXPORT_BATCH), 1))
+
+
+def _stream_rows(queries, batch_size):
+    # Conexión propia, fuera del pool y sin `DB_STATEMENT_TIMEOUT`: una exportación
+    # puede durar minutos y, si se corta a medias, la conexión con filas sin leer
+    # se cierra en vez de reutilizarse.
+    conn = None
+    cursor = None
+    try:
+        start = time.perf_counter()
+        conn = _connect_function()(**_connect_args())
+        if instrument.ENABLED:
+            conn = instrument.wrap_connection(conn, time.perf_counter() - start)
+        for sql, params in queries:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            cursor = None
+    except Error:
+        raise
+    finally:
+        for resource in (cursor, conn):
+            if resource is not None:
+                try:
+                    resource.close()
+                except Error:
+                    pass
+
+
+# ======================== ARCHIVO DE EMERGENCIAS CERRADAS ========================
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_BATCH = int(os.getenv('ARCHIVE_BATCH', '500'))
+
+# Las hijas se mueven antes que la emergencia; todas comparten la columna de enlace.
+_ARCHIVE_CHILDREN = ('tbhistorialestados', 'tbdespacho', 'tbreporteduplicado')
+
+_ARCHIVABLE_SQL = (
+    "estadoEmergencia = 'cerrada' AND (fechaCierreEmergencia < %s"
+    " OR (fechaCierreEmergencia IS NULL AND fechaHoraEmergencia < %s))"
+)
+
+
+def count_emergencias_archivables(antes):
+    """Cuántas emergencias cerradas antes de `antes` movería `archivar_emergencias_cerradas`."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM tbemergencia WHERE {_ARCHIVABLE_SQL}", (antes, antes))
+        return cursor.fetchone()[0]
+    except Error:
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+
+
+def _archivar_lote(conn, cursor, ids):
+    """Copia y borra un lote en la transacción en curso. Devuelve los recuentos o None si se deshizo."""
+    marks = _in_list(ids)
+    movidas = {}
+    for table in _ARCHIVE_CHILDREN:
+        cursor.execute(f"INSERT INTO {table}_archivo SELECT * FROM {table} WHERE tbEmergencia_idEmergencia IN ({marks})", ids)
+        copiadas = cursor.rowcount
+        cursor.execute(f"DELETE FROM {table} WHERE tbEmergencia_idEmergencia IN ({marks})", ids)
+        if cursor.rowcount != copiadas:
+            conn.rollback()
+            return None
+        movidas[table] = copiadas
+    # El estado se comprueba otra vez: una emergencia reabierta entretanto deshace el lote.
+    cursor.execute(f"INSERT INTO tbemergencia_archivo SELECT * FROM tbemergencia WHERE idEmergencia IN ({marks}) AND estadoEmergencia = 'cerrada'", ids)
+    copiadas = cursor.rowcount
+    cursor.execute(f"DELETE FROM tbemergencia WHERE idEmergencia IN ({marks}) AND estadoEmergencia = 'cerrada'", ids)
+    if copiadas != len(ids) or cursor.rowcount != copiadas:
+        conn.rollback()
+        return None
+    conn.commit()
+    movidas['tbemergencia'] = copiadas
+    return movidas
+
+
+@invalidates(_cache, 'tbemergencia', 'tbhistorialestados', 'tbdespacho', 'tbreporteduplicado')
+def archivar_emergencias_cerradas(antes, batch_size=None, max_lotes=None):
+    """Mueve a las tablas `*_archivo` las emergencias cerradas antes de `antes`.
+
+    Se recorren por `idEmergencia` en lotes de `batch_size`; cada lote copia
+    y borra su historial, sus despachos, sus reportes duplicados y las
+    emergencias en una transacción propia, de modo que un corte a medias
+    deja lotes completos archivados y el resto intacto. Un lote en el que algo cambió mientras se movía (por
+    ejemplo, una emergencia reabierta) se deshace y se cuenta en `omitidas`;
+    la siguiente ejecución lo vuelve a intentar. Las emergencias sin
+    `fechaCierreEmergencia` se juzgan por `fechaHoraEmergencia`.
+
+    Devuelve `{'emergencias': n, 'historial': n, 'despachos': n, 'duplicados': n, 'lotes': n, 'omitidas': n}`.
+    """
+    batch_size = max(int(batch_size or ARCHIVE_BATCH), 1)
+    result = {'emergencias': 0, 'historial': 0, 'despachos': 0, 'duplicados': 0, 'lotes': 0, 'omitidas': 0}
+    last_id = 0
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        while max_lotes is None or result['lotes'] < max_lotes:
+            cursor.execute(
+                f"SELECT idEmergencia FROM tbemergencia WHERE idEmergencia > %s AND {_ARCHIVABLE_SQL} ORDER BY idEmergencia LIMIT %s",
+                (last_id, antes, antes, batch_size)
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            last_id = ids[-1]
+            result['lotes'] += 1
+            movidas = _archivar_lote(conn, cursor, ids)
+            if movidas is None:
+                result['omitidas'] += len(ids)
+                continue
+            result['emergencias'] += movidas['tbemergencia']
+            result['historial'] += movidas['tbhistorialestados']
+            result['despachos'] += movidas['tbdespacho']
+            result['duplicados'] += movidas['tbreporteduplicado']
+            events.publish('emergencias_archivadas', {'ids': ids})
+    except Error:
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if conn and conn.is_connected():
+            conn.close()
+    return result
+
+
+# ======================== BÚSQUEDA DE TEXTO ========================
+
+SEARCH_QUERY_MAX = 200
+
+# Con DB_BACKEND=sqlite los índices FULLTEXT son tablas FTS5 (ver `sqlite_backend`).
+_SQLITE = os.getenv('DB_BACKEND') == 'sqlite'
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _fulltext_hits(texto, archivo):
+    """Subconsulta `(id, relevancia)` con las coincidencias en emergencias y en motivos del historial."""
+    emergencias = ('tbemergencia', 'tbemergencia_archivo') if archivo else ('tbemergencia',)
+    historial = ('tbhistorialestados', 'tbhistorialestados_archivo') if archivo else ('tbhistorialestados',)
+    parts = []
+    params = []
+    if _SQLITE:
+        # FTS5: OR de las palabras entre comillas; bm25 es menor cuanto más relevante.
+        query = ' OR '.join(f'"{word}"' for word in _WORD.findall(texto))
+        for table in emergencias:
+            parts.append(f"SELECT rowid AS id, -bm25({table}_fts) AS relevancia FROM {table}_fts WHERE {table}_fts MATCH %s")
+            params.append(query)
+        for table in historial:
+            parts.append(
+                f"SELECT h.tbEmergencia_idEmergencia AS id, -bm25({table}_fts) AS relevancia FROM {table}_fts"
+                f" JOIN {table} h ON h.idHistorialEstados = {table}_fts.rowid WHERE {table}_fts MATCH %s"
+            )
+            params.append(query)
+    else:
+        match = "MATCH (descripcionEmergencia, observacionesEmergencia, ubicacionEmergencia) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        for table in emergencias:
+            parts.append(f"SELECT idEmergencia AS id, {match} AS relevancia FROM {table} WHERE {match}")
+            params.extend((texto, texto))
+        match = "MATCH (motivoHistorialEstados) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+        for table in historial:
+            parts.append(f"SELECT tbEmergencia_idEmergencia AS id, {match} AS relevancia FROM {table} WHERE {match}")
+            params.extend((texto, texto))
+    return " UNION ALL ".join(parts), params
+
+
+def buscar_emergencias(texto, filters=None, after=None, before=None, limit=None, archivo=False):
+    """Emergencias que contienen las palabras de `texto`, de más a menos relevante.
+
+    Busca con los índices de texto completo en la descripción, las
+    observaciones y la ubicación de la emergencia y en los motivos de su
+    historial; la relevancia de una emergencia es la suma de ambas partes.
+    `filters` son los de `API_ENTITIES['emergencias']` (estado, prioridad,
+    desde, hasta...). Devuelve una página keyset como `query_api`, con la
+    columna `relevancia` en cada fila. Lanza ValueError si falta el texto o
+    un filtro no es válido.
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        raise ValueError("Falta el texto a buscar")
+    if len(texto) > SEARCH_QUERY_MAX:
+        raise ValueError(f"El texto a buscar admite como máximo {SEARCH_QUERY_MAX} caracteres")
+    spec = API_ENTITIES['emergencias']
+    if _SQLITE and not _WORD.search(texto):
+        return {'rows': [], 'next': None, 'prev': None, 'limit': _page_limit(limit)}
+    conditions, params = _api_conditions(spec, filters)
+    hits, hit_params = _fulltext_hits(texto, archivo)
+    # El redondeo hace estable la relevancia entre consultas: la usa el cursor de paginación.
+    # Con `archivo` el origen es una unión con alias `tbemergencia`: se califica con ese nombre.
+    base_sql = (
+        f"SELECT {', '.join('tbemergencia.' + column for column in spec['columns'])}, r.relevancia"
+        f" FROM (SELECT id, ROUND(SUM(relevancia), 6) AS relevancia FROM ({hits}) AS m GROUP BY id) AS r"
+        f" JOIN {_api_source(spec, archivo)} ON tbemergencia.idEmergencia = r.id"
+    )
+    return _fetch_keyset_page(
+        base_sql, ('relevancia', 'idEmergencia'), True, after, before, limit,
+        conditions=conditions, condition_params=params, base_params=hit_params,
+    )
+
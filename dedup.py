@@ -0,0 +1,337 @@
+"""Detección de reportes casi duplicados en la entrada de solicitudes de ayuda.
+
+Durante un incidente grande muchas personas reportan lo mismo. Antes de
+guardar una solicitud en el diario de `intake.py` se busca, entre las
+recibidas en los últimos `DEDUP_WINDOW_SECONDS` para el mismo servicio, un
+reporte original que cumpla:
+
+- con coordenadas en ambos: distancia de hasta `DEDUP_RADIUS_M` metros y
+  similitud de texto de al menos `DEDUP_SIMILARITY_NEAR`;
+- sin coordenadas en alguno: similitud de al menos `DEDUP_SIMILARITY`.
+
+La similitud es el índice de Jaccard entre los conjuntos de tejas (palabras
+normalizadas, sin las más frecuentes) de la descripción. La dirección no
+entra en el texto comparado: dos incidentes distintos en la misma calle
+comparten casi todas sus palabras, y la cercanía ya la mide el radio. Los
+candidatos salen de dos índices en memoria: una rejilla de celdas del tamaño
+del radio y cubos LSH sobre la firma MinHash del texto, de modo que solo se
+compara con unos pocos reportes y no con toda la ventana.
+Un duplicado se guarda en el diario con `parent_id` y, al vaciarse, se
+vincula a la emergencia del original (`tbreporteduplicado`) sin crear una
+emergencia nueva ni trabajo de despacho.
+
+El índice se alimenta del propio diario (solicitudes con id mayor que la
+última vista), así que incluye lo recibido por otros procesos que comparten
+el diario y se reconstruye solo tras un reinicio. La búsqueda se hace bajo un
+candado del proceso, pero la escritura en el diario (sincronizada en disco)
+no: mientras tanto la solicitud queda reservada en el índice con un id
+provisional, y quien la elija como original espera a que tenga id real.
+
+Variables de entorno:
+DEDUP_WINDOW_SECONDS, DEDUP_RADIUS_M, DEDUP_SIMILARITY, DEDUP_SIMILARITY_NEAR
+"""
+import hashlib
+import itertools
+import math
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from geo import haversine_km
+from intake import get_journal
+
+
+PERMUTACIONES = 64
+# 32 bandas de 2 filas: un par con similitud 0,3 comparte algún cubo con
+# probabilidad ~0,95 y uno con 0,6 casi siempre; el Jaccard exacto decide.
+BANDAS = 32
+_FILAS = PERMUTACIONES // BANDAS
+_PRIMO = (1 << 61) - 1
+_rng = random.Random(20240601)
+_COEFICIENTES = [(_rng.randrange(1, _PRIMO), _rng.randrange(0, _PRIMO)) for _ in range(PERMUTACIONES)]
+
+_PALABRA = re.compile(r'[a-z0-9]+')
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return texto.lower()
+
+
+# Palabras frecuentes que no distinguen un incidente de otro.
+_VACIAS = frozenset((
+    'que con por para los las del una uno unos unas hay esta estan este esto muy mas pero sin sobre entre '
+    'como donde cerca frente hace ayuda favor urgente solicitud'
+).split())
+
+
+def tejas(texto):
+    """Palabras normalizadas de 3 o más caracteres, sin las vacías y recortadas a 6 (raíz aproximada)."""
+    return frozenset(
+        palabra[:6] for palabra in _PALABRA.findall(_normalizar(texto))
+        if len(palabra) >= 3 and palabra not in _VACIAS
+    )
+
+
+def firma(conjunto):
+    """Firma MinHash de `PERMUTACIONES` valores (tupla vacía si no hay tejas)."""
+    if not conjunto:
+        return ()
+    hashes = [int.from_bytes(hashlib.blake2b(teja.encode(), digest_size=8).digest(), 'little') for teja in conjunto]
+    return tuple(min((a * h + b) % _PRIMO for h in hashes) for a, b in _COEFICIENTES)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Reporte:
+    __slots__ = ('id', 'creado', 'servicio', 'latitud', 'longitud', 'tejas', 'cubos', 'celda', 'parent')
+
+    def __init__(self, intake_id, creado, servicio, latitud, longitud, texto, parent):
+        self.id = intake_id
+        self.creado = creado
+        self.servicio = servicio
+        self.latitud = float(latitud) if latitud is not None else None
+        self.longitud = float(longitud) if longitud is not None else None
+        self.tejas = tejas(texto)
+        valores = firma(self.tejas)
+        self.cubos = [
+            (servicio, banda, valores[banda * _FILAS:(banda + 1) * _FILAS]) for banda in range(BANDAS)
+        ] if valores else []
+        self.celda = None
+        self.parent = parent
+
+
+class _Reserva:
+    """Solicitud buscada que aún se está escribiendo en el diario."""
+
+    def __init__(self):
+        self.escrita = threading.Event()
+        self.intake_id = None
+        self.parent_id = None
+
+    def original(self, timeout=30.0):
+        """Id del reporte original que representa (o None si no llegó a escribirse)."""
+        if not self.escrita.wait(timeout):
+            return None
+        return self.parent_id or self.intake_id
+
+
+class DuplicateDetector:
+    """Índice en memoria de los reportes recientes, alimentado desde el diario de entrada."""
+
+    def __init__(self, journal, window=1800.0, radius_m=500.0, similarity=0.6, similarity_near=0.3):
+        self.journal = journal
+        self.window = float(window)
+        self.radius_km = float(radius_m) / 1000.0
+        self.similarity = float(similarity)
+        self.similarity_near = float(similarity_near)
+        # Celdas del tamaño del radio (en latitud): los vecinos posibles están en las filas contiguas.
+        self._cell_deg = max(self.radius_km / 111.32, 1e-4)
+        self._lock = threading.Lock()
+        self._reportes = {}
+        self._orden = deque()
+        self._cubos = {}
+        self._celdas = {}
+        self._last_id = 0
+        # Ids provisionales (negativos) de las solicitudes reservadas.
+        self._provisionales = itertools.count(-1, -1)
+        self._reservas = {}
+        self.comparados = 0
+        self.duplicados = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    # -- índice --------------------------------------------------------
+
+    def _celda(self, servicio, latitud, longitud):
+        return (servicio, math.floor(latitud / self._cell_deg), math.floor(longitud / self._cell_deg))
+
+    def _add(self, reporte):
+        self._reportes[reporte.id] = reporte
+        self._orden.append(reporte)
+        for cubo in reporte.cubos:
+            self._cubos.setdefault(cubo, set()).add(reporte.id)
+        if reporte.latitud is not None and reporte.longitud is not None:
+            reporte.celda = self._celda(reporte.servicio, reporte.latitud, reporte.longitud)
+            self._celdas.setdefault(reporte.celda, set()).add(reporte.id)
+
+    def _remove(self, reporte):
+        self._reportes.pop(reporte.id, None)
+        for cubo in reporte.cubos:
+            ids = self._cubos.get(cubo)
+            if ids is not None:
+                ids.discard(reporte.id)
+                if not ids:
+                    del self._cubos[cubo]
+        if reporte.celda is not None:
+            ids = self._celdas.get(reporte.celda)
+            if ids is not None:
+                ids.discard(reporte.id)
+                if not ids:
+                    del self._celdas[reporte.celda]
+
+    def _expire(self, ahora):
+        limite = ahora - self.window
+        while self._orden and self._orden[0].creado < limite:
+            self._remove(self._orden.popleft())
+
+    def _sync(self, ahora):
+        """Incorpora las solicitudes del diario posteriores a la última vista. Requiere el candado."""
+        for intake_id, creado, servicio, latitud, longitud, texto, parent in self.journal.recent(self._last_id, ahora - self.window):
+            self._last_id = intake_id
+            if texto is not None or latitud is not None:
+                self._add(_Reporte(intake_id, creado, servicio, latitud, longitud, texto, parent))
+        self._expire(ahora)
+
+    # -- consulta ------------------------------------------------------
+
+    def _candidatos(self, nuevo):
+        ids = set()
+        for cubo in nuevo.cubos:
+            ids |= self._cubos.get(cubo, set())
+        if nuevo.latitud is not None and nuevo.longitud is not None:
+            servicio, fila, columna = self._celda(nuevo.servicio, nuevo.latitud, nuevo.longitud)
+            # En longitud las celdas se estrechan con la latitud: hacen falta más columnas.
+            coseno = math.cos(math.radians(min(abs(nuevo.latitud) + self._cell_deg, 89.0)))
+            ancho = math.ceil(1 / coseno)
+            for df in (-1, 0, 1):
+                for dc in range(-ancho, ancho + 1):
+                    ids |= self._celdas.get((servicio, fila + df, columna + dc), set())
+        return ids
+
+    def _original(self, candidato):
+        """Id del original al que enlazar: nunca otro duplicado ni un id provisional."""
+        if candidato.parent is not None:
+            return candidato.parent
+        if candidato.id > 0:
+            return candidato.id
+        return self._reservas[candidato.id]
+
+    def _buscar(self, nuevo):
+        mejor = None
+        for candidato_id in self._candidatos(nuevo):
+            candidato = self._reportes.get(candidato_id)
+            if candidato is None or candidato.servicio != nuevo.servicio:
+                continue
+            self.comparados += 1
+            similitud = jaccard(nuevo.tejas, candidato.tejas)
+            if None not in (nuevo.latitud, nuevo.longitud, candidato.latitud, candidato.longitud):
+                distancia = haversine_km(nuevo.latitud, nuevo.longitud, candidato.latitud, candidato.longitud)
+                if distancia > self.radius_km or similitud < self.similarity_near:
+                    continue
+            else:
+                distancia = None
+                if similitud < self.similarity:
+                    continue
+            clave = (similitud, -(distancia or 0.0))
+            if mejor is None or clave > mejor[0]:
+                mejor = (clave, candidato, similitud, distancia)
+        if mejor is None:
+            return None
+        _, candidato, similitud, distancia = mejor
+        return {
+            'parent_id': self._original(candidato),
+            'similitud': round(similitud, 4),
+            'distanciaKm': round(distancia, 3) if distancia is not None else None,
+        }
+
+    @staticmethod
+    def _resolver(coincidencia):
+        """Sustituye una reserva por el id real del original (esperando a su escritura)."""
+        if coincidencia is None or not isinstance(coincidencia['parent_id'], _Reserva):
+            return coincidencia
+        parent_id = coincidencia['parent_id'].original()
+        if parent_id is None:
+            return None
+        return dict(coincidencia, parent_id=parent_id)
+
+    def find(self, servicio_id, texto, latitud=None, longitud=None, ahora=None):
+        """Reporte original del que esta solicitud sería un duplicado, o None.
+
+        Devuelve `{'parent_id', 'similitud', 'distanciaKm'}`; no guarda nada.
+        """
+        if not self.enabled:
+            return None
+        ahora = ahora or time.time()
+        nuevo = _Reporte(None, ahora, servicio_id, latitud, longitud, texto, None)
+        with self._lock:
+            self._sync(ahora)
+            coincidencia = self._buscar(nuevo)
+        return self._resolver(coincidencia)
+
+    def submit(self, record, servicio_id, texto):
+        """Busca un original y guarda la solicitud en el diario, enlazada a él si lo hay.
+
+        Devuelve `(id en el diario, coincidencia o None)`. La búsqueda y la
+        reserva en el índice van bajo el candado, así que dos reportes
+        simultáneos del mismo incidente no pueden quedar ambos como
+        originales dentro de este proceso; la escritura en el diario va fuera.
+        """
+        if not self.enabled:
+            return self.journal.submit(record, servicio_id=servicio_id, texto=texto), None
+        ahora = time.time()
+        reserva = _Reserva()
+        with self._lock:
+            self._sync(ahora)
+            nuevo = _Reporte(next(self._provisionales), ahora, servicio_id, record.get('latitud'), record.get('longitud'), texto, None)
+            coincidencia = self._buscar(nuevo)
+            if coincidencia and not isinstance(coincidencia['parent_id'], _Reserva):
+                nuevo.parent = coincidencia['parent_id']
+            self._reservas[nuevo.id] = reserva
+            self._add(nuevo)
+        try:
+            coincidencia = self._resolver(coincidencia)
+            reserva.parent_id = coincidencia['parent_id'] if coincidencia else None
+            reserva.intake_id = self.journal.submit(
+                record, servicio_id=servicio_id, texto=texto, parent_id=reserva.parent_id,
+                similitud=coincidencia['similitud'] if coincidencia else None,
+            )
+        finally:
+            with self._lock:
+                self._remove(nuevo)
+                del self._reservas[nuevo.id]
+                if coincidencia and reserva.intake_id is not None:
+                    self.duplicados += 1
+                self._sync(ahora)
+            reserva.escrita.set()
+        return reserva.intake_id, coincidencia
+
+    def stats(self):
+        with self._lock:
+            return {
+                'recientes': len(self._reportes),
+                'cubos': len(self._cubos),
+                'celdas': len(self._celdas),
+                'comparados': self.comparados,
+                'duplicados': self.duplicados,
+            }
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """Devuelve el detector del proceso (sobre el diario de `intake.get_journal`), creándolo la primera vez."""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = DuplicateDetector(
+                    get_journal(),
+                    window=float(os.getenv('DEDUP_WINDOW_SECONDS', '1800')),
+                    radius_m=float(os.getenv('DEDUP_RADIUS_M', '500')),
+                    similarity=float(os.getenv('DEDUP_SIMILARITY', '0.6')),
+                    similarity_near=float(os.getenv('DEDUP_SIMILARITY_NEAR', '0.3')),
+                )
+    return _detector
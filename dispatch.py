@@ -0,0 +1,243 @@
+"""Recomendación de servicios para despachar a una emergencia.
+
+Cada candidato recibe una puntuación de 0 a 1 que combina:
+
+- capacidad libre: `capacidadServicioEmergencia` menos sus despachos no
+  finalizados (un servicio marcado como ocupado no tiene capacidad libre);
+- distancia entre la emergencia y la base del servicio;
+- coincidencia de `especialidadServicioEmergencia` / `tipoServicioEmergencia`
+  con el nombre del tipo de la emergencia;
+- `horarioServicioEmergencia` (p. ej. "24/7", "08:00-18:00", "22:00-06:00").
+
+Los servicios sin capacidad libre o fuera de horario se ordenan después de
+los aptos. La carga de cada servicio se lleva en memoria: se carga con una
+consulta agregada y se actualiza con los eventos de despacho de `events.bus`,
+de modo que una recomendación no consulta la base de datos por candidato (los
+servicios, los tipos y el índice espacial salen de la caché de `db.py`).
+
+Variables de entorno:
+DISPATCH_CANDIDATES, DISPATCH_DISTANCE_KM, DISPATCH_RESYNC_SECONDS
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime
+
+import db
+import events
+
+
+CANDIDATOS = int(os.getenv('DISPATCH_CANDIDATES', '25'))
+# Distancia a la que la puntuación por cercanía cae a la mitad.
+DISTANCIA_KM = float(os.getenv('DISPATCH_DISTANCE_KM', '5'))
+
+PESOS = {'capacidad': 0.35, 'distancia': 0.35, 'especialidad': 0.2, 'horario': 0.1}
+
+_RANGO = re.compile(r'(\d{1,2})(?:[:.h](\d{2}))?\s*(?:-|a|hasta)\s*(\d{1,2})(?:[:.h](\d{2}))?')
+_PERMANENTE = re.compile(r'24\s*(?:/\s*7|h\b|horas)|permanente|siempre')
+_GENERICAS = {'general', 'generales', 'todas', 'todos', 'multiple', 'multiples'}
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return texto.lower()
+
+
+def _raices(texto):
+    # Prefijo de 5 letras: "incendio" coincide con "incendios", "medica" con "medico".
+    return {palabra[:5] for palabra in re.findall(r'[a-z]+', _normalizar(texto)) if len(palabra) >= 4}
+
+
+def abierto(horario, ahora=None):
+    """True/False si el servicio atiende en `ahora` según su horario; None si no se puede interpretar."""
+    texto = _normalizar(horario)
+    if not texto.strip():
+        return None
+    if _PERMANENTE.search(texto):
+        return True
+    ahora = ahora or datetime.now()
+    minuto = ahora.hour * 60 + ahora.minute
+    rangos = _RANGO.findall(texto)
+    if not rangos:
+        return None
+    for h1, m1, h2, m2 in rangos:
+        inicio = int(h1) % 24 * 60 + int(m1 or 0)
+        fin = int(h2) * 60 + int(m2 or 0)
+        if fin <= inicio:
+            # Horario nocturno (22:00-06:00) o "0-24".
+            if minuto >= inicio or minuto < fin or fin == inicio:
+                return True
+        elif inicio <= minuto < fin:
+            return True
+    return False
+
+
+def coincidencia_especialidad(servicio, tipo):
+    """1 si la especialidad o el tipo del servicio coincide con el tipo de emergencia, 0.5 si es genérica o desconocida."""
+    raices_servicio = _raices(servicio.get('especialidadServicioEmergencia')) | _raices(servicio.get('tipoServicioEmergencia'))
+    raices_tipo = _raices(tipo.get('nombreTipoEmergencia')) if tipo else set()
+    if raices_servicio & raices_tipo:
+        return 1.0
+    if not raices_servicio or not raices_tipo or raices_servicio & {g[:5] for g in _GENERICAS}:
+        return 0.5
+    return 0.0
+
+
+class CargaServicios:
+    """Despachos activos por servicio, mantenidos con los eventos de despacho."""
+
+    def __init__(self, resync=30.0):
+        self.resync = float(resync)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._activos = {}
+        self._carga = Counter()
+        self._pendientes = None
+        self._loaded_at = None
+        self._stale = False
+
+    def _set(self, despacho_id, servicio_id, activo):
+        anterior = self._activos.pop(despacho_id, None)
+        if anterior is not None:
+            self._carga[anterior] -= 1
+            if self._carga[anterior] <= 0:
+                del self._carga[anterior]
+        if activo and servicio_id is not None:
+            self._activos[despacho_id] = servicio_id
+            self._carga[servicio_id] += 1
+
+    def _apply(self, event):
+        tipo = event.get('tipo')
+        data = event.get('data') or {}
+        if tipo in ('despacho_creado', 'despacho_actualizado'):
+            self._set(data.get('idDespacho'), data.get('servicio'), db.despacho_activo(data.get('estado')))
+        elif tipo == 'despacho_eliminado':
+            self._set(data.get('idDespacho'), None, False)
+        elif tipo in ('emergencia_eliminada', 'emergencias_archivadas'):
+            # El borrado de sus despachos (en cascada o al archivar) no publica eventos.
+            self._stale = True
+
+    def on_event(self, event):
+        """Oyente de `events.bus`."""
+        if not str(event.get('tipo', '')).startswith('despacho_') and event.get('tipo') not in ('emergencia_eliminada', 'emergencias_archivadas'):
+            return
+        with self._lock:
+            if self._pendientes is not None:
+                self._pendientes.append(event)
+            if self._loaded_at is not None:
+                self._apply(event)
+
+    def reload(self):
+        """Relee los despachos activos (una consulta) y reaplica lo publicado mientras tanto."""
+        with self._lock:
+            self._pendientes = []
+        try:
+            rows = db.get_despachos_activos()
+        except Exception:
+            with self._lock:
+                self._pendientes = None
+            raise
+        with self._lock:
+            self._activos = {}
+            self._carga = Counter()
+            for despacho_id, servicio_id in rows:
+                self._set(despacho_id, servicio_id, True)
+            # Reaplicar es idempotente: cada evento fija el estado final de un despacho.
+            for event in self._pendientes:
+                if event.get('tipo') not in ('emergencia_eliminada', 'emergencias_archivadas'):
+                    self._apply(event)
+            self._pendientes = None
+            self._stale = False
+            self._loaded_at = time.monotonic()
+
+    def ensure(self):
+        with self._refresh_lock:
+            with self._lock:
+                loaded_at, stale = self._loaded_at, self._stale
+            if stale or loaded_at is None or (self.resync > 0 and time.monotonic() - loaded_at > self.resync):
+                self.reload()
+
+    def carga(self, servicio_id):
+        with self._lock:
+            return self._carga.get(servicio_id, 0)
+
+    def stats(self):
+        with self._lock:
+            return {'activos': len(self._activos), 'servicios_con_carga': len(self._carga), 'cargada': self._loaded_at is not None}
+
+
+cargas = CargaServicios(resync=float(os.getenv('DISPATCH_RESYNC_SECONDS', '30')))
+events.bus.add_listener(cargas.on_event)
+
+
+def _candidato(servicio):
+    estado = (servicio.get('estadoServicioEmergencia') or '').lower()
+    disponibilidad = (servicio.get('disponibilidadServicioEmergencia') or '').lower()
+    return estado != 'inactivo' and disponibilidad != 'fuera_servicio'
+
+
+def _puntuar(servicio, distancia, tipo, ahora, con_distancia):
+    capacidad = servicio.get('capacidadServicioEmergencia')
+    capacidad = int(capacidad) if capacidad and int(capacidad) > 0 else 1
+    carga = cargas.carga(servicio['idServicioEmergencia'])
+    libre = 0 if (servicio.get('disponibilidadServicioEmergencia') or '').lower() == 'ocupado' else max(capacidad - carga, 0)
+    en_horario = abierto(servicio.get('horarioServicioEmergencia'), ahora)
+    if not con_distancia:
+        puntos_distancia = 0.5
+    elif distancia is None:
+        puntos_distancia = 0.0
+    else:
+        puntos_distancia = DISTANCIA_KM / (DISTANCIA_KM + distancia)
+    partes = {
+        'capacidad': libre / capacidad,
+        'distancia': puntos_distancia,
+        'especialidad': coincidencia_especialidad(servicio, tipo),
+        'horario': 0.5 if en_horario is None else float(en_horario),
+    }
+    item = dict(servicio)
+    item.update({
+        'distanciaKm': round(distancia, 3) if distancia is not None else None,
+        'carga': carga,
+        'capacidadLibre': libre,
+        'abierto': en_horario,
+        'apto': libre > 0 and en_horario is not False,
+        'puntuacion': round(sum(PESOS[name] * value for name, value in partes.items()), 4),
+        'detalle': {name: round(value, 3) for name, value in partes.items()},
+    })
+    return item
+
+
+def recomendar(emergencia, k=5, ahora=None):
+    """Servicios ordenados para despachar a `emergencia` (dict de `db.get_emergencia`).
+
+    Devuelve hasta `k` copias de los servicios con `puntuacion`, `apto`,
+    `capacidadLibre`, `carga`, `abierto`, `distanciaKm` y el `detalle` de cada
+    criterio. Con coordenadas solo se evalúan los `DISPATCH_CANDIDATES` más
+    cercanos (índice espacial); sin ellas, todos los servicios.
+    """
+    cargas.ensure()
+    ahora = ahora or datetime.now()
+    tipo_id = emergencia.get('tbTipoEmergencia_idTipoEmergencia')
+    tipo = next((t for t in db.get_all_tipoemergencia() if t['idTipoEmergencia'] == tipo_id), None)
+    latitud = emergencia.get('latitudEmergencia')
+    longitud = emergencia.get('longitudEmergencia')
+    con_distancia = latitud is not None and longitud is not None
+    if con_distancia:
+        cercanos = db.get_nearest_servicioemergencia(latitud, longitud, max(CANDIDATOS, k), solo_disponibles=False)
+        candidatos = [(s['distanciaKm'], s) for s in cercanos if _candidato(s)]
+    else:
+        candidatos = [(None, s) for s in db.get_all_servicioemergencia() if _candidato(s)]
+    ranking = [_puntuar(servicio, distancia, tipo, ahora, con_distancia) for distancia, servicio in candidatos]
+    ranking.sort(key=lambda item: (not item['apto'], -item['puntuacion'], item['distanciaKm'] if item['distanciaKm'] is not None else float('inf')))
+    return ranking[:max(int(k), 1)]
+
+
+def recomendar_para(emergencia_id, k=5):
+    """Como `recomendar`, leyendo la emergencia por id. Devuelve None si no existe."""
+    emergencia = db.get_emergencia(emergencia_id)
+    if emergencia is None:
+        return None
+    return recomendar(emergencia, k)
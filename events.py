@@ -0,0 +1,190 @@
+"""Bus de cambios en proceso para el seguimiento en vivo de emergencias.
+
+`db.py` publica un evento tras confirmar cada alta, modificación, borrado o
+cambio de estado de una emergencia. Las consolas conectadas a
+`/eventos/emergencias` (SSE) o a su variante de long-poll leen del historial
+reciente del bus, sin consultar la base de datos. Para ver también las altas
+hechas por otros procesos, un único hilo por proceso consulta
+`idEmergencia > último visto` mientras haya consolas conectadas o algún
+cliente de long-poll haya consultado en el último minuto.
+
+Variables de entorno:
+EVENTS_HISTORY, EVENTS_POLL_INTERVAL, EVENTS_MAX_SUBSCRIBERS
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class ChangeBus:
+    """Historial acotado de eventos numerados, con espera bloqueante para lectores."""
+
+    def __init__(self, history=1000):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=max(int(history), 1))
+        self._seq = 0
+        self._created = OrderedDict()
+        self._listeners = []
+        self.subscribers = 0
+        # Última baja de una consola: los clientes de long-poll se dan de baja en cada respuesta.
+        self.last_unsubscribe = None
+
+    @property
+    def last_seq(self):
+        with self._cond:
+            return self._seq
+
+    def publish(self, tipo, data):
+        """Añade un evento, despierta a los lectores y avisa a los oyentes. Devuelve su número."""
+        with self._cond:
+            self._seq += 1
+            event = {'id': self._seq, 'tipo': tipo, 'ts': time.time(), 'data': data}
+            self._events.append(event)
+            if tipo == 'emergencia_creada':
+                self._created[data.get('idEmergencia')] = None
+                while len(self._created) > self._events.maxlen:
+                    self._created.popitem(last=False)
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                sys.stderr.write(f"events: error en oyente {listener!r}: {e}\n")
+        return event['id']
+
+    def add_listener(self, listener):
+        """Registra `listener(evento)`, llamado en el hilo que publica tras cada evento."""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def was_created(self, emergencia_id):
+        """Indica si el alta de `emergencia_id` ya se publicó en este proceso."""
+        with self._cond:
+            return emergencia_id in self._created
+
+    def _since(self, seq):
+        # Si el lector va por detrás del historial conservado, debe recargar.
+        reset = bool(self._events) and self._events[0]['id'] > seq + 1
+        return [event for event in self._events if event['id'] > seq], reset
+
+    def wait(self, seq, timeout):
+        """Espera hasta `timeout` segundos eventos posteriores a `seq`.
+
+        Devuelve `(eventos, reset)`; `reset` indica que se perdieron eventos.
+        """
+        with self._cond:
+            if self._seq <= seq:
+                self._cond.wait_for(lambda: self._seq > seq, timeout)
+            return self._since(seq)
+
+    def subscribe(self, limit=None):
+        """Registra una consola. Devuelve False si se alcanzó `limit`."""
+        with self._cond:
+            if limit and self.subscribers >= limit:
+                return False
+            self.subscribers += 1
+        _poller.start()
+        return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers = max(self.subscribers - 1, 0)
+            self.last_unsubscribe = time.monotonic()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'last_id': self._seq,
+                'history': len(self._events),
+                'subscribers': self.subscribers,
+                'poller_alive': _poller.alive,
+            }
+
+
+class _EmergenciaPoller:
+    """Hilo que publica las emergencias insertadas por otros procesos.
+
+    `_last_id` se conserva entre paradas: al relanzarse publica lo insertado
+    mientras estuvo detenido (hasta `get_emergencias_desde` filas por vuelta).
+    """
+
+    def __init__(self, interval, linger=60.0):
+        self.interval = float(interval)
+        # Segundos que sigue activo tras la última baja (el timeout máximo del long-poll).
+        self.linger = float(linger)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_id = None
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            # `_thread` solo vuelve a None bajo este candado, cuando el hilo decide parar.
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='events-poller', daemon=True)
+            self._thread.start()
+
+    def _should_stop(self):
+        """Decide (con el candado) si parar; si para, la próxima suscripción lo relanza."""
+        with self._lock:
+            recent = bus.last_unsubscribe is not None and time.monotonic() - bus.last_unsubscribe < self.linger
+            if bus.subscribers or recent:
+                return False
+            self._thread = None
+            return True
+
+    def poll_once(self):
+        """Publica las emergencias con id mayor que el último visto y no publicadas ya."""
+        import db
+
+        if self._last_id is None:
+            self._last_id = db.get_max_emergencia_id()
+            return 0
+        published = 0
+        for row in db.get_emergencias_desde(self._last_id):
+            self._last_id = max(self._last_id, row['idEmergencia'])
+            if not bus.was_created(row['idEmergencia']):
+                bus.publish('emergencia_creada', emergencia_event(row))
+                published += 1
+        return published
+
+    def _run(self):
+        while not self._should_stop():
+            try:
+                self.poll_once()
+            except Exception as e:
+                sys.stderr.write(f"events: error consultando emergencias nuevas: {e}\n")
+            time.sleep(self.interval)
+
+
+def emergencia_event(row):
+    """Datos de un evento a partir de una fila (o registro) de emergencia."""
+    return {
+        'idEmergencia': row.get('idEmergencia'),
+        'estado': row.get('estadoEmergencia', row.get('estado')),
+        'prioridad': row.get('prioridadEmergencia', row.get('prioridad')),
+        'fechaHora': row.get('fechaHoraEmergencia', row.get('fecha_hora')),
+        'ubicacion': row.get('ubicacionEmergencia', row.get('ubicacion')),
+        'usuario': row.get('tbUsuario_idUsuario', row.get('usuario_id')),
+        'tipoEmergencia': row.get('tbTipoEmergencia_idTipoEmergencia', row.get('tipoemergencia_id')),
+    }
+
+
+MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', '100'))
+
+bus = ChangeBus(history=int(os.getenv('EVENTS_HISTORY', '1000')))
+_poller = _EmergenciaPoller(float(os.getenv('EVENTS_POLL_INTERVAL', '5')))
+
+
+def publish(tipo, data):
+    """Publica un evento en el bus del proceso."""
+    return bus.publish(tipo, data)
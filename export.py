@@ -0,0 +1,134 @@
+"""Exportación en streaming de emergencias y despachos a CSV o JSONL.
+
+Uso:
+    python export.py emergencias emergencias.csv --estado reportada,en_proceso --desde 2024-01-01
+    python export.py despachos - --formato jsonl --hasta 2024-06-30 > despachos.jsonl
+    python export.py emergencias todas.csv --archivo
+
+Las filas salen de `db.export_rows` (cursor sin buffer, bloques de
+`EXPORT_BATCH` filas) y cada bloque se serializa y se escribe antes de leer
+el siguiente, así que la memoria no crece con el tamaño de la exportación.
+Los mismos generadores alimentan `/api/v1/<entidad>/exportar`, que responde
+con transferencia por bloques.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+
+import db
+
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def parse_date(name, value):
+    """Convierte `desde`/`hasta` (fecha o fecha-hora ISO) a datetime; `hasta` sin hora incluye el día."""
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            if name == 'hasta':
+                return datetime.combine(day + timedelta(days=1), dtime()) - timedelta(microseconds=1)
+            return datetime.combine(day, dtime())
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Fecha inválida en `{name}`: {value}")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep='T')
+    if isinstance(value, (date, dtime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def csv_chunks(columns, batches):
+    """Genera el CSV (cabecera incluida) como un texto por bloque de filas."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Sin filas: solo la cabecera.
+        yield buffer.getvalue()
+
+
+def jsonl_chunks(columns, batches):
+    """Genera una línea JSON por fila, agrupadas en un texto por bloque."""
+    encode = json.JSONEncoder(default=_json_default, ensure_ascii=False).encode
+    for rows in batches:
+        yield ''.join(encode(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def chunks(fmt, columns, batches):
+    if fmt == 'csv':
+        return csv_chunks(columns, batches)
+    if fmt == 'jsonl':
+        return jsonl_chunks(columns, batches)
+    raise ValueError(f"Formato desconocido: {fmt}")
+
+
+def export(entity, out, fmt='csv', fields=None, filters=None, batch_size=None, archivo=False):
+    """Escribe la exportación en el fichero de texto `out`. Devuelve las filas escritas."""
+    columns, batches = db.export_rows(entity, fields, filters, batch_size, archivo)
+    counted = 0
+
+    def counting():
+        nonlocal counted
+        for rows in batches:
+            counted += len(rows)
+            yield rows
+
+    for chunk in chunks(fmt, columns, counting()):
+        out.write(chunk)
+    return counted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta emergencias o despachos a CSV/JSONL.")
+    parser.add_argument('entidad', choices=db.EXPORT_ENTITIES)
+    parser.add_argument('fichero', help="Fichero de salida (.csv o .jsonl); '-' para la salida estándar")
+    parser.add_argument('--formato', choices=sorted(FORMATS), help="Por defecto, según la extensión del fichero")
+    parser.add_argument('--campos', help="Columnas separadas por comas (por defecto todas)")
+    parser.add_argument('--estado', help="Uno o varios estados separados por comas")
+    parser.add_argument('--desde', help="Fecha (AAAA-MM-DD) o fecha-hora ISO inicial")
+    parser.add_argument('--hasta', help="Fecha (incluye el día completo) o fecha-hora ISO final")
+    parser.add_argument('--batch', type=int, default=db.EXPORT_BATCH, help="Filas por bloque de lectura")
+    parser.add_argument('--archivo', action='store_true', help="Incluye las filas archivadas (antes que las vivas)")
+    args = parser.parse_args(argv)
+
+    fmt = args.formato or ('jsonl' if args.fichero.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    fields = [f.strip() for f in args.campos.split(',') if f.strip()] if args.campos else None
+    filters = {}
+    if args.estado:
+        estados = [e.strip() for e in args.estado.split(',') if e.strip()]
+        filters['estado'] = estados if len(estados) > 1 else estados[0]
+    for name in ('desde', 'hasta'):
+        value = getattr(args, name)
+        if value:
+            filters[name] = parse_date(name, value)
+
+    if args.fichero == '-':
+        rows = export(args.entidad, sys.stdout, fmt, fields, filters, args.batch, args.archivo)
+    else:
+        with open(args.fichero, 'w', newline='', encoding='utf-8') as out:
+            rows = export(args.entidad, out, fmt, fields, filters, args.batch, args.archivo)
+    sys.stderr.write(f"{rows} filas exportadas\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
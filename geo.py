@@ -0,0 +1,100 @@
+import heapq
+import math
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distancia en kilómetros sobre la esfera terrestre entre dos coordenadas."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Índice espacial en memoria sobre una rejilla de celdas de `cell_deg` grados.
+
+    Cada elemento es `(lat, lon, item)`. `nearest` recorre anillos de celdas
+    alrededor del punto hasta que la distancia mínima posible del siguiente
+    anillo supera al k-ésimo candidato, así que solo examina los elementos
+    cercanos en lugar de toda la lista.
+    """
+
+    def __init__(self, points, cell_deg=0.05):
+        self.cell_deg = float(cell_deg)
+        self._cells = {}
+        self._size = 0
+        for lat, lon, item in points:
+            if lat is None or lon is None:
+                continue
+            lat = float(lat)
+            lon = float(lon)
+            self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, item))
+            self._size += 1
+        # Latitud absoluta máxima: acota por abajo el ancho en km de una celda.
+        self._max_abs_lat = max((abs(lat) for cell in self._cells.values() for lat, _, _ in cell), default=0.0)
+        rows = [row for row, _ in self._cells] or [0]
+        cols = [col for _, col in self._cells] or [0]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _ring(self, center, radius):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for dc in range(-radius, radius + 1):
+            yield (row - radius, col + dc)
+            yield (row + radius, col + dc)
+        for dr in range(-radius + 1, radius):
+            yield (row + dr, col - radius)
+            yield (row + dr, col + radius)
+
+    def nearest(self, lat, lon, k=5, predicate=None):
+        """Devuelve hasta `k` pares `(distancia_km, item)` ordenados por distancia."""
+        if not self._size or k <= 0:
+            return []
+        lat = float(lat)
+        lon = float(lon)
+        center = self._cell(lat, lon)
+        # Ancho mínimo de una celda en km (en longitud la celda se estrecha con la latitud).
+        widest_lat = min(max(self._max_abs_lat, abs(lat)) + self.cell_deg, 89.9)
+        km_per_cell = self.cell_deg * 111.32 * math.cos(math.radians(widest_lat))
+        min_row, max_row, min_col, max_col = self._bounds
+        ring_limit = max(abs(center[0] - min_row), abs(center[0] - max_row),
+                         abs(center[1] - min_col), abs(center[1] - max_col))
+        best = []  # montículo de máximos por distancia: (-distancia, contador, item)
+        counter = 0
+        for radius in range(ring_limit + 1):
+            # Lo que queda sin revisar está al menos a `radius - 1` celdas completas.
+            if len(best) == k and -best[0][0] <= (radius - 1) * km_per_cell:
+                break
+            full_scan = (2 * radius + 1) ** 2 > 4 * len(self._cells)
+            if full_scan:
+                # Lejos de los datos es más barato revisar las celdas ocupadas restantes.
+                cells = [cell for cell in self._cells
+                         if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= radius]
+            else:
+                cells = self._ring(center, radius)
+            for cell in cells:
+                for p_lat, p_lon, item in self._cells.get(cell, ()):
+                    if predicate is not None and not predicate(item):
+                        continue
+                    distance = haversine_km(lat, lon, p_lat, p_lon)
+                    counter += 1
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, counter, item))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, counter, item))
+            if full_scan:
+                break
+        return [(-d, item) for d, _, item in sorted(best, reverse=True)]
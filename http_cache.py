@@ -0,0 +1,80 @@
+"""Validación HTTP (ETag / Last-Modified) basada en las versiones de tabla de `db`.
+
+`@conditional('tbtipoemergencia')` sobre una vista GET calcula un ETag fuerte a
+partir de las versiones de esas tablas (`db.table_versions`), el usuario de la
+sesión y la URL. Si el cliente ya tiene esa versión (`If-None-Match` o
+`If-Modified-Since`) se responde 304 sin consultar la base de datos ni
+renderizar la plantilla.
+
+Las versiones son del proceso; para que un cambio hecho en otro proceso no
+quede oculto indefinidamente, el ETag incluye además el intervalo de
+`HTTP_CACHE_MAX_AGE` segundos en curso (por defecto el TTL de la caché, que ya
+acota cuánto puede tardar este proceso en ver ese cambio).
+"""
+import functools
+import hashlib
+import os
+import time
+from email.utils import formatdate
+
+from flask import Response, g, make_response, message_flashed, request, session
+
+import db
+
+
+MAX_AGE = float(os.getenv('HTTP_CACHE_MAX_AGE', os.getenv('DB_CACHE_TTL', '60')))
+ENABLED = os.getenv('HTTP_CACHE_ENABLED', '1') not in ('0', 'false', 'False')
+
+
+def _mark_flashed(sender, **extra):
+    g._http_cache_flashed = True
+
+
+# Una vista que muestra un mensaje (normalmente un error) no debe quedar validada.
+message_flashed.connect(_mark_flashed, weak=False)
+
+
+def _validators(tables):
+    versions, changed = db.table_versions(*tables)
+    window = int(time.time() // MAX_AGE) if MAX_AGE > 0 else 0
+    raw = repr((request.full_path, session.get('user_id'), tables, versions, window))
+    etag = hashlib.sha1(raw.encode()).hexdigest()[:20]
+    # Last-Modified no puede ser anterior al inicio del intervalo: otro proceso pudo cambiar algo.
+    last_modified = max(changed, window * MAX_AGE)
+    return etag, int(last_modified)
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified <= since.timestamp()
+
+
+def conditional(*tables):
+    """Decorador de vista: ETag/Last-Modified por versión de `tables` y 304 si no cambió.
+
+    `tables` puede ser una función que recibe los argumentos de la vista y
+    devuelve la tupla de tablas. Solo actúa en GET/HEAD; no valida respuestas
+    distintas de 200 ni páginas con mensajes `flash`.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ENABLED or request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+            names = tuple(tables[0](*args, **kwargs)) if len(tables) == 1 and callable(tables[0]) else tables
+            etag, last_modified = _validators(names)
+            if _not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or g.get('_http_cache_flashed'):
+                    return response
+            response.set_etag(etag)
+            response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,373 @@
+"""Instrumentación de SQL por petición.
+
+`db.get_connection()` envuelve cada conexión en `InstrumentedConnection`, cuyos
+cursores anotan en el perfil de la petición en curso el texto de la consulta,
+la forma de los parámetros (tipos, nunca valores), las filas devueltas y los
+tiempos de conexión, ejecución y lectura. `init_app(app)` añade a cada
+respuesta una cabecera `Server-Timing` y acumula histogramas por ruta; las
+consultas que superan `SQL_SLOW_MS` se escriben en el log de consultas lentas.
+
+Variables de entorno:
+SQL_INSTRUMENT, SQL_SLOW_MS, SQL_SLOW_LOG
+"""
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+# Límites superiores (ms) de las cubetas de los histogramas; la última es +Inf.
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Consultas distintas que se guardan en el detalle de un perfil.
+MAX_QUERIES_PER_REQUEST = 200
+
+ENABLED = os.getenv('SQL_INSTRUMENT', '1') not in ('0', 'false', 'False')
+SLOW_MS = float(os.getenv('SQL_SLOW_MS', '200'))
+SLOW_LOG = os.getenv('SQL_SLOW_LOG', '')
+
+_local = threading.local()
+_WHITESPACE = re.compile(r'\s+')
+
+
+class Histogram:
+    """Histograma de cubetas fijas, seguro entre hilos."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Devuelve `{'count', 'sum', 'buckets': [(límite, acumulado), ...]}`."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+        cumulative = []
+        running = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            running += n
+            cumulative.append(('+Inf' if bound == float('inf') else bound, running))
+        return {'count': count, 'sum': round(total, 3), 'buckets': cumulative}
+
+
+class RequestProfile:
+    """Consultas y tiempos acumulados durante una petición."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+        self.query_count = 0
+        self.connections = 0
+        self.connect_ms = 0.0
+        self.execute_ms = 0.0
+        self.fetch_ms = 0.0
+
+    @property
+    def db_ms(self):
+        return self.connect_ms + self.execute_ms + self.fetch_ms
+
+    def add_query(self, record):
+        self.query_count += 1
+        self.execute_ms += record['execute_ms']
+        if len(self.queries) < MAX_QUERIES_PER_REQUEST:
+            self.queries.append(record)
+
+
+def current_profile():
+    """Perfil de la petición en curso en este hilo, o None."""
+    return getattr(_local, 'profile', None)
+
+
+def begin_profile():
+    _local.profile = RequestProfile()
+    return _local.profile
+
+
+def end_profile():
+    profile = getattr(_local, 'profile', None)
+    _local.profile = None
+    return profile
+
+
+def _normalize(sql):
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _params_shape(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+# ---------------------------------------------------------------- consultas lentas
+
+_slow_lock = threading.Lock()
+_slow_recent = deque(maxlen=50)
+
+
+def _log_slow(record, route):
+    entry = dict(record, route=route, at=datetime.now().isoformat(timespec='seconds'))
+    line = (f"{entry['at']} slow-query {record['total_ms']:.1f}ms route={route} "
+            f"rows={record['rows']} params={record['params']} sql={record['sql']}\n")
+    with _slow_lock:
+        _slow_recent.append(entry)
+        try:
+            if SLOW_LOG:
+                with open(SLOW_LOG, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+        except OSError:
+            pass
+
+
+def slow_queries():
+    """Últimas consultas lentas registradas (más recientes primero)."""
+    with _slow_lock:
+        return list(reversed(_slow_recent))
+
+
+# ---------------------------------------------------------------- envoltorios
+
+class InstrumentedCursor:
+    """Cursor que mide ejecución y lectura y las anota en el perfil de la petición."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._record = None
+
+    def _finish_previous(self):
+        record = self._record
+        if record is None:
+            return
+        self._record = None
+        record['total_ms'] = round(record['execute_ms'] + record['fetch_ms'], 3)
+        profile = current_profile()
+        if profile is not None:
+            profile.fetch_ms += record['fetch_ms']
+        _query_histogram.observe(record['total_ms'])
+        if record['total_ms'] >= SLOW_MS:
+            _log_slow(record, getattr(_local, 'route', None))
+
+    def _run(self, method, sql, params, shape):
+        self._finish_previous()
+        start = time.perf_counter()
+        try:
+            return method(sql, params) if params is not None else method(sql)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self._record = {
+                'sql': _normalize(sql),
+                'params': shape,
+                'rows': None,
+                'execute_ms': round(elapsed, 3),
+                'fetch_ms': 0.0,
+            }
+            profile = current_profile()
+            if profile is not None:
+                profile.add_query(self._record)
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        return self._run(self._raw.execute, sql, params, _params_shape(params))
+
+    def executemany(self, sql, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        shape = {'executemany': len(seq_params),
+                 'row': _params_shape(seq_params[0]) if seq_params else None}
+        return self._run(self._raw.executemany, sql, seq_params, shape)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        if self._record is not None:
+            self._record['fetch_ms'] = round(self._record['fetch_ms'] + (time.perf_counter() - start) * 1000, 3)
+            if isinstance(result, list):
+                self._record['rows'] = (self._record['rows'] or 0) + len(result)
+            elif result is not None:
+                self._record['rows'] = (self._record['rows'] or 0) + 1
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._raw.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._fetch(self._raw.fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(self._raw.fetchall)
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    def close(self):
+        self._finish_previous()
+        return self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class InstrumentedConnection:
+    """Conexión cuyos cursores se instrumentan; el resto se delega tal cual."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._raw.cursor(*args, **kwargs))
+
+    def close(self):
+        return self._raw.close()
+
+    def is_connected(self):
+        return self._raw.is_connected()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def wrap_connection(raw, connect_seconds):
+    """Envuelve `raw` y anota el tiempo de obtención de la conexión."""
+    connect_ms = connect_seconds * 1000
+    _connect_histogram.observe(connect_ms)
+    profile = current_profile()
+    if profile is not None:
+        profile.connections += 1
+        profile.connect_ms += connect_ms
+    return InstrumentedConnection(raw)
+
+
+# ---------------------------------------------------------------- agregados
+
+_stats_lock = threading.Lock()
+_route_stats = {}
+_connect_histogram = Histogram()
+_query_histogram = Histogram()
+
+
+class _RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.duration = Histogram()
+        self.db_time = Histogram()
+        self.query_count = Histogram(buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+
+
+def record_request(route, profile):
+    """Acumula el perfil de una petición terminada en las estadísticas de su ruta."""
+    total_ms = (time.perf_counter() - profile.started) * 1000
+    with _stats_lock:
+        stats = _route_stats.get(route)
+        if stats is None:
+            stats = _route_stats[route] = _RouteStats()
+        stats.requests += 1
+        stats.queries += profile.query_count
+    stats.duration.observe(total_ms)
+    stats.db_time.observe(profile.db_ms)
+    stats.query_count.observe(profile.query_count)
+    return total_ms
+
+
+def stats_connect():
+    """Histograma (ms) del tiempo de obtención de conexiones."""
+    return _connect_histogram.snapshot()
+
+
+def stats_query():
+    """Histograma (ms) de ejecución más lectura de cada consulta."""
+    return _query_histogram.snapshot()
+
+
+def stats():
+    """Histogramas por ruta y globales, más las últimas consultas lentas."""
+    with _stats_lock:
+        routes = dict(_route_stats)
+    return {
+        'enabled': ENABLED,
+        'slow_ms': SLOW_MS,
+        'connect_ms': _connect_histogram.snapshot(),
+        'query_ms': _query_histogram.snapshot(),
+        'routes': {
+            route: {
+                'requests': s.requests,
+                'queries': s.queries,
+                'duration_ms': s.duration.snapshot(),
+                'db_ms': s.db_time.snapshot(),
+                'queries_per_request': s.query_count.snapshot(),
+            }
+            for route, s in sorted(routes.items())
+        },
+        'slow_queries': slow_queries(),
+    }
+
+
+def reset():
+    """Vacía los agregados (p. ej. entre rondas de benchmark)."""
+    global _connect_histogram, _query_histogram
+    with _stats_lock:
+        _route_stats.clear()
+        _connect_histogram = Histogram()
+        _query_histogram = Histogram()
+    with _slow_lock:
+        _slow_recent.clear()
+
+
+# ---------------------------------------------------------------- Flask
+
+def server_timing(profile, total_ms):
+    """Valor de la cabecera Server-Timing para un perfil."""
+    parts = [
+        f'db;dur={profile.db_ms:.2f};desc="{profile.query_count} consultas, {profile.connections} conexiones"',
+        f'connect;dur={profile.connect_ms:.2f}',
+        f'execute;dur={profile.execute_ms:.2f}',
+        f'fetch;dur={profile.fetch_ms:.2f}',
+        f'total;dur={total_ms:.2f}',
+    ]
+    return ', '.join(parts)
+
+
+def init_app(app):
+    """Registra los hooks de Flask que perfilan cada petición."""
+    if not ENABLED:
+        return
+    from flask import request
+
+    @app.before_request
+    def _begin_sql_profile():
+        begin_profile()
+        _local.route = request.endpoint
+
+    @app.after_request
+    def _finish_sql_profile(response):
+        profile = end_profile()
+        _local.route = None
+        if profile is not None:
+            total_ms = record_request(request.endpoint or 'desconocida', profile)
+            response.headers['Server-Timing'] = server_timing(profile, total_ms)
+        return response
+
+    @app.teardown_request
+    def _drop_sql_profile(exc):
+        # Si la vista lanzó una excepción no hubo after_request: no dejar el perfil colgado.
+        end_profile()
+        _local.route = None
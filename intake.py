@@ -0,0 +1,359 @@
+"""Cola de entrada duradera para las solicitudes de ayuda.
+
+`formulario_ayuda` no inserta directamente en MySQL: guarda la solicitud en un
+diario local SQLite (modo WAL, `synchronous=FULL`, es decir, sincronizado en
+disco al confirmar) y responde al ciudadano. Un hilo en segundo plano vacía el
+diario por lotes llamando a `db.insert_emergencia_batch`, reintentando con espera
+exponencial mientras MySQL no esté disponible. Una solicitud que MySQL
+rechaza por sus datos (error permanente) o que agota `INTAKE_MAX_ATTEMPTS`
+intentos pasa a 'fallida': se conserva en el diario con el último error
+(ver `failed`) para revisarla a mano y aparece en `/admin/intake`.
+
+Las solicitudes que `dedup.py` marca como duplicadas (`parent_id`, el id en el
+diario del reporte original) no crean emergencia: cuando el original ya tiene
+`emergencia_id`, se vinculan a ella con `db.insert_reporte_duplicado_batch`.
+Si el original no llega a tener emergencia tras `LINK_MAX_ATTEMPTS` intentos,
+o su emergencia ya no existe (borrada o archivada: la clave foránea falla), el
+duplicado se desvincula y se inserta como una emergencia nueva, para que
+ninguna solicitud se quede sin llegar a despacho.
+
+Variables de entorno:
+INTAKE_JOURNAL_PATH, INTAKE_BATCH_SIZE, INTAKE_POLL_INTERVAL, INTAKE_MAX_BACKOFF,
+INTAKE_MAX_ATTEMPTS
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import db
+
+
+# Una fila 'procesando' más antigua que esto se considera abandonada
+# (proceso caído a mitad de lote) y vuelve a 'pendiente'.
+STALE_CLAIM_SECONDS = 300
+# Las filas ya insertadas se conservan este tiempo como comprobante.
+DONE_RETENTION_SECONDS = 7 * 24 * 3600
+# Intentos de vincular un duplicado antes de insertarlo como emergencia nueva
+# (con la espera exponencial, unos 4 minutos).
+LINK_MAX_ATTEMPTS = 8
+
+
+class IntakeJournal:
+    """Diario append-only de solicitudes pendientes de insertar en MySQL."""
+
+    def __init__(self, path, batch_size=50, poll_interval=1.0, max_backoff=300.0, max_attempts=50):
+        self.path = path
+        self.batch_size = max(int(batch_size), 1)
+        self.poll_interval = float(poll_interval)
+        self.max_backoff = float(max_backoff)
+        self.max_attempts = max(int(max_attempts), 1)
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS intake (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pendiente',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                claimed_at REAL,
+                last_error TEXT,
+                emergencia_id INTEGER,
+                servicio_id INTEGER,
+                latitud REAL,
+                longitud REAL,
+                texto TEXT,
+                parent_id INTEGER,
+                similitud REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_intake_status ON intake(status, next_attempt);
+            """
+        )
+        # Diarios creados antes de la detección de duplicados.
+        existing = {row[1] for row in self._conn().execute("PRAGMA table_info(intake)")}
+        for column, kind in _DEDUP_COLUMNS:
+            if column not in existing:
+                self._conn().execute(f"ALTER TABLE intake ADD COLUMN {column} {kind}")
+
+    def submit(self, record, servicio_id=None, texto=None, parent_id=None, similitud=None):
+        """Guarda `record` (kwargs de `insert_emergencia`) y devuelve su id en el diario.
+
+        `servicio_id` y `texto` son los datos que compara `dedup.py`; con
+        `parent_id` la solicitud es un duplicado de esa otra. Al volver, la
+        solicitud ya está sincronizada en disco.
+        """
+        payload = json.dumps(record, default=_json_default)
+        cursor = self._conn().execute(
+            "INSERT INTO intake (payload, created, servicio_id, latitud, longitud, texto, parent_id, similitud) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (payload, time.time(), servicio_id, record.get('latitud'), record.get('longitud'), texto, parent_id, similitud)
+        )
+        self.start()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def recent(self, after_id, since):
+        """Solicitudes con id mayor que `after_id` creadas desde `since` (epoch), para el índice de `dedup.py`."""
+        return self._conn().execute(
+            "SELECT id, created, servicio_id, latitud, longitud, texto, parent_id FROM intake WHERE id > ? AND created >= ? ORDER BY id",
+            (after_id, since)
+        ).fetchall()
+
+    def _claim(self):
+        """Marca como 'procesando' un lote de filas pendientes y las devuelve."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE intake SET status='pendiente' WHERE status='procesando' AND claimed_at < ?",
+                (now - STALE_CLAIM_SECONDS,)
+            )
+            rows = conn.execute(
+                "SELECT id, payload, attempts, parent_id, similitud FROM intake WHERE status='pendiente' AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (now, self.batch_size)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE intake SET status='procesando', claimed_at=? WHERE id=?",
+                    [(now, row[0]) for row in rows]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def drain_once(self):
+        """Inserta en MySQL un lote del diario. Devuelve cuántas filas se insertaron o vincularon."""
+        rows = self._claim()
+        if not rows:
+            return 0
+        nuevas = [row for row in rows if row[3] is None]
+        duplicadas = [row for row in rows if row[3] is not None]
+        now = time.time()
+        done = []
+        linked = []
+        failed = []
+        promoted = []
+        dead = []
+
+        def retry(row, error):
+            if row[2] + 1 >= self.max_attempts:
+                dead.append((f"Agotados {self.max_attempts} intentos: {error}"[:500], row[0]))
+                return
+            delay = min(self.max_backoff, 2 ** row[2])
+            failed.append((now + delay, error[:500], row[0]))
+
+        def promote(row, error):
+            # Vuelve a la cola como solicitud nueva, sin esperar.
+            promoted.append((f"Insertada como emergencia nueva: {error}"[:500], row[0]))
+
+        if nuevas:
+            result = db.insert_emergencia_batch([json.loads(row[1]) for row in nuevas])
+            errors = {item['index']: item for item in result['errors']}
+            for index, row in enumerate(nuevas):
+                emergencia_id = result['ids'][index]
+                error = errors.get(index, {})
+                if emergencia_id is not None:
+                    done.append((emergencia_id, row[0]))
+                elif error.get('permanent'):
+                    # MySQL rechaza los datos: reintentar no cambiaría el resultado.
+                    dead.append((error['error'][:500], row[0]))
+                else:
+                    retry(row, error.get('error', ''))
+            # Antes de buscar los originales: pueden ser filas de este mismo lote.
+            self._mark(done=done)
+        if duplicadas:
+            # El original tiene id menor: se insertó en este lote o en uno anterior (o sigue reintentándose).
+            parents = {row[3] for row in duplicadas}
+            emergencias = dict(self._conn().execute(
+                f"SELECT id, emergencia_id FROM intake WHERE emergencia_id IS NOT NULL AND id IN ({', '.join('?' * len(parents))})",
+                tuple(parents)
+            ).fetchall())
+            listas = [row for row in duplicadas if row[3] in emergencias]
+            for row in duplicadas:
+                if row[3] in emergencias:
+                    continue
+                error = f"El reporte original {row[3]} aún no tiene emergencia"
+                if row[2] + 1 >= LINK_MAX_ATTEMPTS:
+                    promote(row, error)
+                else:
+                    retry(row, error)
+            if listas:
+                result = db.insert_reporte_duplicado_batch([
+                    _reporte(json.loads(row[1]), emergencias[row[3]], row[4]) for row in listas
+                ])
+                errors = {item['index']: item for item in result['errors']}
+                for index, row in enumerate(listas):
+                    if result['ids'][index] is not None:
+                        linked.append((emergencias[row[3]], row[0]))
+                    elif errors.get(index, {}).get('integrity'):
+                        # La emergencia del original se borró o se archivó.
+                        promote(row, errors[index]['error'])
+                    else:
+                        retry(row, errors.get(index, {}).get('error', ''))
+        self._mark(linked=linked, failed=failed, promoted=promoted, dead=dead)
+        return len(done) + len(linked) + len(promoted)
+
+    def _mark(self, done=(), linked=(), failed=(), promoted=(), dead=()):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            self._apply_marks(conn, done, linked, failed, promoted, dead)
+            conn.execute("COMMIT")
+        except Exception:
+            # Sin esto la conexión del hilo quedaría dentro de la transacción y
+            # todos los `BEGIN IMMEDIATE` posteriores de `_claim` fallarían.
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _apply_marks(conn, done, linked, failed, promoted, dead):
+        conn.executemany(
+            "UPDATE intake SET status='insertada', emergencia_id=?, last_error=NULL WHERE id=?", done
+        )
+        conn.executemany(
+            "UPDATE intake SET status='vinculada', emergencia_id=?, last_error=NULL WHERE id=?", linked
+        )
+        conn.executemany(
+            "UPDATE intake SET status='pendiente', attempts=attempts+1, next_attempt=?, last_error=? WHERE id=?", failed
+        )
+        conn.executemany(
+            "UPDATE intake SET status='pendiente', parent_id=NULL, similitud=NULL, attempts=0, next_attempt=0, last_error=? WHERE id=?",
+            promoted
+        )
+        conn.executemany(
+            "UPDATE intake SET status='fallida', attempts=attempts+1, last_error=? WHERE id=?", dead
+        )
+
+    def failed(self, limit=20):
+        """Las últimas solicitudes 'fallida' (id, creada, intentos, último error, datos), para revisarlas."""
+        return [
+            {'id': row[0], 'created': row[1], 'attempts': row[2], 'last_error': row[3], 'record': json.loads(row[4])}
+            for row in self._conn().execute(
+                "SELECT id, created, attempts, last_error, payload FROM intake WHERE status='fallida' ORDER BY id DESC LIMIT ?",
+                (limit,)
+            )
+        ]
+
+    def purge(self):
+        """Elimina las filas ya insertadas con más antigüedad que la retención (las fallidas se conservan)."""
+        self._conn().execute(
+            "DELETE FROM intake WHERE status IN ('insertada', 'vinculada') AND created < ?",
+            (time.time() - DONE_RETENTION_SECONDS,)
+        )
+
+    def _run(self):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                drained = self.drain_once()
+                if time.monotonic() - last_purge > 3600:
+                    self.purge()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                sys.stderr.write(f"intake: error vaciando el diario: {e}\n")
+                drained = 0
+            if not drained:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def start(self):
+        """Arranca el hilo de vaciado si no está en marcha."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='intake-drainer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """Cuenta filas por estado y la antigüedad de la solicitud pendiente más vieja."""
+        conn = self._conn()
+        data = {status: count for status, count in conn.execute(
+            "SELECT status, COUNT(*) FROM intake GROUP BY status"
+        )}
+        oldest = conn.execute(
+            "SELECT MIN(created) FROM intake WHERE status IN ('pendiente', 'procesando')"
+        ).fetchone()[0]
+        data.setdefault('fallida', 0)
+        data['oldest_pending_seconds'] = round(time.time() - oldest, 3) if oldest else 0
+        data['drainer_alive'] = self._thread is not None and self._thread.is_alive()
+        return data
+
+
+_DEDUP_COLUMNS = (
+    ('servicio_id', 'INTEGER'), ('latitud', 'REAL'), ('longitud', 'REAL'),
+    ('texto', 'TEXT'), ('parent_id', 'INTEGER'), ('similitud', 'REAL'),
+)
+
+
+def _reporte(record, emergencia_id, similitud):
+    """Registro de `insert_reporte_duplicado_batch` a partir de la solicitud guardada."""
+    return {
+        'emergencia_id': emergencia_id,
+        'fecha_hora': record.get('fecha_hora'),
+        'ubicacion': record.get('ubicacion'),
+        'latitud': record.get('latitud'),
+        'longitud': record.get('longitud'),
+        'descripcion': record.get('descripcion'),
+        'observaciones': record.get('observaciones'),
+        'similitud': similitud,
+    }
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """Devuelve el diario de entrada del proceso, creándolo la primera vez."""
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = IntakeJournal(
+                    os.getenv('INTAKE_JOURNAL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intake_journal.db')),
+                    batch_size=int(os.getenv('INTAKE_BATCH_SIZE', '50')),
+                    poll_interval=float(os.getenv('INTAKE_POLL_INTERVAL', '1')),
+                    max_backoff=float(os.getenv('INTAKE_MAX_BACKOFF', '300')),
+                    max_attempts=int(os.getenv('INTAKE_MAX_ATTEMPTS', '50')),
+                )
+    return _journal
@@ -0,0 +1,219 @@
+"""Métricas de la aplicación en formato de texto de Prometheus.
+
+Los contadores viven en memoria del proceso y se actualizan con hooks de Flask
+y señales (`message_flashed`, `got_request_exception`), sin tocar las vistas.
+`/metrics` los expone junto con los tiempos de conexión y consulta de
+`instrument`, el estado del pool, la caché y el diario de entrada, y el número
+de emergencias por `estadoEmergencia`.
+
+Con varios procesos cada uno expone sus propios contadores; Prometheus los
+distingue por instancia.
+"""
+import threading
+import time
+
+import instrument
+
+
+PREFIX = 'appemergencia'
+
+
+class _Family:
+    """Conjunto de series de una métrica, indexadas por tupla de etiquetas."""
+
+    def __init__(self, name, kind, help_text, labels=()):
+        self.name = f'{PREFIX}_{name}'
+        self.kind = kind
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Family):
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, 'counter', help_text, labels)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, values, count) for values, count in sorted(self._series.items())]
+
+
+class Histogram(_Family):
+    """Histograma en segundos que reutiliza las cubetas (ms) de `instrument.Histogram`."""
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, 'histogram', help_text, labels)
+
+    def observe(self, *label_values, ms):
+        series = self._series.get(label_values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(label_values, instrument.Histogram())
+        series.observe(ms)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._series.items())
+        out = []
+        for values, histogram in items:
+            out.extend(_histogram_samples(self.name, self.labels, values, histogram.snapshot()))
+        return out
+
+
+def _histogram_samples(name, labels, values, snapshot):
+    out = []
+    for bound, cumulative in snapshot['buckets']:
+        le = bound if bound == '+Inf' else _number(bound / 1000)
+        out.append((f'{name}_bucket', values + (le,), cumulative, labels + ('le',)))
+    out.append((f'{name}_sum', values, snapshot['sum'] / 1000))
+    out.append((f'{name}_count', values, snapshot['count']))
+    return out
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _line(name, labels, values, value):
+    if labels:
+        pairs = ','.join(f'{key}="{_escape(val)}"' for key, val in zip(labels, values))
+        return f'{name}{{{pairs}}} {_number(value)}'
+    return f'{name} {_number(value)}'
+
+
+def _render_family(kind, name, help_text, labels, samples):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for sample in samples:
+        sample_name, values, value = sample[:3]
+        sample_labels = sample[3] if len(sample) > 3 else labels
+        lines.append(_line(sample_name, sample_labels, values, value))
+    return lines
+
+
+# ---------------------------------------------------------------- métricas HTTP
+
+REQUESTS = Counter('http_requests_total', 'Peticiones atendidas por vista, método y código.',
+                   ('endpoint', 'method', 'status'))
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Duración de las peticiones por vista.',
+                             ('endpoint',))
+FLASHED_ERRORS = Counter('flashed_errors_total',
+                         "Errores capturados en las vistas y mostrados con flash(..., 'danger').",
+                         ('endpoint',))
+UNHANDLED_EXCEPTIONS = Counter('unhandled_exceptions_total', 'Excepciones no capturadas por las vistas.',
+                               ('endpoint',))
+
+_FAMILIES = (REQUESTS, REQUEST_DURATION, FLASHED_ERRORS, UNHANDLED_EXCEPTIONS)
+
+
+def _collect_db():
+    """Métricas de base de datos leídas de `instrument` y del pool/caché de `db`."""
+    import db
+
+    families = []
+    for name, help_text, snapshot in (
+        ('db_connect_seconds', 'Tiempo en obtener una conexión (pool o nueva).', instrument.stats_connect()),
+        ('db_query_seconds', 'Tiempo de ejecución más lectura de cada consulta.', instrument.stats_query()),
+    ):
+        families.append(('histogram', f'{PREFIX}_{name}', help_text, (),
+                         _histogram_samples(f'{PREFIX}_{name}', (), (), snapshot)))
+
+    pool = db.pool_stats()
+    for key in ('checked_out', 'idle', 'total', 'size', 'max_overflow'):
+        if key in pool:
+            families.append(('gauge', f'{PREFIX}_db_pool_{key}', f'Pool de conexiones: {key}.', (),
+                             [(f'{PREFIX}_db_pool_{key}', (), pool[key])]))
+    for key in ('created', 'discarded', 'recycled', 'waits', 'timeouts', 'checkouts'):
+        if key in pool:
+            families.append(('counter', f'{PREFIX}_db_pool_{key}_total', f'Pool de conexiones: {key}.', (),
+                             [(f'{PREFIX}_db_pool_{key}_total', (), pool[key])]))
+    if 'wait_time' in pool:
+        families.append(('counter', f'{PREFIX}_db_pool_wait_seconds_total', 'Tiempo total esperando conexión.', (),
+                         [(f'{PREFIX}_db_pool_wait_seconds_total', (), pool['wait_time'])]))
+
+    cache = db.cache_stats()
+    for key in ('hits', 'misses', 'invalidations'):
+        families.append(('counter', f'{PREFIX}_cache_{key}_total', f'Caché de lecturas: {key}.', (),
+                         [(f'{PREFIX}_cache_{key}_total', (), cache[key])]))
+    families.append(('gauge', f'{PREFIX}_cache_entries', 'Entradas en la caché de lecturas.', (),
+                     [(f'{PREFIX}_cache_entries', (), cache['size'])]))
+    return families
+
+
+def _collect_business():
+    """Emergencias por estado y solicitudes pendientes del diario de entrada."""
+    import db
+    from intake import get_journal
+
+    families = []
+    try:
+        counts = db.count_emergencias_por_estado()
+        families.append(('gauge', f'{PREFIX}_emergencias', 'Emergencias por estadoEmergencia.', ('estado',),
+                         [(f'{PREFIX}_emergencias', (estado,), count) for estado, count in sorted(counts.items())]))
+        up = 1
+    except Exception:
+        up = 0
+    families.append(('gauge', f'{PREFIX}_db_up', 'La última consulta de métricas a la base de datos funcionó.', (),
+                     [(f'{PREFIX}_db_up', (), up)]))
+
+    try:
+        journal = get_journal().stats()
+        families.append(('gauge', f'{PREFIX}_intake_rows', 'Filas del diario de entrada por estado.', ('status',),
+                         [(f'{PREFIX}_intake_rows', (status,), journal.get(status, 0))
+                          for status in ('pendiente', 'procesando', 'insertada', 'vinculada', 'fallida')]))
+        families.append(('gauge', f'{PREFIX}_intake_oldest_pending_seconds',
+                         'Antigüedad de la solicitud pendiente más vieja.', (),
+                         [(f'{PREFIX}_intake_oldest_pending_seconds', (), journal['oldest_pending_seconds'])]))
+    except Exception:
+        pass
+    return families
+
+
+def render():
+    """Texto completo de `/metrics`."""
+    lines = []
+    for family in _FAMILIES:
+        lines.extend(_render_family(family.kind, family.name, family.help, family.labels, family.samples()))
+    for kind, name, help_text, labels, samples in _collect_db() + _collect_business():
+        lines.extend(_render_family(kind, name, help_text, labels, samples))
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Registra los hooks y señales que alimentan los contadores."""
+    from flask import g, message_flashed, got_request_exception, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_finish(response):
+        started = g.pop('_metrics_started', None)
+        endpoint = request.endpoint or 'desconocida'
+        REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        if started is not None:
+            REQUEST_DURATION.observe(endpoint, ms=(time.perf_counter() - started) * 1000)
+        return response
+
+    def _on_flash(sender, message, category, **extra):
+        if category == 'danger':
+            FLASHED_ERRORS.inc(request.endpoint or 'desconocida')
+
+    def _on_exception(sender, exception, **extra):
+        UNHANDLED_EXCEPTIONS.inc(request.endpoint or 'desconocida')
+
+    message_flashed.connect(_on_flash, app, weak=False)
+    got_request_exception.connect(_on_exception, app, weak=False)
@@ -0,0 +1,169 @@
+"""Hashing de contraseñas fuera del hilo de la petición.
+
+Los hashes guardados llevan el algoritmo y su coste:
+- `pbkdf2_sha256$<iteraciones>$<salt>$<hash>`
+- `scrypt$<n>$<r>$<p>$<salt>$<hash>`
+El formato antiguo `<salt>$<hash>` (PBKDF2-SHA256, 100000 iteraciones) se sigue
+aceptando; `needs_rehash` indica cuándo conviene regenerarlo con el coste actual.
+
+El cálculo se hace en un pool de procesos acotado para no bloquear el GIL.
+Si un proceso del pool muere (p. ej. por falta de memoria) el pool queda roto:
+se sustituye por uno nuevo y el cálculo se reintenta una vez.
+
+Variables de entorno:
+PASSWORD_ALGORITHM, PASSWORD_ITERATIONS, PASSWORD_SCRYPT_N,
+PASSWORD_WORKERS, PASSWORD_QUEUE_LIMIT, PASSWORD_QUEUE_TIMEOUT
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+LEGACY_ITERATIONS = 100000
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+class PasswordBusyError(RuntimeError):
+    """Hay demasiados cálculos de contraseña en cola; el cliente debe reintentar."""
+
+
+def _derive(algorithm, password, salt, params):
+    """Calcula el hash en hexadecimal. Se ejecuta en un proceso del pool."""
+    if algorithm == 'pbkdf2_sha256':
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations).hex()
+    if algorithm == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+                              maxmem=128 * r * n * 2 + 1024 * 1024).hex()
+    raise ValueError(f"Algoritmo de contraseña desconocido: {algorithm}")
+
+
+def _current_params():
+    algorithm = os.getenv('PASSWORD_ALGORITHM', 'pbkdf2_sha256')
+    if algorithm == 'scrypt':
+        return algorithm, (int(os.getenv('PASSWORD_SCRYPT_N', '16384')), SCRYPT_R, SCRYPT_P)
+    return 'pbkdf2_sha256', (int(os.getenv('PASSWORD_ITERATIONS', str(LEGACY_ITERATIONS))),)
+
+
+def _parse(stored):
+    """Devuelve (algoritmo, parámetros, salt, hash, es_formato_antiguo) de un hash guardado."""
+    parts = stored.split('$')
+    if len(parts) == 2:
+        salt, pwd_hash = parts
+        return 'pbkdf2_sha256', (LEGACY_ITERATIONS,), salt, pwd_hash, True
+    if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        return 'pbkdf2_sha256', (int(parts[1]),), parts[2], parts[3], False
+    if parts[0] == 'scrypt' and len(parts) == 6:
+        return 'scrypt', (int(parts[1]), int(parts[2]), int(parts[3])), parts[4], parts[5], False
+    raise ValueError("Formato de hash de contraseña no reconocido")
+
+
+class PasswordHasher:
+    """Ejecuta los cálculos de hash en un pool de procesos con cola limitada.
+
+    Con `workers=0` el cálculo se hace en el propio hilo (desarrollo y pruebas).
+    Si ya hay `queue_limit` cálculos pendientes, se espera hasta
+    `queue_timeout` segundos y después se lanza `PasswordBusyError`.
+    """
+
+    def __init__(self, workers=2, queue_limit=32, queue_timeout=2.0):
+        self.workers = max(int(workers), 0)
+        self.queue_timeout = float(queue_timeout)
+        self._slots = threading.BoundedSemaphore(max(int(queue_limit), 1))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _discard(self, executor):
+        """Retira `executor` (roto) para que `_get_executor` cree otro."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, algorithm, password, salt, params):
+        if not self.workers:
+            return _derive(algorithm, password, salt, params)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordBusyError("Servidor ocupado verificando contraseñas, inténtalo de nuevo")
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(_derive, algorithm, password, salt, params).result()
+            except BrokenProcessPool:
+                # Un solo reintento: si el pool nuevo también se rompe, el error sube.
+                self._discard(executor)
+                return self._get_executor().submit(_derive, algorithm, password, salt, params).result()
+        finally:
+            self._slots.release()
+
+    def warm_up(self):
+        """Arranca los procesos del pool para que el primer login no pague su creación."""
+        if not self.workers:
+            return
+        executor = self._get_executor()
+        for future in [executor.submit(abs, 0) for _ in range(self.workers)]:
+            future.result()
+
+    def hash(self, password):
+        algorithm, params = _current_params()
+        salt = secrets.token_hex(32)
+        pwd_hash = self._run(algorithm, password, salt, params)
+        return '$'.join([algorithm, *map(str, params), salt, pwd_hash])
+
+    def verify(self, password, stored):
+        """Compara `password` con el hash guardado. Un hash ilegible no coincide;
+        los fallos del pool (ocupado, roto) se propagan y no cuentan como contraseña incorrecta."""
+        try:
+            algorithm, params, salt, pwd_hash, _ = _parse(stored)
+        except (ValueError, AttributeError):
+            return False
+        try:
+            attempt = self._run(algorithm, password, salt, params)
+        except ValueError:
+            # Parámetros guardados que `_derive` no acepta (hash corrupto).
+            return False
+        return hmac.compare_digest(attempt.encode(), pwd_hash.encode())
+
+    def needs_rehash(self, stored):
+        """Indica si `stored` usa un algoritmo o coste distinto del configurado."""
+        try:
+            algorithm, params, _, _, legacy = _parse(stored)
+        except (ValueError, AttributeError):
+            return False
+        return legacy or (algorithm, params) != _current_params()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """Devuelve el `PasswordHasher` del proceso, creándolo la primera vez."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(
+                    workers=int(os.getenv('PASSWORD_WORKERS', str(max((os.cpu_count() or 2) // 2, 1)))),
+                    queue_limit=int(os.getenv('PASSWORD_QUEUE_LIMIT', '32')),
+                    queue_timeout=float(os.getenv('PASSWORD_QUEUE_TIMEOUT', '2')),
+                )
+    return _hasher
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class PoolTimeoutError(Error):
+    """No se pudo obtener una conexión del pool dentro del tiempo de espera."""
+
+
+class PooledConnection:
+    """Conexión prestada por `ConnectionPool`.
+
+    Se comporta como la conexión de `mysql.connector` (cursor, commit,
+    rollback, ...), pero `close()` la devuelve al pool en lugar de cerrarla.
+    `is_connected()` indica si la conexión sigue prestada, para que el patrón
+    `if conn and conn.is_connected(): conn.close()` de `db.py` siempre la
+    devuelva.
+    """
+
+    def __init__(self, pool, raw, uses):
+        self._pool = pool
+        self._raw = raw
+        self._uses = uses
+
+    def cursor(self, *args, **kwargs):
+        return self._raw.cursor(*args, **kwargs)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        if self._raw is not None:
+            self._raw.rollback()
+
+    def is_connected(self):
+        return self._raw is not None
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool.release(raw, self._uses)
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise Error(msg="La conexión ya fue devuelta al pool")
+        return getattr(self._raw, name)
+
+    def __del__(self):
+        # Red de seguridad: una conexión olvidada no debe ocupar un hueco del pool.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Pool de conexiones MySQL con desborde, caducidad y reciclaje.
+
+    - `size`: conexiones que se mantienen abiertas en reposo.
+    - `max_overflow`: conexiones extra permitidas en picos; se cierran al devolverse.
+    - `timeout`: segundos máximos esperando una conexión libre.
+    - `idle_timeout`: segundos en reposo tras los cuales una conexión se descarta.
+    - `pre_ping`: comprueba la conexión con `ping()` antes de prestarla.
+    - `recycle`: número de préstamos tras los cuales la conexión se reemplaza.
+    - `connect`: función que abre una conexión (por defecto `mysql.connector.connect`).
+    """
+
+    def __init__(self, connect_args, size=5, max_overflow=10, timeout=30.0,
+                 idle_timeout=300.0, pre_ping=True, recycle=1000, connect=None):
+        self.connect_args = dict(connect_args)
+        self.connect = connect or mysql.connector.connect
+        self.size = max(int(size), 1)
+        self.max_overflow = max(int(max_overflow), 0)
+        self.timeout = float(timeout)
+        self.idle_timeout = float(idle_timeout)
+        self.pre_ping = bool(pre_ping)
+        self.recycle = int(recycle)
+
+        self._cond = threading.Condition()
+        # Cada elemento: (conexión, instante del último uso, número de préstamos)
+        self._idle = deque()
+        self._total = 0
+        self._checked_out = 0
+        self._stats = {
+            'created': 0,
+            'discarded': 0,
+            'recycled': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'checkouts': 0,
+        }
+
+    def _connect(self):
+        return self.connect(**self.connect_args)
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _take_idle(self):
+        """Saca una conexión válida de la cola de reposo (con el lock tomado)."""
+        now = time.monotonic()
+        while self._idle:
+            raw, last_used, uses = self._idle.pop()
+            if self.idle_timeout and now - last_used > self.idle_timeout:
+                self._total -= 1
+                self._stats['discarded'] += 1
+                self._discard(raw)
+                continue
+            if self.recycle and uses >= self.recycle:
+                self._total -= 1
+                self._stats['recycled'] += 1
+                self._discard(raw)
+                continue
+            return raw, uses
+        return None
+
+    def acquire(self):
+        """Presta una conexión; espera hasta `timeout` si el pool está agotado."""
+        deadline = None
+        waited_since = None
+        with self._cond:
+            while True:
+                item = self._take_idle()
+                if item is not None:
+                    break
+                if self._total < self.size + self.max_overflow:
+                    self._total += 1
+                    item = (None, 0)
+                    break
+                if deadline is None:
+                    waited_since = time.monotonic()
+                    deadline = waited_since + self.timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += time.monotonic() - waited_since
+                    raise PoolTimeoutError(
+                        msg=f"Pool de conexiones agotado tras {self.timeout:.1f}s "
+                            f"({self._checked_out} conexiones en uso)"
+                    )
+                self._cond.wait(remaining)
+            if waited_since is not None:
+                self._stats['wait_time'] += time.monotonic() - waited_since
+            self._checked_out += 1
+            self._stats['checkouts'] += 1
+
+        raw, uses = item
+        try:
+            if raw is not None and self.pre_ping:
+                try:
+                    raw.ping(reconnect=False)
+                except Error:
+                    self._discard(raw)
+                    with self._cond:
+                        self._stats['discarded'] += 1
+                    raw, uses = None, 0
+            if raw is None:
+                raw = self._connect()
+                with self._cond:
+                    self._stats['created'] += 1
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw, uses + 1)
+
+    def release(self, raw, uses):
+        """Devuelve una conexión prestada al pool (o la cierra si sobra)."""
+        keep = True
+        try:
+            if not raw.is_connected():
+                keep = False
+            elif raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            keep = False
+
+        with self._cond:
+            self._checked_out -= 1
+            if keep and len(self._idle) < self.size:
+                self._idle.append((raw, time.monotonic(), uses))
+                raw = None
+            else:
+                self._total -= 1
+                self._stats['discarded'] += 1
+            self._cond.notify()
+        if raw is not None:
+            self._discard(raw)
+
+    def dispose(self):
+        """Cierra todas las conexiones en reposo."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        """Devuelve un diccionario con el estado y los contadores del pool."""
+        with self._cond:
+            data = dict(self._stats)
+            data.update({
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'checked_out': self._checked_out,
+                'idle': len(self._idle),
+                'total': self._total,
+            })
+        data['wait_time'] = round(data['wait_time'], 6)
+        return data
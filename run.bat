@@ -1,10 +1,14 @@
 @echo off
 REM Run the app using the project's virtualenv python if present.
+REM   run.bat        production server (wsgi.py: waitress if installed)
+REM   run.bat dev    Flask development server with the debugger (app.py)
 SET ROOT=%~dp0
 SET VENV=%ROOT%\.venv\Scripts\python.exe
+SET ENTRY=%ROOT%wsgi.py
+IF /I "%1"=="dev" SET ENTRY=%ROOT%app.py
 IF EXIST "%VENV%" (
-  "%VENV%" "%ROOT%app.py"
+  "%VENV%" "%ENTRY%"
 ) ELSE (
   echo .venv not found, trying system python
-  python "%ROOT%app.py"
+  python "%ENTRY%"
 )
@@ -1,20 +1,17 @@
 <#
 Run the app using the project's virtualenv Python if present.
-Usage: From PowerShell run `.
-un.ps1` (no need to Activate.ps1).
-#>
-$root = Split-Path -Parent $MyInvocation.MyCommand.Definition
-$venvPython = Join-Path $root '.venv\Scripts\python.exe'
-<#
-Run the app using the project's virtualenv Python if present.
 Usage: From PowerShell run .\run.ps1 (no need to Activate.ps1).
+  .\run.ps1        production server (wsgi.py: waitress if installed)
+  .\run.ps1 dev    Flask development server with the debugger (app.py)
 #>
+param([string]$mode = '')
 $root = Split-Path -Parent $MyInvocation.MyCommand.Definition
 $venvPython = Join-Path $root '.venv\Scripts\python.exe'
+$entry = if ($mode -eq 'dev') { Join-Path $root 'app.py' } else { Join-Path $root 'wsgi.py' }
 if (Test-Path $venvPython) {
-    & $venvPython (Join-Path $root 'app.py')
+    & $venvPython $entry
     exit $LASTEXITCODE
 } else {
     Write-Host '.venv not found. Attempting system python...'
-    python (Join-Path $root 'app.py')
+    python $entry
 }
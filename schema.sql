@@ -14,7 +14,8 @@ CREATE TABLE IF NOT EXISTS tbusuario (
   direccionUsuario VARCHAR(255),
   emailUsuario VARCHAR(150),
   fechaRegistroUsuario DATETIME,
-  estadoUsuario VARCHAR(20)
+  estadoUsuario VARCHAR(20),
+  passwordUsuario VARCHAR(255)
 );
 
 -- Tabla de tipos de emergencia (PARENT)
@@ -37,7 +38,9 @@ CREATE TABLE IF NOT EXISTS tbservicioemergencia (
   capacidadServicioEmergencia INT,
   horarioServicioEmergencia VARCHAR(100),
   especialidadServicioEmergencia VARCHAR(100),
-  estadoServicioEmergencia VARCHAR(20)
+  estadoServicioEmergencia VARCHAR(20),
+  latitudServicioEmergencia DECIMAL(11,8),
+  longitudServicioEmergencia DECIMAL(11,8)
 );
 
 -- Tabla de contactos de emergencia
@@ -104,6 +107,20 @@ CREATE TABLE IF NOT EXISTS tbdespacho (
   FOREIGN KEY (tbEmergencia_idEmergencia) REFERENCES tbemergencia(idEmergencia) ON DELETE CASCADE ON UPDATE CASCADE
 );
 
+-- Reportes ciudadanos detectados como duplicados de una emergencia ya reportada (dedup.py)
+CREATE TABLE IF NOT EXISTS tbreporteduplicado (
+  idReporteDuplicado INT AUTO_INCREMENT PRIMARY KEY,
+  tbEmergencia_idEmergencia INT NOT NULL,
+  fechaHoraReporteDuplicado DATETIME,
+  ubicacionReporteDuplicado VARCHAR(300),
+  latitudReporteDuplicado DECIMAL(11,8),
+  longitudReporteDuplicado DECIMAL(11,8),
+  descripcionReporteDuplicado TEXT,
+  observacionesReporteDuplicado TEXT,
+  similitudReporteDuplicado DECIMAL(5,4),
+  FOREIGN KEY (tbEmergencia_idEmergencia) REFERENCES tbemergencia(idEmergencia) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
 -- Índices para mejorar búsquedas
 CREATE INDEX idx_emergencia_usuario ON tbemergencia(tbUsuario_idUsuario);
 CREATE INDEX idx_emergencia_tipo ON tbemergencia(tbTipoEmergencia_idTipoEmergencia);
@@ -114,3 +131,48 @@ CREATE INDEX idx_historial_usuario ON tbhistorialestados(tbUsuario_idUsuario);
 CREATE INDEX idx_despacho_servicio ON tbdespacho(tbServicioEmergencia_idServicioEmergencia);
 CREATE INDEX idx_despacho_emergencia ON tbdespacho(tbEmergencia_idEmergencia);
 CREATE INDEX idx_despacho_estado ON tbdespacho(estadoDespacho);
+CREATE INDEX idx_reporte_emergencia ON tbreporteduplicado(tbEmergencia_idEmergencia);
+
+-- Índices para la paginación por keyset de los listados
+CREATE INDEX idx_historial_fecha ON tbhistorialestados(fechaCambioHistorialEstados, idHistorialEstados);
+CREATE INDEX idx_despacho_asignacion ON tbdespacho(horaAsignacionDespacho, idDespacho);
+
+-- Índices de texto completo para la búsqueda de emergencias (db.buscar_emergencias)
+CREATE FULLTEXT INDEX ft_emergencia_texto ON tbemergencia(descripcionEmergencia, observacionesEmergencia, ubicacionEmergencia);
+CREATE FULLTEXT INDEX ft_historial_motivo ON tbhistorialestados(motivoHistorialEstados);
+
+-- Archivo de emergencias cerradas (archive.py): misma estructura que las tablas vivas, sin claves foráneas
+CREATE TABLE IF NOT EXISTS tbemergencia_archivo LIKE tbemergencia;
+CREATE TABLE IF NOT EXISTS tbhistorialestados_archivo LIKE tbhistorialestados;
+CREATE TABLE IF NOT EXISTS tbdespacho_archivo LIKE tbdespacho;
+CREATE TABLE IF NOT EXISTS tbreporteduplicado_archivo LIKE tbreporteduplicado;
+
+-- Índice para seleccionar las emergencias cerradas que se archivan
+CREATE INDEX idx_emergencia_estado_cierre ON tbemergencia(estadoEmergencia, fechaCierreEmergencia);
+
+-- Índice para el login por correo
+CREATE INDEX idx_usuario_email ON tbusuario(emailUsuario);
+
+-- Migración de bases creadas antes de `passwordUsuario` (el hash estaba en tipoUsuario como role|hash):
+-- ALTER TABLE tbusuario ADD COLUMN passwordUsuario VARCHAR(255);
+-- UPDATE tbusuario SET passwordUsuario = SUBSTRING_INDEX(tipoUsuario, '|', -1), tipoUsuario = SUBSTRING_INDEX(tipoUsuario, '|', 1) WHERE tipoUsuario LIKE '%|%';
+
+-- Migración: coordenadas de la base de cada servicio (búsqueda del servicio más cercano)
+-- ALTER TABLE tbservicioemergencia ADD COLUMN latitudServicioEmergencia DECIMAL(11,8), ADD COLUMN longitudServicioEmergencia DECIMAL(11,8);
+
+-- Migración: archivo de emergencias cerradas
+-- CREATE TABLE tbemergencia_archivo LIKE tbemergencia;
+-- CREATE TABLE tbhistorialestados_archivo LIKE tbhistorialestados;
+-- CREATE TABLE tbdespacho_archivo LIKE tbdespacho;
+-- CREATE INDEX idx_emergencia_estado_cierre ON tbemergencia(estadoEmergencia, fechaCierreEmergencia);
+
+-- Migración: reportes duplicados vinculados a una emergencia (ver la tabla tbreporteduplicado arriba)
+-- CREATE TABLE tbreporteduplicado (...);
+-- CREATE INDEX idx_reporte_emergencia ON tbreporteduplicado(tbEmergencia_idEmergencia);
+-- CREATE TABLE tbreporteduplicado_archivo LIKE tbreporteduplicado;
+
+-- Migración: búsqueda de texto completo (las tablas *_archivo creadas antes no copiaron estos índices)
+-- CREATE FULLTEXT INDEX ft_emergencia_texto ON tbemergencia(descripcionEmergencia, observacionesEmergencia, ubicacionEmergencia);
+-- CREATE FULLTEXT INDEX ft_historial_motivo ON tbhistorialestados(motivoHistorialEstados);
+-- ALTER TABLE tbemergencia_archivo ADD FULLTEXT INDEX ft_emergencia_texto (descripcionEmergencia, observacionesEmergencia, ubicacionEmergencia);
+-- ALTER TABLE tbhistorialestados_archivo ADD FULLTEXT INDEX ft_historial_motivo (motivoHistorialEstados);
@@ -0,0 +1,339 @@
+"""Sustituto local de MySQL sobre SQLite para benchmarks y desarrollo.
+
+Imita la parte de la API de `mysql.connector` que usa `db.py` (cursores con
+`dictionary=True`, marcadores `%s`, `lastrowid`, `rowcount`, `commit`,
+`rollback`, `ping`, `is_connected`) y crea las tablas con los mismos nombres de
+columna. Se activa con `DB_BACKEND=sqlite` y `DB_SQLITE_PATH=<fichero>`.
+No sustituye a MySQL en producción: tipos ENUM, claves foráneas en cascada y
+`ALTER TABLE ... AUTO_INCREMENT` no se reproducen. Los índices FULLTEXT son
+tablas FTS5 (`FULLTEXT`), con su propia fórmula de relevancia (bm25).
+"""
+import sqlite3
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from mysql.connector import errors
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tbusuario (
+  idUsuario INTEGER PRIMARY KEY AUTOINCREMENT,
+  cedulaUsuario TEXT,
+  nombresApellidosUsuario TEXT,
+  telefonoUsuario TEXT,
+  contactoEmergenciaUsuario TEXT,
+  tipoUsuario TEXT,
+  direccionUsuario TEXT,
+  emailUsuario TEXT,
+  fechaRegistroUsuario TEXT,
+  estadoUsuario TEXT,
+  passwordUsuario TEXT
+);
+CREATE TABLE IF NOT EXISTS tbtipoemergencia (
+  idTipoEmergencia INTEGER PRIMARY KEY AUTOINCREMENT,
+  nombreTipoEmergencia TEXT NOT NULL,
+  descripcionTipoEmergencia TEXT,
+  nivelPrioridadTipoEmergencia_3 TEXT NOT NULL,
+  estadoTipoEmergencia_4 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tbservicioemergencia (
+  idServicioEmergencia INTEGER PRIMARY KEY AUTOINCREMENT,
+  nombreServicioEmergencia TEXT,
+  tipoServicioEmergencia TEXT,
+  telefonoServicioEmergencia TEXT,
+  disponibilidadServicioEmergencia TEXT,
+  direccionBaseServicioEmergencia TEXT,
+  capacidadAtencionServicioEmergencia INTEGER,
+  horarioServicioEmergencia TEXT,
+  especialidadServicioEmergencia TEXT,
+  estadoServicioEmergencia TEXT,
+  latitudServicioEmergencia REAL,
+  longitudServicioEmergencia REAL
+);
+CREATE TABLE IF NOT EXISTS tbcontactoemergencia (
+  idContactoEmergencia INTEGER PRIMARY KEY AUTOINCREMENT,
+  tbTipoEmergencia_idTipoEmergencia INTEGER NOT NULL,
+  nombreContactoEmergencia TEXT,
+  telefonoContactoEmergencia TEXT,
+  tipoContactoEmergencia TEXT,
+  descripcionContactoEmergencia TEXT,
+  estadoContactoEmergencia TEXT
+);
+CREATE TABLE IF NOT EXISTS tbemergencia (
+  idEmergencia INTEGER PRIMARY KEY AUTOINCREMENT,
+  tbUsuario_idUsuario INTEGER NOT NULL,
+  tbTipoEmergencia_idTipoEmergencia INTEGER NOT NULL,
+  codigoEmergencia INTEGER,
+  fechaHoraEmergencia TEXT,
+  tipoEmergencia INTEGER,
+  estadoEmergencia TEXT,
+  ubicacionEmergencia TEXT,
+  latitudEmergencia REAL,
+  longitudEmergencia REAL,
+  descripcionEmergencia TEXT,
+  prioridadEmergencia TEXT,
+  idusuarioreportaEmergencia INTEGER,
+  fechaCierreEmergencia TEXT,
+  observacionesEmergencia TEXT
+);
+CREATE TABLE IF NOT EXISTS tbhistorialestados (
+  idHistorialEstados INTEGER PRIMARY KEY AUTOINCREMENT,
+  tbEmergencia_idEmergencia INTEGER NOT NULL,
+  tbUsuario_idUsuario INTEGER NOT NULL,
+  estadoAnterior TEXT,
+  estadoNuevo TEXT,
+  fechaCambioHistorialEstados TEXT,
+  usuarioCambioHistorialEstados TEXT,
+  motivoHistorialEstados TEXT
+);
+CREATE TABLE IF NOT EXISTS tbdespacho (
+  idDespacho INTEGER PRIMARY KEY AUTOINCREMENT,
+  tbServicioEmergencia_idServicioEmergencia INTEGER NOT NULL,
+  tbEmergencia_idEmergencia INTEGER NOT NULL,
+  idServicio INTEGER,
+  horaAsignacionDespacho TEXT,
+  horaLlegadaDespacho TEXT,
+  horaFinalizacionDespacho TEXT,
+  estadoDespacho TEXT,
+  observacionesDespacho TEXT,
+  tiempoRespuestaDespacho INTEGER,
+  calificacionDespacho INTEGER
+);
+CREATE TABLE IF NOT EXISTS tbreporteduplicado (
+  idReporteDuplicado INTEGER PRIMARY KEY AUTOINCREMENT,
+  tbEmergencia_idEmergencia INTEGER NOT NULL,
+  fechaHoraReporteDuplicado TEXT,
+  ubicacionReporteDuplicado TEXT,
+  latitudReporteDuplicado REAL,
+  longitudReporteDuplicado REAL,
+  descripcionReporteDuplicado TEXT,
+  observacionesReporteDuplicado TEXT,
+  similitudReporteDuplicado REAL
+);
+CREATE TABLE IF NOT EXISTS tbemergencia_archivo (
+  idEmergencia INTEGER PRIMARY KEY,
+  tbUsuario_idUsuario INTEGER NOT NULL,
+  tbTipoEmergencia_idTipoEmergencia INTEGER NOT NULL,
+  codigoEmergencia INTEGER,
+  fechaHoraEmergencia TEXT,
+  tipoEmergencia INTEGER,
+  estadoEmergencia TEXT,
+  ubicacionEmergencia TEXT,
+  latitudEmergencia REAL,
+  longitudEmergencia REAL,
+  descripcionEmergencia TEXT,
+  prioridadEmergencia TEXT,
+  idusuarioreportaEmergencia INTEGER,
+  fechaCierreEmergencia TEXT,
+  observacionesEmergencia TEXT
+);
+CREATE TABLE IF NOT EXISTS tbhistorialestados_archivo (
+  idHistorialEstados INTEGER PRIMARY KEY,
+  tbEmergencia_idEmergencia INTEGER NOT NULL,
+  tbUsuario_idUsuario INTEGER NOT NULL,
+  estadoAnterior TEXT,
+  estadoNuevo TEXT,
+  fechaCambioHistorialEstados TEXT,
+  usuarioCambioHistorialEstados TEXT,
+  motivoHistorialEstados TEXT
+);
+CREATE TABLE IF NOT EXISTS tbdespacho_archivo (
+  idDespacho INTEGER PRIMARY KEY,
+  tbServicioEmergencia_idServicioEmergencia INTEGER NOT NULL,
+  tbEmergencia_idEmergencia INTEGER NOT NULL,
+  idServicio INTEGER,
+  horaAsignacionDespacho TEXT,
+  horaLlegadaDespacho TEXT,
+  horaFinalizacionDespacho TEXT,
+  estadoDespacho TEXT,
+  observacionesDespacho TEXT,
+  tiempoRespuestaDespacho INTEGER,
+  calificacionDespacho INTEGER
+);
+CREATE TABLE IF NOT EXISTS tbreporteduplicado_archivo (
+  idReporteDuplicado INTEGER PRIMARY KEY,
+  tbEmergencia_idEmergencia INTEGER NOT NULL,
+  fechaHoraReporteDuplicado TEXT,
+  ubicacionReporteDuplicado TEXT,
+  latitudReporteDuplicado REAL,
+  longitudReporteDuplicado REAL,
+  descripcionReporteDuplicado TEXT,
+  observacionesReporteDuplicado TEXT,
+  similitudReporteDuplicado REAL
+);
+CREATE INDEX IF NOT EXISTS idx_usuario_email ON tbusuario(emailUsuario);
+CREATE INDEX IF NOT EXISTS idx_emergencia_usuario ON tbemergencia(tbUsuario_idUsuario);
+CREATE INDEX IF NOT EXISTS idx_emergencia_estado ON tbemergencia(estadoEmergencia);
+CREATE INDEX IF NOT EXISTS idx_historial_emergencia ON tbhistorialestados(tbEmergencia_idEmergencia);
+CREATE INDEX IF NOT EXISTS idx_historial_fecha ON tbhistorialestados(fechaCambioHistorialEstados, idHistorialEstados);
+CREATE INDEX IF NOT EXISTS idx_despacho_emergencia ON tbdespacho(tbEmergencia_idEmergencia);
+CREATE INDEX IF NOT EXISTS idx_despacho_asignacion ON tbdespacho(horaAsignacionDespacho, idDespacho);
+CREATE INDEX IF NOT EXISTS idx_emergencia_estado_cierre ON tbemergencia(estadoEmergencia, fechaCierreEmergencia);
+CREATE INDEX IF NOT EXISTS idx_historial_archivo_emergencia ON tbhistorialestados_archivo(tbEmergencia_idEmergencia);
+CREATE INDEX IF NOT EXISTS idx_reporte_emergencia ON tbreporteduplicado(tbEmergencia_idEmergencia);
+CREATE INDEX IF NOT EXISTS idx_reporte_archivo_emergencia ON tbreporteduplicado_archivo(tbEmergencia_idEmergencia);
+CREATE INDEX IF NOT EXISTS idx_despacho_archivo_emergencia ON tbdespacho_archivo(tbEmergencia_idEmergencia);
+"""
+
+# Índices FULLTEXT de schema.sql como tablas FTS5 de contenido externo
+# (`<tabla>_fts`, rowid = clave primaria) mantenidas con disparadores.
+FULLTEXT = (
+    ('tbemergencia', 'idEmergencia', ('descripcionEmergencia', 'observacionesEmergencia', 'ubicacionEmergencia')),
+    ('tbemergencia_archivo', 'idEmergencia', ('descripcionEmergencia', 'observacionesEmergencia', 'ubicacionEmergencia')),
+    ('tbhistorialestados', 'idHistorialEstados', ('motivoHistorialEstados',)),
+    ('tbhistorialestados_archivo', 'idHistorialEstados', ('motivoHistorialEstados',)),
+)
+
+
+def _fulltext_ddl(table, key, columns):
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    fts = f'{table}_fts'
+    return f"""
+CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', content_rowid='{key}', tokenize='unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+  INSERT INTO {fts}(rowid, {cols}) VALUES (new.{key}, {new});
+END;
+CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+  INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{key}, {old});
+END;
+CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+  INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{key}, {old});
+  INSERT INTO {fts}(rowid, {cols}) VALUES (new.{key}, {new});
+END;
+INSERT INTO {fts}({fts}) VALUES ('rebuild');
+"""
+
+
+def _ensure_fulltext(conn):
+    """Crea las tablas FTS5 que falten e indexa las filas que ya hubiera (bases anteriores)."""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, key, columns in FULLTEXT:
+        if f'{table}_fts' not in existing:
+            conn.executescript(_fulltext_ddl(table, key, columns))
+
+
+sqlite3.register_adapter(datetime, lambda value: value.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(Decimal, float)
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _translate(sql):
+    return sql.replace('%s', '?')
+
+
+def _wrap_error(e):
+    if isinstance(e, sqlite3.IntegrityError):
+        return errors.IntegrityError(msg=str(e))
+    if isinstance(e, sqlite3.OperationalError):
+        return errors.OperationalError(msg=str(e))
+    return errors.DatabaseError(msg=str(e))
+
+
+class SQLiteCursor:
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        try:
+            self._cursor.execute(_translate(sql), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise _wrap_error(e) from e
+
+    def executemany(self, sql, seq_params):
+        try:
+            self._cursor.executemany(_translate(sql), [tuple(p) for p in seq_params])
+        except sqlite3.Error as e:
+            raise _wrap_error(e) from e
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description or ())
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        # MySQL devuelve el primer id de un INSERT multi-fila; SQLite el último.
+        last = self._cursor.lastrowid
+        if last is not None and self._cursor.rowcount and self._cursor.rowcount > 1:
+            return last - self._cursor.rowcount + 1
+        return last
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._open = True
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._conn, dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        if not self._open:
+            raise errors.InterfaceError(msg="Conexión cerrada")
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        if self._open:
+            self._conn.close()
+            self._open = False
+
+
+def connect(database, **kwargs):
+    """Abre (y si hace falta inicializa) la base SQLite `database`."""
+    conn = SQLiteConnection(database)
+    if database not in _schema_ready:
+        with _schema_lock:
+            if database not in _schema_ready:
+                conn._conn.executescript(SCHEMA)
+                _ensure_fulltext(conn._conn)
+                _schema_ready.add(database)
+    return conn
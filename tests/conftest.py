@@ -0,0 +1,13 @@
+"""Las pruebas usan el sustituto SQLite (`sqlite_backend.py`) en un directorio temporal."""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix='appemergencia-tests-')
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(_tmp, 'tests.sqlite3')
+os.environ['INTAKE_JOURNAL_PATH'] = os.path.join(_tmp, 'intake.db')
+os.environ.setdefault('INTAKE_POLL_INTERVAL', '3600')
+os.environ.setdefault('EVENTS_POLL_INTERVAL', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,37 @@
+import db
+
+
+class _FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+
+    def close(self):
+        pass
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return _FakeCursor(self.executed)
+
+
+def _fake_mysql(monkeypatch, timeout):
+    monkeypatch.delenv('DB_BACKEND')
+    monkeypatch.setenv('DB_STATEMENT_TIMEOUT', timeout)
+    monkeypatch.setattr(db, '_connect_function', lambda: lambda **kwargs: _FakeConnection())
+
+
+def test_limite_de_lectura_por_sesion(monkeypatch):
+    _fake_mysql(monkeypatch, '2.5')
+    conn = db._open_connection(host='x')
+    assert conn.executed == [("SET SESSION max_execution_time = %s", (2500,))]
+
+
+def test_sin_limite_no_toca_la_sesion(monkeypatch):
+    _fake_mysql(monkeypatch, '0')
+    assert db._open_connection(host='x').executed == []
@@ -0,0 +1,79 @@
+import threading
+
+from dedup import DuplicateDetector
+from intake import IntakeJournal
+
+
+def _record(latitud=4.6097, longitud=-74.0817):
+    return {'descripcion': 'x', 'ubicacion': 'Calle 45 barrio San Fernando', 'latitud': latitud, 'longitud': longitud}
+
+
+def _detector(tmp_path, journal_cls=IntakeJournal):
+    journal = journal_cls(str(tmp_path / 'intake.db'), poll_interval=3600)
+    journal.start = lambda: None
+    return DuplicateDetector(journal)
+
+
+def test_misma_direccion_incidente_distinto(tmp_path):
+    detector = _detector(tmp_path)
+    _, primero = detector.submit(_record(), 1, 'dolor de pecho fuerte')
+    _, segundo = detector.submit(_record(), 1, 'incendio en la cocina')
+    assert primero is None
+    assert segundo is None
+
+
+def test_mismo_incidente_cercano_es_duplicado(tmp_path):
+    detector = _detector(tmp_path)
+    original, _ = detector.submit(_record(), 1, 'incendio en la cocina del edificio')
+    _, coincidencia = detector.submit(_record(4.6099, -74.0815), 1, 'incendio cocina edificio con humo')
+    assert coincidencia is not None
+    assert coincidencia['parent_id'] == original
+
+
+class _SlowJournal(IntakeJournal):
+    """Diario cuya primera escritura espera a que se le dé paso."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def submit(self, *args, **kwargs):
+        if not self.entered.is_set():
+            self.entered.set()
+            assert self.release.wait(5)
+        return super().submit(*args, **kwargs)
+
+
+def test_escritura_fuera_del_candado(tmp_path):
+    detector = _detector(tmp_path, _SlowJournal)
+    journal = detector.journal
+    result = {}
+    first = threading.Thread(target=lambda: result.setdefault('a', detector.submit(_record(), 1, 'incendio en la cocina del edificio')))
+    first.start()
+    assert journal.entered.wait(5)
+    # Mientras la primera solicitud se escribe, otra la encuentra como original y espera su id real.
+    second = threading.Thread(target=lambda: result.setdefault('b', detector.submit(_record(), 1, 'incendio cocina edificio humo')))
+    second.start()
+    assert detector.find(1, 'dolor de pecho fuerte', 4.6097, -74.0817) is None
+    journal.release.set()
+    first.join(5)
+    second.join(5)
+    original, _ = result['a']
+    _, coincidencia = result['b']
+    assert coincidencia['parent_id'] == original
+
+
+def test_formulario_misma_direccion_no_se_vincula():
+    import app as app_module
+    import db
+
+    servicio_id = db.insert_servicioemergencia('Bomberos', 'bomberos', '123', 'disponible', 'Base', 5, '24h', None, 'activo')
+    client = app_module.app.test_client()
+    form = {'nombre': 'Ana', 'telefono': '555', 'ubicacion': 'Calle 45 barrio San Fernando', 'grupo_sanguineo': 'O+',
+            'latitud': '4.6097', 'longitud': '-74.0817'}
+    client.post(f'/formulario-ayuda/{servicio_id}', data=dict(form, descripcion='dolor de pecho fuerte'))
+    client.post(f'/formulario-ayuda/{servicio_id}', data=dict(form, descripcion='incendio en la cocina'))
+    with client.session_transaction() as sess:
+        mensajes = [message for _, message in sess.get('_flashes', [])]
+    assert mensajes and not any('ya había sido reportada' in message for message in mensajes)
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+import db
+
+
+def test_activos_iguales_en_panel_y_carga():
+    creados = {}
+    for estado in ('asignado', 'en_ruta', 'en_sitio', 'finalizado', None, ''):
+        creados[estado] = db.insert_despacho(1, 1, 1, datetime(2024, 1, 1), None, None, estado, '', None, None)
+    activos = {despacho_id for despacho_id, _ in db.get_despachos_activos()}
+    panel = {despacho_id for despacho_id, _ in db.get_panel_base(datetime(2024, 1, 1))['despachos']}
+    esperados = {despacho_id for estado, despacho_id in creados.items() if db.despacho_activo(estado)}
+    assert creados['finalizado'] not in esperados
+    assert activos >= esperados and panel >= esperados
+    assert creados['finalizado'] not in activos | panel
+    assert activos == panel
@@ -0,0 +1,25 @@
+import app as app_module
+import events
+
+
+def test_head_no_deja_consolas_suscritas(monkeypatch):
+    monkeypatch.setattr(events, 'MAX_SUBSCRIBERS', 3)
+    client = app_module.app.test_client()
+    before = events.bus.subscribers
+    for _ in range(5):
+        response = client.head('/eventos/emergencias')
+        assert response.status_code == 200
+        response.close()
+    assert events.bus.subscribers == before
+
+
+def test_desconexion_antes_del_primer_bloque_libera_la_consola(monkeypatch):
+    monkeypatch.setattr(events, 'MAX_SUBSCRIBERS', 3)
+    client = app_module.app.test_client()
+    before = events.bus.subscribers
+    for _ in range(5):
+        response = client.get('/eventos/emergencias', buffered=False)
+        assert response.status_code == 200
+        response.close()
+    assert events.bus.subscribers == before
+    assert client.get('/eventos/emergencias/poll?timeout=0').status_code == 200
@@ -0,0 +1,62 @@
+import sqlite3
+
+import db
+from intake import IntakeJournal
+
+
+RECORD = {
+    'usuario_id': 1, 'tipoemergencia_id': 1, 'codigo': None, 'fecha_hora': '2026-10-18 10:00:00', 'tipo': None,
+    'estado': 'reportada', 'ubicacion': 'Calle 1', 'latitud': None, 'longitud': None, 'descripcion': 'Prueba',
+    'prioridad': 'media', 'idusuarioreporta': 1, 'fecha_cierre': None, 'observaciones': None,
+}
+
+
+def _journal(tmp_path, **kwargs):
+    journal = IntakeJournal(str(tmp_path / 'intake.db'), poll_interval=3600, **kwargs)
+    journal.start = lambda: None
+    return journal
+
+
+def _status(journal, intake_id):
+    return journal._conn().execute("SELECT status, last_error FROM intake WHERE id=?", (intake_id,)).fetchone()
+
+
+def test_error_permanente_pasa_a_fallida(tmp_path, monkeypatch):
+    journal = _journal(tmp_path)
+    intake_id = journal.submit(dict(RECORD, usuario_id=None))
+    journal.drain_once()
+    status, error = _status(journal, intake_id)
+    assert status == 'fallida' and 'usuario_id' in error
+    stats = journal.stats()
+    assert stats['fallida'] == 1 and stats['oldest_pending_seconds'] == 0
+    assert journal.failed()[0]['id'] == intake_id
+
+
+def test_error_transitorio_agota_los_intentos(tmp_path, monkeypatch):
+    journal = _journal(tmp_path, max_attempts=3)
+    intake_id = journal.submit(RECORD)
+    monkeypatch.setattr(db, 'insert_emergencia_batch', lambda records: {
+        'ids': [None] * len(records), 'errors': [{'index': 0, 'error': 'sin conexión'}], 'aborted': True,
+    })
+    statuses = []
+    for _ in range(3):
+        journal._conn().execute("UPDATE intake SET next_attempt=0")
+        journal.drain_once()
+        statuses.append(_status(journal, intake_id)[0])
+    assert statuses == ['pendiente', 'pendiente', 'fallida']
+
+
+def test_mark_deshace_la_transaccion_si_falla(tmp_path):
+    journal = _journal(tmp_path)
+    intake_id = journal.submit(RECORD)
+    assert journal._claim()
+    # Un valor que sqlite3 no sabe adaptar hace fallar el executemany dentro de la transacción.
+    try:
+        journal._mark(done=[(object(), intake_id)])
+    except sqlite3.Error:
+        pass
+    else:
+        raise AssertionError("se esperaba un error")
+    assert not journal._conn().in_transaction
+    journal._conn().execute("UPDATE intake SET status='pendiente'")
+    assert journal.drain_once() == 1
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import db
+import passwords
+from passwords import PasswordHasher
+
+
+def _romper(hasher):
+    """Mata los procesos del pool actual, dejándolo en estado BrokenProcessPool."""
+    executor = hasher._get_executor()
+    executor.submit(os._exit, 1)
+    with pytest.raises(Exception):
+        executor.submit(abs, 1).result(timeout=10)
+    return executor
+
+
+def test_pool_roto_se_reemplaza(monkeypatch):
+    monkeypatch.setenv('PASSWORD_ALGORITHM', 'pbkdf2_sha256')
+    monkeypatch.setenv('PASSWORD_ITERATIONS', '1000')
+    hasher = PasswordHasher(workers=1)
+    try:
+        stored = hasher.hash('secreto')
+        roto = _romper(hasher)
+        assert hasher.verify('secreto', stored)
+        assert not hasher.verify('otra', stored)
+        assert hasher._executor is not roto
+    finally:
+        hasher.shutdown()
+
+
+def test_verify_password_no_oculta_errores_del_pool(monkeypatch):
+    monkeypatch.setenv('PASSWORD_ALGORITHM', 'pbkdf2_sha256')
+    monkeypatch.setenv('PASSWORD_ITERATIONS', '1000')
+    hasher = PasswordHasher(workers=1)
+    stored = hasher.hash('secreto')
+
+    def roto(*args):
+        raise passwords.BrokenProcessPool('pool caído')
+
+    monkeypatch.setattr(hasher, '_run', roto)
+    monkeypatch.setattr(db, 'get_hasher', lambda: hasher)
+    with pytest.raises(passwords.BrokenProcessPool):
+        db.verify_password('secreto', stored)
+    assert not db.verify_password('secreto', 'basura')
+    hasher.shutdown()
@@ -0,0 +1,33 @@
+import db
+from triage import TriageQueue
+
+
+def _emergencia(prioridad='alta'):
+    return db.insert_emergencia(1, 1, 1, '2026-10-18 10:00:00', 1, 'reportada', 'Calle 1', None, None,
+                                'Prueba de triaje', prioridad, None, None, None)
+
+
+def test_actualizar_dos_veces_sin_cambiar_prioridad():
+    q = TriageQueue()
+    q.top(5)
+    emergencia_id = _emergencia()
+    event = {'tipo': 'emergencia_actualizada', 'data': {
+        'idEmergencia': emergencia_id, 'estado': 'reportada', 'prioridad': 'alta',
+        'fechaHora': '2026-10-18 10:00:00', 'tipoEmergencia': 1,
+    }}
+    q.on_event(dict(event, tipo='emergencia_creada'))
+    # Dos actualizaciones con la misma clave dejan copias obsoletas empatadas en el montículo.
+    q.on_event(event)
+    q.on_event(event)
+
+    top = q.top(5)
+    assert [item['idEmergencia'] for item in top].count(emergencia_id) == 1
+
+
+def test_releer_pendientes_con_la_misma_clave():
+    q = TriageQueue()
+    emergencia_id = _emergencia('media')
+    q.top(5)
+    for _ in range(2):
+        q.on_event({'tipo': 'estado_cambiado', 'data': {'idEmergencia': emergencia_id}})
+        assert emergencia_id in [item['idEmergencia'] for item in q.top(50)]
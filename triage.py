@@ -0,0 +1,259 @@
+"""Cola de triaje en memoria: emergencias pendientes de despacho por prioridad.
+
+Las emergencias en estado 'reportada' se ordenan por la mayor de dos
+prioridades (la de la emergencia y el `nivelPrioridadTipoEmergencia_3` de su
+tipo), después por la suma de ambas y, a igualdad, por antigüedad. La cola es
+un montículo (`heapq`) con borrado perezoso: consultar la siguiente emergencia
+cuesta O(log n) amortizado y las `n` primeras O(n log N), sin ordenar toda la
+tabla en cada petición.
+
+Se mantiene al día con los eventos de `events.bus` (altas, cambios y bajas de
+este proceso y altas vistas por su sondeo). Los cambios de estado registrados
+solo en el historial marcan la emergencia para releerla, en lote, en la
+siguiente consulta. La cola se reconstruye si cambia algún tipo de emergencia
+y cada `TRIAGE_RESYNC_SECONDS` segundos, para incorporar lo modificado por
+otros procesos.
+
+Variables de entorno:
+TRIAGE_RESYNC_SECONDS, TRIAGE_TOP_MAX
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+
+import db
+import events
+
+
+PENDIENTE = 'reportada'
+NIVELES = {'baja': 1, 'media': 2, 'alta': 3, 'critica': 4}
+_NOMBRES = {nivel: nombre for nombre, nivel in NIVELES.items()}
+# Eventos que afectan a la cola (otros, como los de despacho, también traen `idEmergencia`).
+_EVENTOS = ('emergencia_creada', 'emergencia_actualizada', 'estado_cambiado', 'emergencia_eliminada')
+
+TOP_MAX = int(os.getenv('TRIAGE_TOP_MAX', '100'))
+
+
+def _nivel(value):
+    return NIVELES.get((value or '').strip().lower(), 0)
+
+
+def _timestamp(value):
+    """Segundos desde la época; las fechas desconocidas quedan al final."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return float('inf')
+
+
+class TriageQueue:
+    """Montículo de emergencias pendientes con índice por id y borrado perezoso."""
+
+    def __init__(self, resync=60.0):
+        self.resync = float(resync)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._heap = []
+        # Entradas `[clave, orden, item]`: `orden` desempata las copias obsoletas
+        # de una misma emergencia (misma clave), así nunca se compara `item`.
+        self._orden = itertools.count()
+        self._entries = {}
+        self._dirty = set()
+        self._touched = None
+        self._tipos = {}
+        self._tipos_version = None
+        self._loaded_at = None
+
+    # -- mantenimiento -------------------------------------------------
+
+    def _key(self, item):
+        nivel = item['nivel']
+        return (-nivel, -(item['nivelEmergencia'] + item['nivelTipo']), _timestamp(item['fechaHora']), item['idEmergencia'])
+
+    def _item(self, data):
+        tipo = data.get('tipoEmergencia')
+        nivel_emergencia = _nivel(data.get('prioridad'))
+        nivel_tipo = self._tipos.get(tipo, 0)
+        return {
+            'idEmergencia': data['idEmergencia'],
+            'tipoEmergencia': tipo,
+            'prioridad': data.get('prioridad'),
+            'prioridadTipo': _NOMBRES.get(nivel_tipo),
+            'nivelEmergencia': nivel_emergencia,
+            'nivelTipo': nivel_tipo,
+            'nivel': max(nivel_emergencia, nivel_tipo),
+            'fechaHora': data.get('fechaHora'),
+            'ubicacion': data.get('ubicacion'),
+            'usuario': data.get('usuario'),
+        }
+
+    def _discard(self, emergencia_id):
+        entry = self._entries.pop(emergencia_id, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def _apply(self, data):
+        """Inserta, mueve o quita una emergencia según su estado. Requiere el candado."""
+        emergencia_id = data['idEmergencia']
+        self._discard(emergencia_id)
+        if data.get('estado') != PENDIENTE:
+            return
+        item = self._item(data)
+        entry = [self._key(item), next(self._orden), item]
+        self._entries[emergencia_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _compact(self):
+        # Las entradas obsoletas se quitan al llegar a la cima; si se acumulan
+        # demasiadas (muchos cambios sin consultas) se rehace el montículo.
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def on_event(self, event):
+        """Oyente de `events.bus`: aplica el evento sin consultar la base de datos."""
+        data = event.get('data') or {}
+        emergencia_id = data.get('idEmergencia')
+        tipo = event.get('tipo')
+        # Un id en `_touched` no se relee en `_refresh_dirty`: solo deben
+        # entrar los eventos que la cola aplica o marca para releer.
+        if emergencia_id is None or tipo not in _EVENTOS:
+            return
+        with self._lock:
+            if self._touched is not None:
+                self._touched.add(emergencia_id)
+            if self._loaded_at is None:
+                return
+            if tipo == 'emergencia_eliminada':
+                self._discard(emergencia_id)
+                self._dirty.discard(emergencia_id)
+            elif tipo in ('emergencia_creada', 'emergencia_actualizada') and data.get('tipoEmergencia') is not None:
+                self._apply(data)
+                self._dirty.discard(emergencia_id)
+            elif tipo in ('emergencia_creada', 'emergencia_actualizada', 'estado_cambiado'):
+                self._dirty.add(emergencia_id)
+            self._compact()
+
+    def _load_tipos(self):
+        versions, _ = db.table_versions('tbtipoemergencia')
+        tipos = {t['idTipoEmergencia']: _nivel(t.get('nivelPrioridadTipoEmergencia_3')) for t in db.get_all_tipoemergencia()}
+        return versions, tipos
+
+    def rebuild(self):
+        """Relee todas las emergencias pendientes y rehace el montículo en O(n)."""
+        with self._lock:
+            self._touched = set()
+        try:
+            versions, tipos = self._load_tipos()
+            rows = db.get_emergencias_pendientes()
+        except Exception:
+            with self._lock:
+                self._touched = None
+            raise
+        with self._lock:
+            self._tipos, self._tipos_version = tipos, versions
+            self._entries = {}
+            for row in rows:
+                item = self._item(events.emergencia_event(row))
+                self._entries[item['idEmergencia']] = [self._key(item), next(self._orden), item]
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+            # Lo que cambió mientras se leía la tabla se relee en la próxima consulta.
+            self._dirty = self._touched
+            self._touched = None
+            self._loaded_at = time.monotonic()
+
+    def _refresh_dirty(self):
+        with self._lock:
+            ids, self._dirty = self._dirty, set()
+            self._touched = set()
+        try:
+            rows = db.get_emergencias_pendientes(ids)
+        except Exception:
+            with self._lock:
+                self._dirty |= ids
+                self._touched = None
+            raise
+        with self._lock:
+            touched, self._touched = self._touched, None
+            found = set()
+            for row in rows:
+                found.add(row['idEmergencia'])
+                if row['idEmergencia'] not in touched:
+                    self._apply(events.emergencia_event(row))
+            for emergencia_id in ids - found - touched:
+                self._discard(emergencia_id)
+            self._compact()
+
+    def _ensure(self):
+        # Un solo hilo recarga; los demás esperan y leen el resultado.
+        with self._refresh_lock:
+            with self._lock:
+                loaded_at, dirty = self._loaded_at, bool(self._dirty)
+            stale = loaded_at is None or (self.resync > 0 and time.monotonic() - loaded_at > self.resync)
+            if not stale and db.table_versions('tbtipoemergencia')[0] != self._tipos_version:
+                stale = True
+            if stale:
+                self.rebuild()
+            elif dirty:
+                self._refresh_dirty()
+
+    # -- consultas -----------------------------------------------------
+
+    def _prune(self):
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+
+    def next(self):
+        """La emergencia que toca despachar (dict) o None si no hay pendientes."""
+        self._ensure()
+        with self._lock:
+            self._prune()
+            return dict(self._heap[0][-1]) if self._heap else None
+
+    def top(self, n=10):
+        """Las `n` primeras emergencias en orden de despacho."""
+        self._ensure()
+        with self._lock:
+            taken = []
+            while self._heap and len(taken) < n:
+                entry = heapq.heappop(self._heap)
+                if entry[-1] is not None:
+                    taken.append(entry)
+            for entry in taken:
+                heapq.heappush(self._heap, entry)
+            return [dict(entry[-1]) for entry in taken]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pendientes': len(self._entries),
+                'heap': len(self._heap),
+                'por_releer': len(self._dirty),
+                'cargada': self._loaded_at is not None,
+            }
+
+
+queue = TriageQueue(resync=float(os.getenv('TRIAGE_RESYNC_SECONDS', '60')))
+events.bus.add_listener(queue.on_event)
+
+
+def siguiente():
+    """Atajo a `queue.next()`."""
+    return queue.next()
+
+
+def top(n=10):
+    """Atajo a `queue.top(n)`, limitado a `TRIAGE_TOP_MAX`."""
+    return queue.top(max(1, min(int(n), TOP_MAX)))
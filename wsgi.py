@@ -0,0 +1,216 @@
+"""Punto de entrada de producción.
+
+`application` es la aplicación Flask ya importada, para cualquier servidor WSGI.
+`python wsgi.py` la sirve con el mejor servidor disponible:
+
+- gunicorn (Linux/macOS): varios procesos con hilos (`gthread`), aplicación
+  precargada en el proceso maestro, calentamiento en cada worker antes de
+  aceptar tráfico, reciclaje gradual tras `WSGI_MAX_REQUESTS` peticiones
+  (con variación aleatoria para que no se reinicien todos a la vez) y
+  `kill -HUP` para recargar sin cortar conexiones.
+- waitress (también Windows): un proceso con `WSGI_THREADS` hilos; el hash de
+  contraseñas ya se reparte entre núcleos con su propio pool de procesos.
+- Si no hay ninguno instalado, el servidor de Werkzeug con hilos y sin
+  depurador (aviso por stderr).
+
+Ningún servidor corta una petición lenta: `WSGI_TIMEOUT` es, en gunicorn, el
+plazo del latido del worker (el maestro reinicia un worker colgado) y, en
+waitress, el de una conexión inactiva. El límite por petición se pone donde se
+va el tiempo: cada lectura de MySQL se interrumpe tras `DB_STATEMENT_TIMEOUT`
+segundos (30 por defecto aquí, ver `db.statement_timeout`) y la petición
+termina con error en lugar de ocupar el hilo. Cada consola de `/eventos/emergencias` ocupa un
+hilo mientras está conectada, así que con gunicorn y waitress las consolas
+por proceso se limitan a la mitad de `WSGI_THREADS` (ver `limit_subscribers`).
+
+Variables de entorno (las opciones de línea de comandos tienen prioridad):
+WSGI_SERVER, WSGI_HOST, WSGI_PORT, WSGI_WORKERS, WSGI_THREADS, WSGI_TIMEOUT,
+WSGI_GRACEFUL_TIMEOUT, WSGI_MAX_REQUESTS, WSGI_MAX_REQUESTS_JITTER, WSGI_WARMUP,
+DB_STATEMENT_TIMEOUT
+"""
+import argparse
+import os
+import sys
+import time
+
+from app import app
+import db
+import events
+from intake import get_journal
+from passwords import get_hasher
+
+
+application = app
+
+
+def warm_up():
+    """Prepara el proceso antes de servir: conexiones, cachés, plantillas y drenador.
+
+    Los fallos de base de datos no impiden arrancar: las solicitudes de ayuda
+    quedan en el diario de entrada hasta que MySQL responda.
+    """
+    started = time.perf_counter()
+    try:
+        connections = [db.get_connection() for _ in range(int(os.getenv('DB_POOL_SIZE', '5')))]
+        for conn in connections:
+            conn.close()
+        db.get_all_tipoemergencia()
+        db.get_all_servicioemergencia()
+        db.get_all_contactoemergencia()
+        db.get_nearest_servicioemergencia(0.0, 0.0, 1)
+    except Exception as e:
+        sys.stderr.write(f"wsgi: calentamiento de base de datos incompleto: {e}\n")
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    get_hasher().warm_up()
+    get_journal().start()
+    sys.stderr.write(f"wsgi: proceso {os.getpid()} listo en {time.perf_counter() - started:.2f}s\n")
+
+
+def shutdown():
+    """Libera los recursos del proceso al terminar un worker."""
+    get_journal().stop()
+    db.dispose_pool()
+    get_hasher().shutdown()
+
+
+def limit_subscribers(threads):
+    """Deja hilos libres para las peticiones normales: como mucho la mitad para consolas SSE."""
+    limit = max(threads // 2, 1)
+    if not events.MAX_SUBSCRIBERS or events.MAX_SUBSCRIBERS > limit:
+        sys.stderr.write(f"wsgi: consolas de eventos limitadas a {limit} por proceso ({threads} hilos)\n")
+        events.MAX_SUBSCRIBERS = limit
+
+
+def _run_gunicorn(options):
+    from gunicorn.app.base import BaseApplication
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    _Application().run()
+
+
+def _gunicorn_options(args):
+    def post_fork(server, worker):
+        # Cada worker calienta su propio pool tras el fork: las conexiones y los
+        # hilos del maestro no se heredan de forma segura.
+        if args.warmup:
+            warm_up()
+        else:
+            get_journal().start()
+
+    def worker_exit(server, worker):
+        shutdown()
+
+    return {
+        'bind': f'{args.host}:{args.port}',
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+
+
+def _run_waitress(args):
+    import waitress
+
+    if args.warmup:
+        warm_up()
+    else:
+        get_journal().start()
+    try:
+        waitress.serve(application, host=args.host, port=args.port, threads=args.threads,
+                       channel_timeout=args.timeout, ident='AppEmergencia')
+    finally:
+        shutdown()
+
+
+def _run_werkzeug(args):
+    from werkzeug.serving import run_simple
+
+    sys.stderr.write("wsgi: ni gunicorn ni waitress están instalados; se usa el servidor de Werkzeug "
+                     "(un proceso, sin límite de tiempo por petición). Instala waitress o gunicorn.\n")
+    if args.warmup:
+        warm_up()
+    else:
+        get_journal().start()
+    try:
+        run_simple(args.host, args.port, application, threaded=True,
+                   use_debugger=False, use_reloader=False)
+    finally:
+        shutdown()
+
+
+def _available(module):
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def choose_server(name):
+    """Resuelve `auto` al mejor servidor instalado para esta plataforma."""
+    if name != 'auto':
+        return name
+    if os.name != 'nt' and _available('gunicorn'):
+        return 'gunicorn'
+    if _available('waitress'):
+        return 'waitress'
+    return 'werkzeug'
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Servidor de producción de AppEmergencia.")
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'waitress', 'werkzeug'),
+                        default=os.getenv('WSGI_SERVER', 'auto'))
+    parser.add_argument('--host', default=os.getenv('WSGI_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('WSGI_PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WSGI_WORKERS', str(cpus))),
+                        help="Procesos (solo gunicorn)")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WSGI_THREADS', '8')),
+                        help="Hilos por proceso")
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('WSGI_TIMEOUT', '30')),
+                        help="Latido del worker (gunicorn) o conexión inactiva (waitress); no limita cada petición")
+    parser.add_argument('--statement-timeout', type=float,
+                        default=float(os.getenv('DB_STATEMENT_TIMEOUT', '30')),
+                        help="Segundos máximos por lectura de MySQL (0 = sin límite)")
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.getenv('WSGI_GRACEFUL_TIMEOUT', '30')),
+                        help="Segundos para terminar las peticiones en curso al reciclar un worker")
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('WSGI_MAX_REQUESTS', '5000')),
+                        help="Peticiones tras las que se recicla un worker (0 = nunca)")
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=int(os.getenv('WSGI_MAX_REQUESTS_JITTER', '500')))
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false',
+                        default=os.getenv('WSGI_WARMUP', '1') not in ('0', 'false', 'False'))
+    args = parser.parse_args(argv)
+    # Antes de abrir conexiones: los workers de gunicorn heredan el entorno del maestro.
+    os.environ['DB_STATEMENT_TIMEOUT'] = str(args.statement_timeout)
+
+    server = choose_server(args.server)
+    sys.stderr.write(f"wsgi: sirviendo en http://{args.host}:{args.port} con {server}\n")
+    if server in ('gunicorn', 'waitress'):
+        limit_subscribers(args.threads)
+    if server == 'gunicorn':
+        _run_gunicorn(_gunicorn_options(args))
+    elif server == 'waitress':
+        _run_waitress(args)
+    else:
+        _run_werkzeug(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())